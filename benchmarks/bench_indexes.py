@@ -0,0 +1,111 @@
+"""
+script: benchmarks/bench_indexes.py
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This script builds a synthetic SQLite database with the repository's
+    parametric schema and times representative queries before and after installing
+    the secondary indexes in `sqlite/indexes/create_indexes.sql`.
+
+    Queries timed:
+     - preferred origin + phase arrival join for a batch of EVIDs
+       (as in :meth:`~sqlite.query_helpers.select_preferred_origins`)
+     - unassociated arrivals for one station (as in `ingest_assoc_ver_3.py`)
+     - arrivals for one station in a 1-day time window
+
+usage: python benchmarks/bench_indexes.py [n_events] [picks_per_event]
+"""
+
+import sys, os, time, tempfile
+import sqlite3
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).parent.parent
+SCHEMA = ROOT/'sqlite'/'schema'
+INDEXES = ROOT/'sqlite'/'indexes'/'create_indexes.sql'
+
+NEVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+NPICKS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+NSTA = 200
+NREPEAT = 5
+TABLES = ['EVENT', 'ORIGIN', 'ASSOCARO', 'ARRIVAL', 'NETMAG']
+
+QUERIES = {
+    'preferred origins + arrivals (100 evids)': """
+        SELECT e.evid, o.orid, o.datetime, a.arid, a.datetime, a.net, a.sta, a.iphase
+        FROM event e
+            INNER JOIN origin o ON e.prefor = o.orid
+            INNER JOIN assocaro x ON o.orid = x.orid
+            INNER JOIN arrival a ON x.arid = a.arid
+        WHERE e.evid IN ({evids});""",
+    'unassociated arrivals for one station': """
+        SELECT a.arid, a.datetime, a.iphase FROM arrival a
+            LEFT JOIN assocaro x ON a.arid = x.arid
+        WHERE x.orid IS NULL AND a.net = 'XX' AND a.sta = 'S{sta:03d}'
+        ORDER BY a.datetime;""",
+    'station arrivals in a 1-day window': """
+        SELECT arid, datetime FROM arrival
+        WHERE net = 'XX' AND sta = 'S{sta:03d}' AND datetime BETWEEN {t0} AND {t0} + 86400;""",
+}
+
+
+def populate(conn, rng):
+    """Fill EVENT, ORIGIN, ASSOCARO and ARRIVAL with synthetic rows"""
+    evid = np.arange(1, NEVENTS + 1)
+    otime = np.sort(rng.uniform(1.3e9, 1.45e9, NEVENTS))
+    conn.executemany("INSERT INTO event (evid, prefor, auth, etype) VALUES (?, ?, 'XX', 'eq');",
+                     zip(evid.tolist(), (evid*10).tolist()))
+    conn.executemany("INSERT INTO origin (orid, evid, datetime, lat, lon, depth, auth) VALUES (?, ?, ?, ?, ?, ?, 'XX');",
+                     zip((evid*10).tolist(), evid.tolist(), otime.tolist(),
+                         rng.uniform(40, 50, NEVENTS).tolist(), rng.uniform(-130, -120, NEVENTS).tolist(),
+                         rng.uniform(0, 30, NEVENTS).tolist()))
+    npick = NEVENTS*NPICKS
+    arid = np.arange(1, npick + 1)
+    a_evid = np.repeat(evid, NPICKS)
+    atime = np.repeat(otime, NPICKS) + rng.uniform(1, 60, npick)
+    sta = rng.integers(0, NSTA, npick)
+    conn.executemany("INSERT INTO arrival (arid, datetime, net, sta, iphase, auth) VALUES (?, ?, 'XX', ?, ?, 'XX');",
+                     zip(arid.tolist(), atime.tolist(), [f'S{_s:03d}' for _s in sta],
+                         np.where(rng.random(npick) < 0.5, 'P', 'S').tolist()))
+    # Associate ~80% of arrivals
+    assoc = rng.random(npick) < 0.8
+    conn.executemany("INSERT INTO assocaro (orid, arid, auth) VALUES (?, ?, 'XX');",
+                     zip((a_evid[assoc]*10).tolist(), arid[assoc].tolist()))
+    conn.commit()
+    return otime
+
+
+def time_queries(conn, rng, otime):
+    """Return the median wall time (s) of each query over NREPEAT randomized runs"""
+    results = {}
+    for label, template in QUERIES.items():
+        times = []
+        for _ in range(NREPEAT):
+            sql = template.format(evids=','.join(map(str, rng.integers(1, NEVENTS + 1, 100))),
+                                  sta=int(rng.integers(0, NSTA)),
+                                  t0=float(rng.choice(otime)))
+            tick = time.perf_counter()
+            conn.execute(sql).fetchall()
+            times.append(time.perf_counter() - tick)
+        results[label] = float(np.median(times))
+    return results
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(42)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = sqlite3.connect(os.path.join(tmpdir, 'bench.db'))
+        for _t in TABLES:
+            conn.executescript(open(SCHEMA/f'create_{_t}.sql', 'r').read())
+        print(f'Populating {NEVENTS} events with {NPICKS} picks each')
+        otime = populate(conn, rng)
+        before = time_queries(conn, rng, otime)
+        tick = time.perf_counter()
+        conn.executescript(open(INDEXES, 'r').read())
+        print(f'Index build + ANALYZE: {time.perf_counter() - tick:.2f} s')
+        after = time_queries(conn, rng, otime)
+        conn.close()
+    print(f"{'query':<45}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for label in QUERIES:
+        print(f'{label:<45}{before[label]*1e3:>14.2f}{after[label]*1e3:>14.2f}{before[label]/after[label]:>9.1f}x')
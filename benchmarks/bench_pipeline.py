@@ -0,0 +1,187 @@
+"""
+script: benchmarks/bench_pipeline.py
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This script times the repository's ingest, association, export, and query
+    paths end-to-end on a synthetic catalog (see `benchmarks/synthetic.py`) and
+    reports wall time, rows/sec, and peak resident set size (RSS) per stage.
+
+    With a PostgreSQL connection string (--dsn), a scratch database is created and
+    dropped afterwards, and the following stages are timed:
+     - pick ingest: :meth:`~postgresql.bulk.load_arrivals`
+     - catalog ingest: :meth:`~postgresql.catalog.load_catalog`
+     - association: :meth:`~postgresql.matching.fetch_unassociated_arrivals` +
+       :meth:`~postgresql.matching.match_arrivals` + ASSOCARO `COPY`
+     - export: :meth:`~sqlite.export.export_database` into a new SQLite file
+    Without --dsn, the synthetic catalog is written to SQLite directly. In both
+    cases :mod:`~sqlite.query_helpers` queries are then timed on the SQLite file.
+
+    Peak RSS is the process high-water mark after each stage, so a stage only
+    "uses" memory if it raises the value reported by the preceding stage.
+
+usage: python benchmarks/bench_pipeline.py [--events N] [--picks N] [--stations N]
+    [--dsn "host=localhost user=postgres"] [--json results.json]
+"""
+
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).parent.parent
+sys.path.append(str(ROOT/'src'))
+from sqlite.install import create_database
+from sqlite.query_helpers import (connect_to_database, gather_picks, select_origins_in_box,
+                                  select_preferred_origins)
+from sqlite.truetime import utc2dbtime_array
+from synthetic import generate_catalog, picks_from_catalog
+
+# Scratch PostgreSQL database name (dropped after the run)
+PGNAME = 'pg_anss_lite_bench'
+# Tables written to SQLite in the order of the export
+TABLES = ['event', 'origin', 'netmag', 'arrival', 'assocaro']
+NREPEAT = 20
+BATCH = 100
+
+RESULTS = []
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in kB on Linux)"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/1024**2 if sys.platform == 'darwin' else maxrss/1024
+
+
+@contextmanager
+def stage(name):
+    """Time a stage. The body sets `record['rows']` to the number of rows processed."""
+    record = {'stage': name, 'rows': 0}
+    tick = time.perf_counter()
+    yield record
+    record['seconds'] = time.perf_counter() - tick
+    record['rows_per_sec'] = record['rows']/record['seconds'] if record['seconds'] > 0 else np.nan
+    record['peak_rss_mb'] = peak_rss_mb()
+    RESULTS.append(record)
+    print(f"{name:<40}{record['rows']:>12d}{record['seconds']:>10.2f}"
+          f"{record['rows_per_sec']:>14.0f}{record['peak_rss_mb']:>12.0f}", flush=True)
+
+
+def run_postgresql(dsn, tables, picks, dbfile):
+    """Time ingest, association, and export against a scratch PostgreSQL database"""
+    import psycopg2
+    from postgresql.bulk import copy_chunks, load_arrivals
+    from postgresql.catalog import load_catalog
+    from postgresql.install import create_database as create_pg_database
+    from postgresql.install import install_schema
+    from postgresql.matching import fetch_unassociated_arrivals, match_arrivals
+    from sqlite.export import export_database
+
+    create_pg_database(PGNAME, dsn=dsn)
+    conn = psycopg2.connect(dsn, dbname=PGNAME)
+    try:
+        install_schema(conn)
+        with stage('pick ingest (load_arrivals)') as rec:
+            rec['rows'], _ = load_arrivals(conn, tables['arrival'], resume=False, progress=False)
+        with stage('catalog ingest (load_catalog)') as rec:
+            counts, _ = load_catalog(conn, {_t: tables[_t] for _t in ['origin', 'netmag', 'event']})
+            rec['rows'] = sum(counts.values())
+        with stage('association (match + COPY)') as rec:
+            arrivals = fetch_unassociated_arrivals(conn)
+            match = match_arrivals(picks, arrivals, tolerance=0.01)
+            ok = match.arid.notna().to_numpy()
+            assoc = picks[ok].assign(arid=match.arid[ok].astype(np.int64), auth='SY', rflag='A')
+            rec['rows'] = copy_chunks(conn, 'assocaro', assoc,
+                                      columns=['orid', 'arid', 'auth', 'iphase', 'timeres', 'rflag'],
+                                      progress=False)
+        with stage('export (PostgreSQL -> SQLite)') as rec:
+            conn_lite = create_database(dbfile, indexes=False, leap_seconds=False)
+            rec['rows'] = sum(export_database(conn, conn_lite, progress=False).values())
+            conn_lite.close()
+    finally:
+        conn.close()
+        admin = psycopg2.connect(dsn)
+        admin.autocommit = True
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {PGNAME};')
+        admin.close()
+
+
+def run_sqlite_load(tables, dbfile):
+    """Write the synthetic catalog straight into a new SQLite database"""
+    with stage('SQLite load (no PostgreSQL)') as rec:
+        conn_lite = create_database(dbfile, indexes=False)
+        for _t in TABLES:
+            df = tables[_t]
+            if 'datetime' in df.columns:
+                df = df.assign(datetime=utc2dbtime_array(df['datetime']))
+            # Schema table names are upper case (pandas matches names case-sensitively)
+            df.to_sql(_t.upper(), conn_lite, if_exists='append', index=False, chunksize=100000)
+            rec['rows'] += len(df)
+        conn_lite.commit()
+        conn_lite.executescript((ROOT/'sqlite'/'indexes'/'create_indexes.sql').read_text())
+        conn_lite.close()
+
+
+def run_queries(dbfile, tables, rng):
+    """Time query_helpers queries on the SQLite database"""
+    conn = connect_to_database(dbfile)
+    evids = tables['event'].evid.to_numpy()
+    otime = tables['origin'].datetime.to_numpy()
+    queries = {
+        f'select_preferred_origins ({BATCH} evids)':
+            lambda: select_preferred_origins(conn, rng.choice(evids, BATCH)),
+        '  + include_phases':
+            lambda: select_preferred_origins(conn, rng.choice(evids, BATCH), include_phases=True),
+        'select_origins_in_box (1x1 deg, 30 d)': lambda: _box(conn, rng, otime),
+        f'gather_picks ({BATCH} evids)':
+            lambda: gather_picks(conn, rng.choice(evids, BATCH))['time_ns'],
+    }
+    for label, query in queries.items():
+        with stage(label) as rec:
+            for _ in range(NREPEAT):
+                rec['rows'] += len(query())
+    conn.close()
+
+
+def _box(conn, rng, otime):
+    lat, lon, t0 = rng.uniform(40., 49.), rng.uniform(-130., -121.), rng.choice(otime)
+    return select_origins_in_box(conn, lat, lat + 1, lon, lon + 1, t0, t0 + 30*86400.)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--picks', type=int, default=20, help='picks per event')
+    parser.add_argument('--stations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dsn', default=None,
+                        help='libpq connection string for a user allowed to create databases')
+    parser.add_argument('--json', default=None, help='write results to this JSON file')
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'stage':<40}{'rows':>12}{'seconds':>10}{'rows/sec':>14}{'peak MB':>12}")
+    with stage('generate synthetic catalog') as rec:
+        tables = generate_catalog(args.events, picks_per_event=args.picks,
+                                  nstations=args.stations, seed=args.seed)
+        picks = picks_from_catalog(tables, seed=args.seed)
+        rec['rows'] = sum(len(tables[_t]) for _t in TABLES)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbfile = Path(tmpdir)/'bench.db'
+        if args.dsn:
+            run_postgresql(args.dsn, tables, picks, dbfile)
+        else:
+            run_sqlite_load(tables, dbfile)
+        run_queries(dbfile, tables, rng)
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump({'config': vars(args) | {'dsn': bool(args.dsn)}, 'results': RESULTS},
+                      _f, indent=2)
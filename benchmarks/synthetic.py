@@ -0,0 +1,174 @@
+"""
+module: benchmarks.synthetic
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module generates reproducible, synthetic ANSS parametric catalogs
+    (EVENT, ORIGIN, NETMAG, ARRIVAL, ASSOCARO) with realistic volumes and value
+    distributions, so that ingest, export, and query performance can be measured
+    without the (private) input files expected by the `example/cascadia` scripts.
+
+    - origin times are uniform over a time span, epicenters uniform in a
+      latitude/longitude box, and depths gamma distributed
+    - magnitudes follow a Gutenberg-Richter distribution (b-value 1) above a
+      magnitude of completeness
+    - each event is picked (P and S) on its nearest stations, with travel times from
+      constant P and S velocities plus Gaussian picking noise
+
+Note on time format
+ - datetime: ORIGIN and ARRIVAL `datetime` values are UTC (UNIX) epoch seconds, as
+    expected by :meth:`~postgresql.bulk.load_arrivals` and
+    :meth:`~postgresql.catalog.load_catalog`. Convert with
+    :meth:`~sqlite.truetime.utc2dbtime_array` before writing them to a database directly.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Network/author code used for all synthetic rows
+AUTH = 'SY'
+# Constant velocities (km/s) and picking noise (s) for synthetic travel times
+VP, VS, PICK_SIGMA = 6.0, 3.46, 0.05
+KM_PER_DEG = 111.19
+
+
+def generate_stations(nstations, bbox=(40., 50., -130., -120.), seed=0):
+    """Generate station codes and coordinates uniformly distributed in **bbox**
+
+    :param nstations: number of stations
+    :type nstations: int
+    :param bbox: (minlat, maxlat, minlon, maxlon) in degrees, defaults to Cascadia
+    :type bbox: tuple of float, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :return: stations with columns net, sta, lat, lon
+    :rtype: pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'net': AUTH,
+                         'sta': [f'S{_i:04d}' for _i in range(nstations)],
+                         'lat': rng.uniform(bbox[0], bbox[1], nstations),
+                         'lon': rng.uniform(bbox[2], bbox[3], nstations)})
+
+
+def _nearest_stations(lat, lon, stations, k, blocksize=10000):
+    """Indices (nevents, k) and epicentral distances (km) of the **k** nearest stations
+    to each epicenter, computed in blocks of events (equirectangular approximation)"""
+    slat = stations.lat.to_numpy()
+    slon = stations.lon.to_numpy()
+    index = np.empty((len(lat), k), dtype=np.int64)
+    dist = np.empty((len(lat), k))
+    for _i in range(0, len(lat), blocksize):
+        _lat = lat[_i:_i + blocksize, np.newaxis]
+        _lon = lon[_i:_i + blocksize, np.newaxis]
+        _dx = (slon[np.newaxis, :] - _lon)*np.cos(np.radians(_lat))
+        _d = np.hypot(slat[np.newaxis, :] - _lat, _dx)*KM_PER_DEG
+        _k = np.argpartition(_d, k - 1, axis=1)[:, :k]
+        index[_i:_i + blocksize] = _k
+        dist[_i:_i + blocksize] = np.take_along_axis(_d, _k, axis=1)
+    return index, dist
+
+
+def generate_catalog(nevents, picks_per_event=20, nstations=200, start='2010-01-01',
+                     end='2015-01-01', bbox=(40., 50., -130., -120.), mc=1.0, seed=0):
+    """Generate a synthetic catalog with phase arrivals and associations
+
+    IDs start at 1: EVID = i, ORID = MAGID = 10*i + 1, ARID = 1, 2, ... in event order.
+
+    :param nevents: number of events
+    :type nevents: int
+    :param picks_per_event: arrivals per event (P and S on the picks_per_event // 2
+        nearest stations, plus one P if odd), defaults to 20
+    :type picks_per_event: int, optional
+    :param nstations: number of stations, defaults to 200
+    :type nstations: int, optional
+    :param start: earliest UTC origin time, defaults to '2010-01-01'
+    :type start: str, optional
+    :param end: latest UTC origin time, defaults to '2015-01-01'
+    :type end: str, optional
+    :param bbox: (minlat, maxlat, minlon, maxlon) in degrees, defaults to Cascadia
+    :type bbox: tuple of float, optional
+    :param mc: magnitude of completeness, defaults to 1.0
+    :type mc: float, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :return: DataFrames keyed by table name ('event', 'origin', 'netmag', 'arrival',
+        'assocaro') using table column names, and 'stations'
+    :rtype: dict of pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    stations = generate_stations(nstations, bbox=bbox, seed=seed)
+    nsta_picked = min(nstations, (picks_per_event + 1)//2)
+    t0, t1 = (pd.Timestamp(_t).timestamp() for _t in (start, end))
+    evid = np.arange(1, nevents + 1, dtype=np.int64)
+    orid = 10*evid + 1
+    otime = np.sort(rng.uniform(t0, t1, nevents))
+    lat = rng.uniform(bbox[0], bbox[1], nevents)
+    lon = rng.uniform(bbox[2], bbox[3], nevents)
+    depth = np.clip(rng.gamma(2., 7.5, nevents), 0., 60.)
+    mag = np.round(mc + rng.exponential(1./np.log(10.), nevents), 2).clip(max=9.)
+    tables = {
+        'origin': pd.DataFrame({'orid': orid, 'evid': evid, 'prefmag': orid, 'datetime': otime,
+                                'lat': lat, 'lon': lon, 'depth': depth, 'type': 'H',
+                                'algorithm': 'SYNTH', 'auth': AUTH, 'subsource': 'synth',
+                                'gap': rng.uniform(30., 300., nevents),
+                                'wrms': rng.gamma(2., 0.05, nevents),
+                                'erhor': rng.gamma(2., 0.5, nevents),
+                                'sdep': rng.gamma(2., 1., nevents),
+                                'ndef': picks_per_event, 'rflag': 'F'}),
+        'netmag': pd.DataFrame({'magid': orid, 'orid': orid, 'magnitude': mag, 'magtype': 'l',
+                                'auth': AUTH, 'subsource': 'synth', 'nsta': nsta_picked,
+                                'uncertainty': rng.gamma(2., 0.05, nevents), 'rflag': 'F'}),
+        'event': pd.DataFrame({'evid': evid, 'prefor': orid, 'prefmag': orid, 'auth': AUTH,
+                               'subsource': 'synth', 'etype': 'eq', 'selectflag': 1,
+                               'version': 1}),
+    }
+    # Phase arrivals: P and S on the nearest stations, first picks_per_event per event
+    index, dist = _nearest_stations(lat, lon, stations, nsta_picked)
+    index = np.repeat(index, 2, axis=1)[:, :picks_per_event]
+    dist = np.repeat(dist, 2, axis=1)[:, :picks_per_event]
+    is_s = np.tile(np.arange(index.shape[1]) % 2 == 1, (nevents, 1))
+    hypo = np.hypot(dist, depth[:, np.newaxis])
+    npicks = index.size
+    timeres = rng.normal(0., PICK_SIGMA, npicks)
+    atime = (otime[:, np.newaxis] + hypo/np.where(is_s, VS, VP)).ravel() + timeres
+    arid = np.arange(1, npicks + 1, dtype=np.int64)
+    is_s = is_s.ravel()
+    iphase = np.where(is_s, 'S', 'P')
+    tables['arrival'] = pd.DataFrame({
+        'arid': arid, 'datetime': atime, 'sta': stations.sta.to_numpy()[index.ravel()],
+        'net': AUTH, 'auth': AUTH, 'subsource': 'synth',
+        'channel': np.where(is_s, 'HHN', 'HHZ'), 'seedchan': np.where(is_s, 'HHN', 'HHZ'),
+        'location': '--', 'iphase': iphase,
+        'qual': np.where(rng.random(npicks) < 0.7, 'i', 'e'),
+        'quality': rng.uniform(0.5, 1., npicks), 'snr': rng.gamma(2., 10., npicks) + 1.,
+        'rflag': 'A'})
+    tables['assocaro'] = pd.DataFrame({
+        'orid': np.repeat(orid, index.shape[1]), 'arid': arid, 'auth': AUTH,
+        'subsource': 'synth', 'iphase': iphase, 'delta': dist.ravel(),
+        'timeres': timeres, 'rflag': 'A'})
+    tables['stations'] = stations
+    return tables
+
+
+def picks_from_catalog(tables, jitter=0.001, seed=0):
+    """Build an association input (as read by `example/cascadia/ingest_assoc_ver_3.py`)
+    from a synthetic catalog: one pick per ASSOCARO row, with pick times offset from
+    their ARRIVAL times by up to **jitter** seconds
+
+    :param tables: synthetic catalog (see :meth:`~.generate_catalog`)
+    :type tables: dict of pandas.DataFrame
+    :param jitter: maximum absolute pick time offset in seconds, defaults to 0.001
+    :type jitter: float, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :return: picks with columns orid, net, sta, iphase, time (UTC epoch seconds), timeres
+    :rtype: pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    assoc = tables['assocaro'].merge(tables['arrival'][['arid', 'net', 'sta', 'datetime']],
+                                     on='arid')
+    return pd.DataFrame({'orid': assoc.orid, 'net': assoc.net, 'sta': assoc.sta,
+                         'iphase': assoc.iphase,
+                         'time': assoc.datetime + rng.uniform(-jitter, jitter, len(assoc)),
+                         'timeres': assoc.timeres})
@@ -10,101 +10,88 @@ purpose:
     If the SQLite database does not exist, it is created and populated with the AQMS schema tables used in
     this repository, minus the epochtimebase table schema.
 
+    Tables are streamed with server-side cursors and written with `executemany` in large transactions
+    (see :mod:`~sqlite.export`), so memory use stays flat regardless of table size.
+
+    If NWORKERS > 1, tables (and ARID-range partitions of ARRIVAL) are read concurrently on NWORKERS
+    PostgreSQL connections while this process writes to SQLite.
+
+    If the SQLite database already exists and INCREMENTAL is True, only rows that are new or changed
+    (by LDDATE / primary key) since the last run are transferred as upserts.
+
+    If PARQUET_DIR is set, each table is also written as a partitioned Parquet dataset with leap-second
+    corrected UTC times (see :mod:`~sqlite.parquet`).
+
+    Per-stage timings, row counts, and round trips are printed on exit and written to METRICS_DIR as
+    JSON and Prometheus text files (see :mod:`~sqlite.metrics`). Set PROFILER to 'cprofile' or
+    'pyinstrument' to profile each top-level stage.
+
 """
-import psycopg2, os, glob
-from sqlalchemy import create_engine, MetaData, Table, insert
+import os, sys
+import sqlite3
 from pathlib import Path
-import pandas as pd
-from tqdm import tqdm
+import psycopg2
 
 ROOT = Path(__file__).parent.parent.parent
 DBLITE = ROOT/'db'/'cascadia_obs2.db'
-SCHEMADIR = Path(__file__).parent/'schema'
-tables = ['event','origin','assocaro','netmag','remark','leap_seconds']
-# conn_lite = sqlite3.connect(str(DBLITE))
-
-if not os.path.isfile(DBLITE):
-    print('Creating SQLite database and initializing database schema')
-    for file in glob.glob(str(SCHEMADIR/'create_*.sql')):
-        cmd = f'sqlite3 {DBLITE} < {file}'
-        print(cmd)
-        os.system(cmd)
-
-print('Connecting to databases')
-engine = create_engine(f'sqlite:////{DBLITE}', echo=False)
-conn_pg = psycopg2.connect(host='localhost',port=5432,dbname='offshore_ml')
+sys.path.append(str(ROOT/'src'))
+from sqlite.export import export_database, export_database_parallel, sync_database
+from sqlite.install import create_database
+from sqlite.metrics import report_at_exit, set_profiler, stage
+from sqlite.parquet import export_parquet
 
-metadata = MetaData()
-
-for tname in tables:
-    print(f'Transferring table {tname}')
-    df = pd.read_sql(f'SELECT * FROM {tname};', con=conn_pg)
-    # Create SQLite/SQLalchemy table object for this table
-    table = Table(tname, metadata, autoload_with=engine)
-    with engine.connect() as conn:
-        insert_data = []
-        for _, row in tqdm(df.iterrows(), total=len(df)):
-            values = {_k.upper(): _v for _k, _v in row.items()}
-            insert_data.append(values)
-            # stmt = insert(table).values(**values)
-        conn.execute(insert(table), insert_data)
+tables = ['event','origin','assocaro','netmag','remark','leap_seconds','arrival']
+BATCHSIZE = 50000
+NWORKERS = 4
+INCREMENTAL = True
+# Set to None to skip the Parquet export
+PARQUET_DIR = ROOT/'db'/'cascadia_obs2_parquet'
+PGDB = {'host': 'localhost',
+        'port': 5432,
+        'dbname': 'offshore_ml'}
+METRICS_DIR = ROOT/'data'/'metrics'
+PROFILER = None
 
+set_profiler(PROFILER, outdir=METRICS_DIR/'profiles')
+report_at_exit('copy_to_sqlite', outdir=METRICS_DIR)
 
+exists = os.path.isfile(DBLITE)
+if not exists:
+    print('Creating SQLite database and initializing database schema')
+    # leap_seconds and secondary indexes are populated/built by the export itself
+    create_database(DBLITE, indexes=False, leap_seconds=False).close()
 
-with conn_pg.cursor() as cur:
-    cur.execute("SELECT MIN(arid), MAX(arid) FROM arrival;")
-    first_arid, last_arid = cur.fetchall()[0]
+print('Connecting to databases')
+conn_lite = sqlite3.connect(str(DBLITE))
 
-next_arid = first_arid - 1
-print("Transferring ARRIVAL in batch mode")
+if exists and INCREMENTAL:
+    print('Synchronizing tables')
+    conn_pg = psycopg2.connect(**PGDB)
+    with stage('sync'):
+        counts = sync_database(conn_pg, conn_lite, tables=tables, batchsize=BATCHSIZE)
+    for tname, nrows in counts.items():
+        print(f'{tname}: {nrows} rows upserted')
+    conn_pg.close()
+elif NWORKERS > 1:
+    print('Transferring tables')
+    with stage('export'):
+        stats = export_database_parallel(PGDB, conn_lite, tables=tables, nworkers=NWORKERS, batchsize=BATCHSIZE)
+    for tname, _s in stats.items():
+        print(f"{tname}: {_s['rows']} rows in {_s['seconds']:.1f} s ({_s['rows_per_sec']:.0f} rows/s)")
+else:
+    print('Transferring tables')
+    conn_pg = psycopg2.connect(**PGDB)
+    with stage('export'):
+        counts = export_database(conn_pg, conn_lite, tables=tables, batchsize=BATCHSIZE)
+    for tname, nrows in counts.items():
+        print(f'{tname}: {nrows} rows')
+    conn_pg.close()
 
-while True:
-    print(f'Batch starting after ARID {next_arid}')
-    df = pd.read_sql(f'SELECT * FROM arrival WHERE arid > {next_arid} ORDER BY arid LIMIT 100000;', con=conn_pg)
-    if len(df) > 0:
-        table = Table('arrival', metadata, autoload_with=engine)
-        with engine.connect() as conn:
-            insert_data = []
-            for _, row in tqdm(df.iterrows(), total=len(df)):
-                values = {_k.upper(): _v for _k, _v in row.items()}
-                insert_data.append(values)
-                
-            #    stmt = insert(table).values(**values)
-            conn.execute(insert(table), insert_data)  
-        next_arid = df.arid.max()
-    elif next_arid < last_arid:
-        next_arid += 1
-    else:
-        break          
-    #     # Replace table on first iteration
-    #     if first_time:
-    #         if_exists = 'replace'
-    #     # Append on all subsequent iterations
-    #     else:
-    #         if_exists = 'append'
-    #     df.to_sql('arrival', con=conn_lite, if_exists=if_exists, chunksize=10000)
-    #     next_arid = df.arid.max()
-    # # If it somehow gets hung, increment up (note - this SHOULD NOT HAPPEN)
-    # elif next_arid < last_arid:
-    #     next_arid += 1
-    # # If 
-    # else:
-    #     break
-        # for _, row in tqdm(df.iterrows(), total=len(df)):
-        #     table.insert(row.to_dict())
-        #     breakpoint()
-#         _sql = f"""
-#             INSERT INTO {tname} 
-#                 ({', '.join(list(row.index))}) 
-#             VALUES 
-#                 (:{', :'.join(list(row.index))});
-#                 """
-#         _var = row.to_dict()
-#         breakpoint()
-#         try:
-#             conn_lite.execute(text(_sql), _var)
-#         except:
-#             breakpoint()
-# #     .to_sql(tname, con=conn_lite, if_exists='replace', chunksize=10000)
+if PARQUET_DIR is not None:
+    print(f'Writing Parquet datasets to {PARQUET_DIR}')
+    with stage('parquet'):
+        counts = export_parquet(conn_lite, PARQUET_DIR, tables=tables)
+    for tname, nrows in counts.items():
+        print(f'{tname}: {nrows} rows')
 
-    
\ No newline at end of file
+conn_lite.close()
@@ -26,88 +26,123 @@ Notes on alterations to data to fit the ANSS ARRIVAL table schema
          - For missing max_prob, a uniform value of 0.01 is used
          - For max_prob = 'inf', a uniform value of 0.0 is used
 
+Notes on loading
+ - The pick file is streamed in chunks of CHUNKSIZE rows with compact dtypes
+   (PICK_DTYPES), dropping rows that duplicate an earlier row of the file as it goes
+   (see :meth:`~sqlite.readers.iter_csv_chunks`), so memory use is bounded by the
+   chunk size rather than the file size.
+ - Picks are converted and loaded in bulk using :meth:`~postgresql.bulk.load_arrivals`,
+   which converts pick times to database time client-side and streams rows to the
+   database with `COPY` in chunks of CHUNKSIZE rows (one transaction per chunk).
+   Re-running this script skips picks at or below the largest ARID present in the
+   database when it starts.
+ - Picks that would violate an ARRIVAL constraint (e.g., an unparseable pick time or a
+   negative `deltim`) are written to REJECTED_CSV instead of stopping the load.
+ - If NWRITERS > 1, picks are formatted chunk by chunk while previous chunks are sent
+   on NWRITERS concurrent connections (see :mod:`~postgresql.pipeline`). Re-running
+   this script skips ARIDs already present in the database.
+ - Per-stage timings, row counts, round trips, and bytes sent are printed on exit and
+   written to METRICS_DIR as JSON and Prometheus text files (see :mod:`~sqlite.metrics`).
+   Set PROFILER to 'cprofile' or 'pyinstrument' to profile each top-level stage.
+
          
 CISN/ANSS Parametric Schema Documentation:
    https://ncedc.org/db/Documents/NewSchemas/PI/v1.6.4/PI.1.6.4/index.htm
 
 """
 
+import sys
 from pathlib import Path
 from getpass import getpass
 import psycopg2
 import pandas as pd
-from obspy import UTCDateTime
-from tqdm import tqdm
 import numpy as np
 
 ROOT = Path(__file__).parent.parent.parent
 DATA_DIR = ROOT/'data'/'cascadia'
+REJECTED_CSV = DATA_DIR/'rejected_all_picks.csv'
+sys.path.append(str(ROOT/'src'))
+from postgresql.bulk import get_max_key, load_arrivals
+from postgresql.pipeline import load_arrivals_pipelined
+from sqlite.metrics import count, report_at_exit, set_profiler, stage
+from sqlite.readers import iter_csv_chunks
+from sqlite.timeparse import duration_seconds, iso_to_ns, ns_to_datetime64
 
 PGDB = {'host':'localhost',
         'port': '5432',
         'dbname': 'offshore_ml'}
+CHUNKSIZE = 100000
+# Repeated codes as categoricals, pick probabilities (quality) as float32
+PICK_DTYPES = {'network': 'category',
+               'station': 'category',
+               'band_inst': 'category',
+               'label': 'category',
+               'max_prob': 'float32'}
+# Concurrent database writers (1: format everything, then load serially)
+NWRITERS = 4
+METRICS_DIR = ROOT/'data'/'metrics'
+PROFILER = None
 
-print('Provide user name for "offshore_ml" database:')
-user = input()
-conn = psycopg2.connect(**PGDB, user=user, password=getpass(f'Provide password for database user {user}: '))
-print('LOADING BIG PICK FILE')
-df_picks_all = pd.read_csv(DATA_DIR/'all_picks_all_regions_2010_2015_ver3.csv', index_col=[0])
-print('DROPPING DUPLICATE ENTRIES')
-pre_len = len(df_picks_all)
-df_picks_all.drop_duplicates(keep='first', inplace=True)
+set_profiler(PROFILER, outdir=METRICS_DIR/'profiles')
+report_at_exit('ingest_all_picks', outdir=METRICS_DIR)
 
-cur = conn.cursor()
-arid_base = 9000000000
-cur.execute("SELECT max(arid) FROM arrival;")
-last_arid = cur.fetchall()[0][0]
-if last_arid is None:
-    last_arid = arid_base - 1
-else:
-    df_picks_all = df_picks_all[df_picks_all.index > last_arid - arid_base]
+ARID_BASE = 9000000000
 
-print("SENDING TO DATABASE")
-for arid, row in tqdm(df_picks_all.iterrows(), total=len(df_picks_all)):
-    if arid + arid_base <= last_arid:
-        continue
-    sql = """
-        INSERT INTO arrival 
-            (arid, datetime, net, sta, seedchan, iphase, quality, deltim, auth, subsource, rflag) 
-        VALUES 
-            (%(arid)s, TrueTime.putEpoch(%(pick_time)s, 'UNIX'), %(network)s, 
-             %(station)s, %(seedchan)s, %(label)s, %(quality)s, 
-             %(deltim)s, 'UW', 'ELEP', 'A');
-        """
-    var = row.to_dict()
-    if isinstance(row.band_inst, str):
-        seedchan = row.band_inst + '?'
-    else:
-        seedchan = None
 
-    if isinstance(row.trigger_onset, str) and isinstance(row.trigger_offset, str):
-        deltim = UTCDateTime(row.trigger_offset) - UTCDateTime(row.trigger_onset)
-    else:
-        deltim = None
+def format_arrivals(df):
+    """Map SeisBench/ELEP pick rows onto ARRIVAL columns"""
+    with stage('format.arrivals', rows=len(df)):
+        # Trigger durations where both onset and offset are documented
+        onset = iso_to_ns(df.trigger_onset)
+        offset = iso_to_ns(df.trigger_offset)
+        # Missing max_prob -> 0.01, max_prob = inf -> 0.0
+        max_prob = df.max_prob.to_numpy(dtype=float)
+        quality = np.where(np.isfinite(max_prob), max_prob,
+                           np.where(max_prob == np.inf, 0.0, 0.01))
+        return pd.DataFrame({
+            'arid': ARID_BASE + df.index.to_numpy(dtype=np.int64),
+            'datetime': ns_to_datetime64(iso_to_ns(df.pick_time.to_numpy())),
+            'net': df.network.to_numpy(),
+            'sta': df.station.to_numpy(),
+            'seedchan': (df.band_inst.astype('string') + '?').to_numpy(),
+            'iphase': df.label.to_numpy(),
+            'quality': quality,
+            'deltim': duration_seconds(onset.to_numpy(), offset.to_numpy()),
+            'auth': 'UW',
+            'subsource': 'ELEP',
+            'rflag': 'A'})
 
-    if not np.isfinite(row.max_prob):
-        if row.max_prob == float('inf'):
-            quality = 0.0
-        else:
-            quality = 0.01
-    else:
-        quality = row.max_prob
 
-    var.update({'arid': arid_base + arid,
-                'seedchan': seedchan,
-                'pick_time': UTCDateTime(row.pick_time).timestamp,
-                'deltim': deltim,
-                'quality': quality})
-    
-    # if not np.isfinite(var['max_prob']):
-        # var['max_prob'] = 
-    try:
-        cur.execute(sql, var)
-    except psycopg2.Error as e:
-        print(e)
-        conn.rollback()
-        continue
-    conn.commit()
+print('Provide user name for "offshore_ml" database:')
+user = input()
+pg_kwargs = dict(PGDB, user=user, password=getpass(f'Provide password for database user {user}: '))
+print('STREAMING PICK FILE')
+chunks = iter_csv_chunks(DATA_DIR/'all_picks_all_regions_2010_2015_ver3.csv', chunksize=CHUNKSIZE,
+                         dtype=PICK_DTYPES, dedup=True, index_col=[0])
+frames = (format_arrivals(_c) for _c in chunks)
+print('FORMATTING AND SENDING TO DATABASE')
+if NWRITERS > 1:
+    with stage('load.arrivals'):
+        nrows, rejected = load_arrivals_pipelined(pg_kwargs, frames, nwriters=NWRITERS,
+                                                  resume=True)
+else:
+    conn = psycopg2.connect(**pg_kwargs)
+    # Resume after the ARIDs loaded by a previous run, not after each chunk committed here,
+    # as the pick file index is not necessarily ascending
+    last_arid = get_max_key(conn, 'arrival', 'arid')
+    nrows = 0
+    rejected = []
+    with stage('load.arrivals'):
+        for _df in frames:
+            if last_arid is not None:
+                _df = _df[_df.arid > last_arid]
+            _n, _r = load_arrivals(conn, _df, chunksize=CHUNKSIZE, resume=False, progress=False)
+            nrows += _n
+            rejected.append(_r)
+    conn.close()
+    rejected = pd.concat(rejected) if rejected else pd.DataFrame(columns=['reason'])
+count('load.arrivals', rows=nrows, rejected=len(rejected))
+print(f'LOADED {nrows} ARRIVALS')
+if len(rejected) > 0:
+    print(f'Rejected {len(rejected)} picks, see {REJECTED_CSV}')
+    rejected.to_csv(REJECTED_CSV, index=False)
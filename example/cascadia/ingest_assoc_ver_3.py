@@ -8,11 +8,11 @@ purpose: This script maps semi-arbitrary integer indexed origin-to-arrival
     solutions based on the  machine learning ensemble picks (ELEP) for the 
     Cascadia offshore OBS study led by H. Bito and M. Denolle 
     (University of Washington) facilitated by Ian McBrearty (Stanford) and 
-    other Stanford colleagues. This script iterates across unique Station.Network
-    codes in the provided association file, queries all picks for this station
-    from the PostgreSQL database, and then uses table joins informed by structured
-    indexing from the other two `ingest*.py` scripts to map ARRIVAL and ORIGIN
-    table entries together in the ASSOCARO table
+    other Stanford colleagues. This script queries all unassociated picks from
+    the PostgreSQL database once, matches them to the provided association file
+    by network, station, phase, and nearest pick time (within TOLERANCE seconds),
+    and then uses structured indexing from the other two `ingest*.py` scripts to
+    map ARRIVAL and ORIGIN table entries together in the ASSOCARO table
 
 Notes on adaptations to the ANSS ASSOCARO table schema:
  - No notable divergences from fields as described in the CISN/ANSS parametric
@@ -20,13 +20,18 @@ Notes on adaptations to the ANSS ASSOCARO table schema:
 
    https://ncedc.org/db/Documents/NewSchemas/PI/v1.6.4/PI.1.6.4/index.htm
 
+Notes on loading
+ - Per-stage timings, row counts, round trips, and bytes sent are printed on exit and
+   written to METRICS_DIR as JSON and Prometheus text files (see :mod:`~sqlite.metrics`).
+   Set PROFILER to 'cprofile' or 'pyinstrument' to profile each top-level stage.
+
 """
 
+import sys
 import psycopg2
 import pandas as pd
 from getpass import getpass
 from pathlib import Path
-from tqdm import tqdm
 
 def orid2oidx(value, orid_base=90000000):
     """Convert back to native Origin INDex values provided in input CSVs
@@ -50,107 +55,72 @@ def oidx2orid(value, orid_base=90000000, offset_integer=3):
 ROOT = Path(__file__).parent.parent.parent
 AFILE = ROOT/'data'/'cascadia'/'Cascadia_relocated_catalog_picks_ver_3.csv'
 OFILE = ROOT/'data'/'cascadia'/'picks_from_phase_picker'/'origin_2010_2015_reloc_cog_ver3.csv'
+sys.path.append(str(ROOT/'src'))
+from postgresql.bulk import copy_chunks
+from postgresql.matching import fetch_unassociated_arrivals, match_arrivals
+from sqlite.metrics import count, report_at_exit, set_profiler, stage
+from sqlite.timeparse import iso_to_ns, ns_to_seconds
 
 LOCALCONN = {'host': 'localhost',
              'user': 'nates',
              'port': '5432',
              'dbname': 'offshore_ml'}
-
-df_orig = pd.read_csv(OFILE)
-df_orig = df_orig.rename(columns={'Unnamed: 0': 'iorid'})
-# Populate GDD+COH origin IDs
-df_orig = df_orig.assign(pgorid=[oidx2orid(x) for x in df_orig.iorid])
-df_assoc = pd.read_csv(AFILE)
-
-df_assoc = df_assoc.assign(pgorid=[df_orig.loc[x, 'pgorid'] for x in df_assoc['Event ID']])
+# Pick time matching tolerance in seconds
+TOLERANCE = 0.01
+# Association file phase type codes to ARRIVAL iphase values
+PHASE_MAP = {0: 'P', 1: 'S'}
+CHUNKSIZE = 100000
+METRICS_DIR = ROOT/'data'/'metrics'
+PROFILER = None
+
+set_profiler(PROFILER, outdir=METRICS_DIR/'profiles')
+report_at_exit('ingest_assoc_ver_3', outdir=METRICS_DIR)
+
+with stage('csv.read'):
+    df_orig = pd.read_csv(OFILE)
+    df_orig = df_orig.rename(columns={'Unnamed: 0': 'iorid'})
+    # Populate GDD+COH origin IDs
+    df_orig = df_orig.assign(pgorid=oidx2orid(df_orig.iorid))
+    df_assoc = pd.read_csv(AFILE)
+count('csv.read', rows=len(df_orig) + len(df_assoc))
+
+with stage('format.picks'):
+    df_assoc = df_assoc.assign(pgorid=df_orig.loc[df_assoc['Event ID'], 'pgorid'].to_numpy())
+    # Split Station.Network codes and format picks for matching
+    stanet = df_assoc['Station Name'].str.split('.', n=1, expand=True)
+    df_assoc = df_assoc.assign(
+        sta=stanet[0].str.strip(),
+        net=stanet[1].str.strip(),
+        iphase=df_assoc['Phase Type'].replace(PHASE_MAP),
+        time=ns_to_seconds(iso_to_ns(df_assoc['Pick Time (UTC)'])))
+count('format.picks', rows=len(df_assoc))
 
 conn = psycopg2.connect(**LOCALCONN, password=getpass('Enter password for user `nates` of database `offshore_ml`: '))
-cur = conn.cursor()
-
-uns = df_assoc['Station Name'].unique()
-
-for _e, stanet in enumerate(uns):
-    print(f'RUNNING {stanet} ({_e + 1}/{len(uns)})')
-    _s, _n = stanet.split('.')
-    _n = _n.strip()
-    _s = _s.strip()
-    _df_assoc = df_assoc[df_assoc['Station Name'] == stanet]
-    _df_assoc = _df_assoc.assign(truetime = [int(pd.Timestamp(x).timestamp()*1e6) for x in _df_assoc['Pick Time (UTC)']])
-    _df_assoc.index = _df_assoc.truetime
-    _df_assoc = _df_assoc[['pgorid','Phase Type', 'Station Name','Residual (s)']]
-    _sql = f"""
-            SELECT 
-                a.arid, 
-                TrueTime.getEpoch(a.datetime, 'UNIX')*1000000::int as truetime, 
-                a.iphase 
-            FROM arrival a 
-                LEFT JOIN assocaro x ON a.arid = x.arid 
-            WHERE x.orid IS NULL AND 
-                a.net = '{_n}' 
-                AND a.sta = '{_s}' 
-            ORDER BY a.datetime;
-           """
-    # Read from database
-    df_pgarr = pd.read_sql(_sql, con=conn, index_col='truetime')
-    # Force integer microseconds timestamps
-    df_pgarr.index = [int(round(x)) for x in df_pgarr.index]
-    # breakpoint()
-    # Get time matches
-    df_pgarr = df_pgarr.join(_df_assoc, how='inner', lsuffix='pg', rsuffix='csv')
-    # breakpoint()
-    for _, row in tqdm(df_pgarr.iterrows(), total=len(df_pgarr)):
-        _sql = """
-                INSERT INTO assocaro 
-                    (orid, arid, auth, subsource, iphase, timeres, rflag) 
-                VALUES
-                    (%(orid)s, %(arid)s, %(auth)s, %(subsource)s, %(iphase)s, %(timeres)s, 'A');
-               """
-        _var = {'orid': int(row.pgorid),
-                'arid': int(row.arid),
-                'auth': 'Stanford',
-                'subsource': 'gddcoh',
-                'iphase': row.iphase,
-                'timeres': row['Residual (s)']}
-        try:
-            cur.execute(_sql, _var)
-        except psycopg2.Error as e:
-            print(e)
-            conn.rollback()
-            breakpoint()
-        # And also do the GraphDD W/O Coherence
-        _var.update({'orid': _var['orid'] - 1,
-                     'subsource': 'gdd'})
-        try:
-            cur.execute(_sql, _var)
-        except psycopg2.Error as e:
-            print(e)
-            conn.rollback()
-            breakpoint()
-    conn.commit()
-
-
-# for idx, orow in df_orig.iterrows():
-#     _df_assoc = df_assoc[df_assoc['Event ID'] == idx]
-#     for _, arow in _df_assoc.iterrows():
-#         _sql = """
-#             SELECT arid, TrueTime.getEpoch(datetime, 'UNIX') FROM arrival 
-#             WHERE net = %(network)s 
-#                 AND sta = %(station)s 
-#                 AND iphase = %(iphase)s 
-#                 AND datetime BETWEEN TrueTime.putEpoch(%(atime)s, 'UNIX') - 1
-#                     AND TrueTime.putEpoch(%(atime)s, 'UNIX') + 1;
-#         """
-#         _n, _s = arow['Station Name'].split('.')
-#         if arow['Phase Type'] == 0:
-#             iphase = 'P'
-#         elif arow['Phase Type'] == 1:
-#             iphase = 'S'
-#         else:
-#             breakpoint()
-#         _var = {'atime': pd.Timestamp(arow['Pick Time (UTC)']).timestamp(),
-#                 'network': _n,
-#                 'station': _s,
-#                 'iphase': iphase}
-#         cur.execute(_sql, _var)
-#         result = cur.fetchall()
-#         breakpoint()
\ No newline at end of file
+
+print('FETCHING UNASSOCIATED ARRIVALS')
+df_pgarr = fetch_unassociated_arrivals(conn)
+print('MATCHING PICKS')
+with stage('match.picks'):
+    df_match = match_arrivals(df_assoc, df_pgarr, tolerance=TOLERANCE, by=('net', 'sta', 'iphase'))
+    matched = df_match.arid.notna()
+count('match.picks', rows=len(df_assoc), rejected=len(df_assoc) - int(matched.sum()))
+print(f'Matched {matched.sum()} of {len(df_assoc)} picks')
+
+# GraphDD+coherence associations
+df_gddcoh = pd.DataFrame({'orid': df_assoc.pgorid[matched].astype(int),
+                          'arid': df_match.arid[matched].astype(int),
+                          'auth': 'Stanford',
+                          'subsource': 'gddcoh',
+                          'iphase': df_assoc.iphase[matched],
+                          'timeres': df_assoc['Residual (s)'][matched],
+                          'rflag': 'A'})
+# And also do the GraphDD W/O Coherence
+df_gdd = df_gddcoh.assign(orid=df_gddcoh.orid - 1, subsource='gdd')
+
+print('SENDING TO DATABASE')
+with stage('load.assocaro'):
+    nrows = copy_chunks(conn, 'assocaro', pd.concat([df_gddcoh, df_gdd], ignore_index=True),
+                        chunksize=CHUNKSIZE)
+count('load.assocaro', rows=nrows)
+print(f'LOADED {nrows} ASSOCARO ROWS')
+conn.close()
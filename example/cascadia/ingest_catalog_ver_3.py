@@ -9,6 +9,19 @@ purpose: This script converts ANSS schema adjacent origin data from
     and in collaboration with Ian McBrearty (Stanford) and other Stanford
     colleagues.
 
+    With NWRITERS = 1, all origins and events are validated and loaded in one transaction with
+    :meth:`~postgresql.catalog.load_catalog`; rows that would violate an ORIGIN or
+    EVENT constraint are written to REJECTED_CSV instead of stopping the load.
+
+    With NWRITERS > 1, events are instead formatted in chunks of CHUNKSIZE while previous
+    chunks are validated and loaded on NWRITERS concurrent connections, one transaction
+    per chunk (see :mod:`~postgresql.pipeline`).
+
+Notes on loading
+ - Per-stage timings, row counts, round trips, and bytes sent are printed on exit and
+   written to METRICS_DIR as JSON and Prometheus text files (see :mod:`~sqlite.metrics`).
+   Set PROFILER to 'cprofile' or 'pyinstrument' to profile each top-level stage.
+
 Note on time format for the ANSS parametric schema
  - datetime: datetime values are in NOMINAL / GPS time and 
     DO NOT INCLUDE LEAP SECONDS. If you are using the PostgreSQL
@@ -31,162 +44,109 @@ CISN/ANSS Parametric Schema Documentation:
    https://ncedc.org/db/Documents/NewSchemas/PI/v1.6.4/PI.1.6.4/index.htm
 
 """
+import sys
 from pathlib import Path
 from getpass import getpass
 import psycopg2
 import pandas as pd
-from tqdm import tqdm
-from obspy import UTCDateTime
 
 ROOT = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT/'src'))
+from postgresql.catalog import constant, load_catalog, map_columns
+from postgresql.pipeline import load_catalog_pipelined
+from sqlite.timeparse import iso_to_ns, ns_to_datetime64
+from sqlite.metrics import count, report_at_exit, set_profiler, stage
+
 DATA_DIR = ROOT/'data'/'cascadia'
+REJECTED_CSV = DATA_DIR/'rejected_catalog_ver_3.csv'
 
 PGDB = {'host':'localhost',
         'port': '5432',
         'dbname': 'offshore_ml'}
 
-print('Provide user name for "offshore_ml" database:')
-user = input()
-conn = psycopg2.connect(**PGDB, user=user, password=getpass(f'Provide password for database user {user}'))
-
-df_orig_in = pd.read_csv(DATA_DIR/'picks_from_phase_picker'/'origin_2010_2015_reloc_cog_ver3.csv')
-df_orig_in = df_orig_in.rename(columns={'Unnamed: 0':'iorid'})
-
-df_orig = pd.read_csv(DATA_DIR/'Cascadia_relocated_catalog_ver_3.csv',
-                      index_col='Event ID')
-df_orig_coh = pd.read_csv(DATA_DIR/'Cascadia_relocated_catalog_ver_3_waveform_coherency.csv',
-                      index_col='Event ID')
-# df_pick = pd.read_csv(DATA_DIR/'Cascadia_relocated_catalog_picks_ver_3.csv',
-#                       index_col='Pick ID')
-breakpoint()
-cur = conn.cursor()
-
-orid_base = 90000000
-evid_base = 90000000
-
-for evid, row_in in tqdm(df_orig_in.iterrows(), total=len(df_orig_in)):
-    # Ingest non-coherence origin first
-    sql = """
-        INSERT INTO origin 
-         (orid, evid, datetime, lat, lon, depth, 
-          algorithm, algo_assoc, auth, subsource,
-          wrms, erhor, sdep, totalarr, nbs, quality, rflag,
-          gap) 
-        VALUES 
-         (%(orid)s, %(evid)s, TrueTime.putEpoch(%(truetime)s, 'UNIX'), 
-          %(lat)s, %(lon)s, %(depth)s, %(algorithm)s, %(algo_assoc)s, %(auth)s,
-          %(subsource)s, %(wrms)s, %(erhor)s, %(sdep)s, %(totalarr)s, %(nbs)s, %(quality)s, %(rflag)s, %(gap)s);
-          """
-    row = df_orig.loc[evid]
-    var = {'orid': orid_base + (row_in.iorid*10) + 2,
-           'evid': evid_base + evid,
-           'truetime': UTCDateTime(row['Origin Time (UTC)']).timestamp,
-           'lat': float(row['Latitude']),
-           'lon': float(row['Longitude']),
-           'depth': float(row['Depth (km)']),
-           'algorithm': 'gdd',
-           'algo_assoc': 'genie',
-           'auth': 'Stanford',
-           'subsource': 'IMcB',
-           'wrms': float(row['RMS Residual (s)']),
-           'erhor': float(row['Horizontal Uncertainity (km)']),
-           'sdep': float(row['Uncertainity (km)']),
-           'totalarr': int(row['Num. P'] + row['Num. S']),
-           'nbs': int(row['Num. S']),
-           'quality': float(row['Detection Value'])/2,
-           'rflag': 'A',
-           'gap': row_in.gap}
-    if var['depth'] < -10:
-        var['depth'] = 10
-    try:
-        cur.execute(sql, var)
-    except psycopg2.Error as e:
-        print(e)
-        conn.rollback()
-        breakpoint()    
-
-    sql = """
-        INSERT INTO origin 
-         (orid, evid, datetime, lat, lon, depth, 
-          algorithm, algo_assoc, auth, subsource,
-          wrms, erhor, sdep, totalarr, nbs, quality, rflag) 
-        VALUES 
-         (%(orid)s, %(evid)s, TrueTime.putEpoch(%(truetime)s, 'UNIX'), 
-          %(lat)s, %(lon)s, %(depth)s, %(algorithm)s, %(algo_assoc)s, %(auth)s,
-          %(subsource)s, %(wrms)s, %(erhor)s, %(sdep)s, %(totalarr)s, %(nbs)s, %(quality)s, %(rflag)s);
-          """
-    # Ingest coherence solution next
-    _row_coh = df_orig_coh.loc[evid]
-    var = {'orid': orid_base + (row_in.iorid*10) + 3,
-           'evid': evid_base + evid,
-           'truetime': UTCDateTime(_row_coh['Origin Time (UTC)']).timestamp,
-           'lat': float(_row_coh['Latitude']),
-           'lon': float(_row_coh['Longitude']),
-           'depth': float(_row_coh['Depth (km)']),
-           'algorithm': 'gddcoh',
-           'algo_assoc': 'genie',
-           'auth': 'Stanford',
-           'subsource': 'IMcB',
-           'wrms': float(_row_coh['RMS Residual (s)']),
-           'erhor': float(_row_coh['Horizontal Uncertainity (km)']),
-           'sdep': float(_row_coh['Uncertainity (km)']),
-           'totalarr': int(_row_coh['Num. P'] + _row_coh['Num. S']),
-           'nbs': int(_row_coh['Num. S']),
-           'quality': float(_row_coh['Detection Value'])/2,
-           'rflag': 'A'} 
-    if var['depth'] < -10:
-        var['depth'] = -10
-    try:
-        cur.execute(sql, var)
-    except psycopg2.Error as e:
-        print(e)
-        conn.rollback()
-        breakpoint()
-
-    # Create event entry with gddcoh solution as the preferred origin
-    sql = """
-        INSERT INTO event 
-            (evid, prefor, auth, subsource, etype, selectflag, version) 
-        VALUES 
-            (%(evid)s, %(prefor)s, %(auth)s, %(subsource)s, %(etype)s, %(selectflag)s, %(version)s);
-          """
-    var = {'evid': evid_base + evid,
-           'prefor': orid_base + (row_in.iorid*10) + 3,
-           'auth': 'Stanford',
-           'subsource': 'IMcB',
-           'etype': 'eq',
-           'selectflag': 0,
-           'version': 3}
-    try:
-        cur.execute(sql, var)
-    except psycopg2.Error as e:
-        print(e)
-        conn.rollback()
-        breakpoint()
-    
-    conn.commit()
-
-    # # Get used picks
-    # _dfp = df_pick[df_pick['Event ID'] == evid]
-    # for _pid, prow in _dfp.iterrows():
-    #     sqlarr = """
-    #         INSERT INTO arrival 
-    #             (arid, datetime, sta, net, auth, subsource, 
-    #              iphase, )
-    #         """
-
-
-    #     sqlaro = """
-    #         INSERT INTO assocaro 
-    #             (orid, arid, auth, subsource, iphase, timeres) 
-    #         VALUES
-    #             (%(orid)s, %(arid)s, %(auth)s, %(subsource)s, %(iphase)s, %(timeres)s);
-    #           """
-
-    # breakpoint()
-    # next_orid += 1
-    # next_evid += 1
-
-
+ORID_BASE = 90000000
+EVID_BASE = 90000000
+# Events per chunk and concurrent database writers (1: one transaction for everything)
+CHUNKSIZE = 20000
+NWRITERS = 4
+METRICS_DIR = ROOT/'data'/'metrics'
+PROFILER = None
+
+set_profiler(PROFILER, outdir=METRICS_DIR/'profiles')
+report_at_exit('ingest_catalog_ver_3', outdir=METRICS_DIR)
+
+# ORIGIN fields shared by the GraphDD and GraphDD+coherence catalogs
+ORIGIN_MAP = {'lat': 'Latitude',
+              'lon': 'Longitude',
+              'depth': lambda df: df['Depth (km)'].clip(lower=-10),
+              'algo_assoc': constant('genie'),
+              'auth': constant('Stanford'),
+              'subsource': constant('IMcB'),
+              'wrms': 'RMS Residual (s)',
+              'erhor': 'Horizontal Uncertainity (km)',
+              'sdep': 'Uncertainity (km)',
+              'totalarr': lambda df: df['Num. P'] + df['Num. S'],
+              'nbs': 'Num. S',
+              'quality': lambda df: df['Detection Value']/2,
+              'rflag': constant('A'),
+              'datetime': lambda df: ns_to_datetime64(iso_to_ns(df['Origin Time (UTC)']))}
+
+
+def format_catalog(df_in):
+    """Build ORIGIN and EVENT rows for rows of the association catalog (row number = Event ID)"""
+    with stage('format.catalog', rows=len(df_in)):
+        # Align both relocated catalogs to the association catalog
+        evid = EVID_BASE + df_in.index.to_numpy()
+        orid_gdd = ORID_BASE + df_in.iorid.to_numpy()*10 + 2
+        orid_coh = ORID_BASE + df_in.iorid.to_numpy()*10 + 3
+        df_gdd = df_orig.loc[df_in.index]
+        df_coh = df_orig_coh.loc[df_in.index]
+
+        # Non-coherence (gdd) and coherence (gddcoh) solutions
+        origin = pd.concat([
+            map_columns(df_gdd, ORIGIN_MAP).assign(orid=orid_gdd, evid=evid, algorithm='gdd',
+                                                   gap=df_in.gap.to_numpy()),
+            map_columns(df_coh, ORIGIN_MAP).assign(orid=orid_coh, evid=evid, algorithm='gddcoh')],
+            ignore_index=True)
+
+        # Event entries with the gddcoh solution as the preferred origin
+        event = pd.DataFrame({'evid': evid,
+                              'prefor': orid_coh,
+                              'auth': 'Stanford',
+                              'subsource': 'IMcB',
+                              'etype': 'eq',
+                              'selectflag': 0,
+                              'version': 3})
+    return {'origin': origin, 'event': event}
 
 
+print('Provide user name for "offshore_ml" database:')
+user = input()
+pg_kwargs = dict(PGDB, user=user, password=getpass(f'Provide password for database user {user}'))
+
+with stage('csv.read'):
+    df_orig_in = pd.read_csv(DATA_DIR/'picks_from_phase_picker'/'origin_2010_2015_reloc_cog_ver3.csv')
+    df_orig_in = df_orig_in.rename(columns={'Unnamed: 0':'iorid'})
+
+    df_orig = pd.read_csv(DATA_DIR/'Cascadia_relocated_catalog_ver_3.csv',
+                          index_col='Event ID')
+    df_orig_coh = pd.read_csv(DATA_DIR/'Cascadia_relocated_catalog_ver_3_waveform_coherency.csv',
+                          index_col='Event ID')
+count('csv.read', rows=len(df_orig_in) + len(df_orig) + len(df_orig_coh))
+
+if NWRITERS > 1:
+    chunks = (format_catalog(df_orig_in.iloc[_i:_i + CHUNKSIZE])
+              for _i in range(0, len(df_orig_in), CHUNKSIZE))
+    with stage('load.catalog'):
+        counts, rejected = load_catalog_pipelined(pg_kwargs, chunks, nwriters=NWRITERS)
+else:
+    tables = format_catalog(df_orig_in)
+    conn = psycopg2.connect(**pg_kwargs)
+    with stage('load.catalog'):
+        counts, rejected = load_catalog(conn, tables)
+    conn.close()
+count('load.catalog', rows=sum(counts.values()), rejected=len(rejected))
+print(f'Loaded {counts}')
+if len(rejected) > 0:
+    print(f'Rejected {len(rejected)} rows, see {REJECTED_CSV}')
+    rejected.to_csv(REJECTED_CSV, index=False)
@@ -11,30 +11,58 @@ purpose: This script reads the ds01.csv earthquake catalog file from Morton et a
     as an example of how these data were loaded into the `offshore_ml` database and how
     one might load their own data into an AQMS PostgreSQL style database.
 
+    Coinciding origins are found client-side: candidate origins are pulled from the database once and
+    all catalog entries are matched in one batch (see :meth:`~postgresql.matching.match_origins`) using
+    a time tolerance of MAX_DT seconds and an epicentral distance tolerance of MAX_DIST_KM. Only origins
+    present before this script runs are considered as matches.
+
+Notes on loading
+ - Per-stage timings, row counts, round trips, and bytes sent are printed on exit and
+   written to METRICS_DIR as JSON and Prometheus text files (see :mod:`~sqlite.metrics`).
+   Set PROFILER to 'cprofile' or 'pyinstrument' to profile each top-level stage.
+
 References: 
 Morton, E.A., Bilek S.L., Rowe, C.A. (2023) Cascadia Subduction Zone Fault Heterogeneities From Newly
     Detected Small Magnitude Earthquakes. JGR Solid Earth 128(6). https://doi.org/10.1029/2023JB026607
 """
 
+import math
+import sys
 import psycopg2
+from psycopg2.extras import execute_batch
 from pathlib import Path
 from getpass import getpass
 import pandas as pd
-from tqdm import tqdm
 
 ROOT = Path(__file__).parent.parent.parent
 OFILE = ROOT/'data'/'cascadia'/'ds01.csv'
+sys.path.append(str(ROOT/'src'))
+from postgresql.bulk import timebase_is_true, utc2dbtime_column
+from postgresql.matching import fetch_origins, match_origins
+from sqlite.metrics import count, report_at_exit, set_profiler, stage
+from sqlite.timeparse import components_to_ns, ns_to_datetime64
+
+# Matching tolerances
+MAX_DT = 5.
+MAX_DIST_KM = 11.
+PAGE_SIZE = 1000
+METRICS_DIR = ROOT/'data'/'metrics'
+PROFILER = None
+
+set_profiler(PROFILER, outdir=METRICS_DIR/'profiles')
+report_at_exit('ingest_morton', outdir=METRICS_DIR)
 
 # Load data from their data repository
-df = pd.read_csv(OFILE)
-# Get rid of empty rows
-df = df[df.YEAR.notna()]
-# Populate datetime objects
-df = df.assign(datetime = [ 
-    pd.Timestamp(year=int(x.YEAR), month=int(x.MONTH), day=int(x.DAY),
-                 hour=int(x.HOUR), minute=int(x.MINUTE)) + pd.Timedelta(float(x.SECOND), unit='s') 
-    for _, x in df.iterrows()
-])
+with stage('csv.read'):
+    df = pd.read_csv(OFILE)
+    # Get rid of empty rows
+    nread = len(df)
+    df = df[df.YEAR.notna()]
+count('csv.read', rows=nread, rejected=nread - len(df))
+# Populate datetime values
+with stage('format.datetime', rows=len(df)):
+    ns = components_to_ns(df, 'YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND')
+    df = df.assign(datetime = ns_to_datetime64(ns))
 
 # Start Morton et al. (2023) origins with 8 (avoids Cascadia OBS ML origins/events)
 orid_base = 80000000
@@ -48,130 +76,110 @@ conn = psycopg2.connect(
     user='nates',
     password=getpass('password for `nates`: ')
 )
-cur = conn.cursor()
-for idx, row in tqdm(df.iterrows(), total=len(df)):
-    #Populate magnitude first
-    sqlm = """
-        INSERT INTO netmag 
-            (magid, orid, magnitude, magtype, auth, magalgo, rflag) 
-        VALUES 
-            (%(magid)s, %(orid)s, %(magnitude)s, 'd', 'Morton2023','Eaton1992','H');
-        """
-    varm = {'magid': int(magid_base + idx),
-            'orid': int(orid_base + idx),
-            'magnitude': float(row.Md)}
-    try:
-        cur.execute(sqlm, varm)
-    except psycopg2.Error as e:
-        conn.rollback()
-        print(f'{e}\nROLLBACK')
-        breakpoint()
-
-    # Populate remark if present
-    remark1 = {'commid': int(commid_base + idx),
-               'lineno': 1,
-               'remark': f'Plate designation: {row['PLATE DESIGNATION']}'}
-    remark2 = {'commid': int(commid_base + idx),
-               'lineno': 2,
-               'remark': f'Template event?: {row['TEMPLATE EVENT?']}'}
-    sqlr = """
-        INSERT INTO remark 
-            (commid, lineno, remark) 
-        VALUES 
-            (%(commid)s, %(lineno)s, %(remark)s);
-        """
-    for remark in [remark1, remark2]:
-        try:
-            cur.execute(sqlr, remark)
-        except psycopg2.Error as e:
-            conn.rollback()
-            print(f'{e}\nROLLBACK')
-            breakpoint()        
-
-    # Search for matches in catalog
-    sql = """
-        WITH timesubset AS (
-            SELECT * FROM origin 
-            WHERE datetime BETWEEN 
-                TrueTime.putEpoch(%(truetime)s, 'UNIX') - 5 AND
-                TrueTime.putEpoch(%(truetime)s, 'UNIX') + 5 AND 
-            abs(lat - %(lat)s) < 0.1 AND abs (lon - %(lon)s) < 0.1 
-            )
-        SELECT * FROM timesubset 
-        ORDER BY abs(lat - %(lat)s) + 
-            abs(lon - %(lon)s) + 
-            abs(datetime - TrueTime.putEpoch(%(truetime)s, 'UNIX'));
-        """
-    var = {'truetime': row.datetime.timestamp(),
-           'lat': row.LAT,
-           'lon': row.LON}
-    
-    cur.execute(sql, var)
-    result = cur.fetchall()
-    if len(result) > 0:
-        evid = result[0][1]
-        sqle = """
-            UPDATE event SET prefor = %(orid)s, prefmag = %(magid)s, 
-                auth='Morton2023', subsource='subspace', selectflag=1,
-                version = 4 
-            WHERE evid = %(evid)s;
-            """
-        vare = {'orid': int(orid_base + idx),
-                'magid': int(magid_base + idx),
-                'evid': int(evid)}
-    else:
-        evid = int(evid_base + idx)
-        sqle = """
-            INSERT INTO event 
-                (evid, prefor, prefmag, etype, auth, subsource, version) 
-            VALUES 
-                (%(evid)s, %(orid)s, %(magid)s, 'eq', 'Morton2023','subspace',1);
-            """
-        vare = {'evid': int(evid),
-                'orid': int(orid_base + idx),
-                'magid': int(magid_base + idx)}
-    try:
-        cur.execute(sqle, vare)
-    except psycopg2.Error as e:
-        conn.rollback()
-        print(f'{e}\nROLLBACK')
-        breakpoint()     
-    
-
-    sqlo = """
-        INSERT INTO origin 
-            (orid, evid, prefmag, commid, 
-            datetime, lat, lon, depth, 
-            totalarr, gap, distance,
-            wrms, erhor, sdep,
-            auth, algorithm, algo_assoc) 
-        VALUES 
-            (%(orid)s, %(evid)s, %(magid)s, %(commid)s, 
-             TrueTime.putEpoch(%(datetime)s, 'UNIX'), %(lat)s, %(lon)s, %(depth)s,
-             %(totalarr)s, %(gap)s, %(distance)s, %(wrms)s, %(erhor)s, %(sdep)s, 
-             'Morton2023', 'HYP2000','subspace');
-        """
-    varo = {
-        'orid': int(orid_base + idx),
-        'evid': int(evid),
-        'magid': int(magid_base + idx),
-        'commid': int(commid_base + idx),
-        'datetime': row.datetime.timestamp(),
-        'lat': float(row.LAT),
-        'lon': float(row.LON),
-        'depth': float(row.DEPTH),
-        'totalarr': int(row['Num P&S with weights > 0.1']),
-        'gap': int(row['max az gap']),
-        'distance': float(row['dist to nearest stn']),
-        'wrms': float(row['tt RMS']),
-        'erhor': float(row.ERH),
-        'sdep': float(row.ERZ)
-    }
+# Convert to database time once, client-side
+df = df.assign(dbtime = utc2dbtime_column(df.datetime, is_true=timebase_is_true(conn)))
+
+# Search for matches in catalog
+print('MATCHING TO EXISTING ORIGINS')
+df_cand = fetch_origins(conn, df.dbtime.min() - MAX_DT, df.dbtime.max() + MAX_DT)
+df_query = pd.DataFrame({'datetime': df.dbtime, 'lat': df.LAT, 'lon': df.LON}, index=df.index)
+with stage('match.origins', rows=len(df_query)):
+    df_match = match_origins(df_query, df_cand, max_dt=MAX_DT, max_dist_km=MAX_DIST_KM)
+    matched = df_match.ref_index.notna()
+print(f'{matched.sum()} of {len(df)} origins coincide with existing origins')
+
+idx = df.index.to_series()
+evids = (evid_base + idx).astype('Int64')
+evids[matched] = df_cand.loc[df_match.ref_index[matched].astype(int), 'evid'].to_numpy()
+
+# Populate magnitudes first
+sqlm = """
+    INSERT INTO netmag 
+        (magid, orid, magnitude, magtype, auth, magalgo, rflag) 
+    VALUES 
+        (%(magid)s, %(orid)s, %(magnitude)s, 'd', 'Morton2023','Eaton1992','H');
+    """
+varm = pd.DataFrame({'magid': magid_base + idx,
+                     'orid': orid_base + idx,
+                     'magnitude': df.Md.astype(float)}).to_dict('records')
+
+# Populate remarks
+sqlr = """
+    INSERT INTO remark 
+        (commid, lineno, remark) 
+    VALUES 
+        (%(commid)s, %(lineno)s, %(remark)s);
+    """
+varr = pd.concat([
+    pd.DataFrame({'commid': commid_base + idx, 'lineno': 1,
+                  'remark': 'Plate designation: ' + df['PLATE DESIGNATION'].astype(str)}),
+    pd.DataFrame({'commid': commid_base + idx, 'lineno': 2,
+                  'remark': 'Template event?: ' + df['TEMPLATE EVENT?'].astype(str)})
+    ]).to_dict('records')
+
+# Update matched events / create new events
+sqleu = """
+    UPDATE event SET prefor = %(orid)s, prefmag = %(magid)s, 
+        auth='Morton2023', subsource='subspace', selectflag=1,
+        version = 4 
+    WHERE evid = %(evid)s;
+    """
+sqlei = """
+    INSERT INTO event 
+        (evid, prefor, prefmag, etype, auth, subsource, version) 
+    VALUES 
+        (%(evid)s, %(orid)s, %(magid)s, 'eq', 'Morton2023','subspace',1);
+    """
+df_event = pd.DataFrame({'evid': evids.astype(int),
+                         'orid': orid_base + idx,
+                         'magid': magid_base + idx})
+vareu = df_event[matched].to_dict('records')
+varei = df_event[~matched].to_dict('records')
+
+sqlo = """
+    INSERT INTO origin 
+        (orid, evid, prefmag, commid, 
+        datetime, lat, lon, depth, 
+        totalarr, gap, distance,
+        wrms, erhor, sdep,
+        auth, algorithm, algo_assoc) 
+    VALUES 
+        (%(orid)s, %(evid)s, %(magid)s, %(commid)s, 
+         %(datetime)s, %(lat)s, %(lon)s, %(depth)s,
+         %(totalarr)s, %(gap)s, %(distance)s, %(wrms)s, %(erhor)s, %(sdep)s, 
+         'Morton2023', 'HYP2000','subspace');
+    """
+varo = pd.DataFrame({
+    'orid': orid_base + idx,
+    'evid': evids.astype(int),
+    'magid': magid_base + idx,
+    'commid': commid_base + idx,
+    'datetime': df.dbtime.astype(float),
+    'lat': df.LAT.astype(float),
+    'lon': df.LON.astype(float),
+    'depth': df.DEPTH.astype(float),
+    'totalarr': df['Num P&S with weights > 0.1'].astype(int),
+    'gap': df['max az gap'].astype(int),
+    'distance': df['dist to nearest stn'].astype(float),
+    'wrms': df['tt RMS'].astype(float),
+    'erhor': df.ERH.astype(float),
+    'sdep': df.ERZ.astype(float)
+}).to_dict('records')
 
+# Load everything in one transaction
+print('SENDING TO DATABASE')
+with conn.cursor() as cur:
     try:
-        cur.execute(sqlo, varo)
+        for name, sql, var in [('netmag', sqlm, varm), ('remark', sqlr, varr),
+                               ('event.update', sqleu, vareu), ('event', sqlei, varei),
+                               ('origin', sqlo, varo)]:
+            # execute_batch sends one round trip per PAGE_SIZE statements
+            with stage(f'send.{name}', rows=len(var), round_trips=math.ceil(len(var)/PAGE_SIZE)):
+                execute_batch(cur, sql, var, page_size=PAGE_SIZE)
     except psycopg2.Error as e:
         conn.rollback()
         print(f'{e}\nROLLBACK')
-        breakpoint()
+        raise
+with stage('commit.morton', round_trips=1):
     conn.commit()
+conn.close()
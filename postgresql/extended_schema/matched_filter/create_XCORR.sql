@@ -34,6 +34,8 @@ CREATE TABLE XCORR (
     CONSTRAINT XCORRKEY05 FOREIGN KEY (jarid) REFERENCES arrival(arid)
 );
 
+CREATE INDEX IF NOT EXISTS ix_xcorr_ievid_iarid ON XCORR (IEVID, IARID);
+
 
 
 
@@ -0,0 +1,53 @@
+-- XCORR_PACKED TABLE PARAMETRIC SCHEMA
+-- Packed Cross Correlation Table Parametric Schema
+-- auth: Nathan T. Stevens
+-- org: PNSN
+-- license: CC-1.0
+--
+-- Compact alternative to XCORR holding one row per reference event/arrival with the
+-- test event/arrival IDs, correlation values, and shifts of all of its pairs in
+-- parallel arrays. This stores ~22 bytes per pair (8 + 8 + 4 + 2), versus a ~28 byte
+-- tuple header plus ~60 bytes of columns per XCORR row, and large rows are compressed
+-- by TOAST. The XCORR_UNPACKED view presents the contents in the XCORR layout.
+-- Rows are written with `src/postgresql/matched_filter.py` (load_xcorr(..., packed=True)).
+--
+-- fields
+-- IEVID: Reference event ID (i^th)
+-- IARID: Reference arrival ID
+-- SAMP_RATE: sampling rate of vectors cross correlated
+-- SHMAX: Unsigned maximum shift of test data assessed in samples
+-- JEVIDS: Test event IDs (j^th)
+-- JARIDS: Test arrival IDs
+-- CC_VALS: Cross correlation coefficient values
+-- CC_SHIFTS: Cross correlation shifts of test data corresponding to CC_VALS in samples
+--      (NULL if not recorded)
+-- LDDATE: Date loaded into database
+
+CREATE TABLE XCORR_PACKED (
+    IEVID BIGINT NOT NULL,
+    IARID BIGINT NOT NULL,
+    SAMP_RATE REAL NOT NULL,
+    SHMAX SMALLINT NOT NULL,
+    JEVIDS BIGINT[] NOT NULL,
+    JARIDS BIGINT[] NOT NULL,
+    CC_VALS REAL[] NOT NULL,
+    CC_SHIFTS SMALLINT[],
+    LDDATE TIMESTAMP DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    CONSTRAINT XCORR_PACKED01 CHECK (cardinality(jarids) = cardinality(jevids)
+                                     AND cardinality(cc_vals) = cardinality(jevids)),
+    CONSTRAINT XCORR_PACKED02 CHECK (cc_shifts IS NULL OR cardinality(cc_shifts) = cardinality(jevids)),
+    CONSTRAINT XCORR_PACKED03 CHECK (-1 <= ALL (cc_vals) AND 1 >= ALL (cc_vals)),
+    CONSTRAINT XCORR_PACKED04 CHECK (-shmax <= ALL (cc_shifts) AND shmax >= ALL (cc_shifts)),
+    CONSTRAINT XCORR_PACKED05 CHECK (samp_rate > 0),
+    CONSTRAINT XCORR_PACKEDKEY02 FOREIGN KEY (ievid) REFERENCES event(evid)
+);
+
+CREATE INDEX IF NOT EXISTS ix_xcorr_packed_ievid ON XCORR_PACKED (IEVID);
+
+-- XCORR layout of XCORR_PACKED (one row per pair)
+CREATE VIEW XCORR_UNPACKED AS
+SELECT p.ievid, p.iarid, u.jevid, u.jarid, p.samp_rate, u.cc_val,
+       u.cc_shift::INTEGER AS cc_shift, p.shmax::INTEGER AS shmax, p.lddate
+FROM xcorr_packed p
+CROSS JOIN LATERAL unnest(p.jevids, p.jarids, p.cc_vals, p.cc_shifts)
+    AS u(jevid, jarid, cc_val, cc_shift);
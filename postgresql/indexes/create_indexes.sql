@@ -0,0 +1,26 @@
+-- SECONDARY INDEXES FOR THE POSTGRESQL PARAMETRIC SCHEMA
+-- Supporting indexes for common joins and filters used in this repository
+--  - event -> origin -> assocaro -> arrival joins (see `src/sqlite/query_helpers.py`)
+--  - arrival lookups by station and time (see `example/cascadia/ingest_assoc_ver_3.py`)
+-- ASSOCARO lookups by ORID are served by the (ORID, ARID) primary key.
+--  - range predicates on UNIX (nominal) epoch times via the inlinable TrueTime functions
+--    (see `stored_procedures/truetime_fast.sql`), e.g.,
+--    WHERE truetime.getEpoch_fast(datetime, 'UNIX') BETWEEN 1325376000 AND 1325462400
+-- Install after tables and stored procedures (including `truetime_fast.sql`) are created
+-- and, for bulk loads, after data are loaded. Rebuild the expression indexes with
+-- REINDEX if `truetime.install_fast()` is re-run after a leap second update.
+-- Indexes use the `ix_` name prefix so they can be dropped/rebuilt around bulk loads.
+-- editor: Nathan T. Stevens
+-- org: PNSN
+-- license: CC-1.0
+
+CREATE INDEX IF NOT EXISTS ix_arrival_net_sta_datetime ON ARRIVAL (NET, STA, DATETIME);
+CREATE INDEX IF NOT EXISTS ix_assocaro_arid ON ASSOCARO (ARID);
+CREATE INDEX IF NOT EXISTS ix_origin_evid ON ORIGIN (EVID);
+CREATE INDEX IF NOT EXISTS ix_origin_datetime ON ORIGIN (DATETIME);
+CREATE INDEX IF NOT EXISTS ix_event_prefor ON EVENT (PREFOR);
+CREATE INDEX IF NOT EXISTS ix_netmag_orid ON NETMAG (ORID);
+CREATE INDEX IF NOT EXISTS ix_origin_unixtime ON ORIGIN (truetime.getEpoch_fast(DATETIME, 'UNIX'));
+CREATE INDEX IF NOT EXISTS ix_arrival_unixtime ON ARRIVAL (truetime.getEpoch_fast(DATETIME, 'UNIX'));
+
+ANALYZE arrival, assocaro, origin, event, netmag;
@@ -0,0 +1,43 @@
+-- PARTITIONED XCORR TABLE PARAMETRIC SCHEMA
+-- Hash-partitioned (on IEVID) variant of `extended_schema/matched_filter/create_XCORR.sql`.
+-- All pairs of a reference event land in one partition, so lookups by IEVID prune to a
+-- single partition and partitions can be vacuumed, indexed, detached, and re-attached
+-- independently. The IARID/JARID foreign keys are omitted, as a partitioned ARRIVAL
+-- (see `partitioned/create_ARRIVAL.sql`) cannot be referenced on ARID alone.
+-- Partitions are created with `src/postgresql/partitions.py`, e.g.,
+-- create_xcorr_partitions(conn, modulus=16).
+-- Cross Correlation Table Parametric Schema
+-- auth: Nathan T. Stevens
+-- org: PNSN
+-- license: CC-1.0
+--
+-- fields
+-- IEVID: Reference event ID (i^th)
+-- IARID: Reference arrival ID
+-- JEVID: Test event ID (j^th)
+-- JARID: Test arrival ID
+-- SAMP_RATE: sampling rate of vectors cross correlated
+-- CC_VAL: Cross correlation coefficient value
+-- CC_SHIFT: Cross correlation shift of test data corresponding to CC_VAL in samples
+-- SHMAX: Unsigned maximum shift of test data assessed in samples 
+-- LDDATE: Date loaded into database
+
+CREATE TABLE XCORR (
+    IEVID BIGINT,
+    IARID BIGINT,
+    JEVID BIGINT,
+    JARID BIGINT,
+    SAMP_RATE REAL NOT NULL,
+    CC_VAL REAL,
+    CC_SHIFT INTEGER,
+    SHMAX INTEGER NOT NULL,
+    LDDATE TIMESTAMP DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+    CONSTRAINT XCORR01 CHECK (cc_val >= -1 AND cc_val <= 1),
+    CONSTRAINT XCORR02 CHECK (ABS(cc_shift) <= shmax),
+    CONSTRAINT XCORR03 CHECK (samp_rate > 0),
+    CONSTRAINT XCORRKEY02 FOREIGN KEY (ievid) REFERENCES event(evid),
+    CONSTRAINT XCORRKEY04 FOREIGN KEY (jevid) REFERENCES event(evid)
+) PARTITION BY HASH (IEVID);
+
+-- Created on each partition, including partitions attached later
+CREATE INDEX IF NOT EXISTS ix_xcorr_ievid_iarid ON XCORR (IEVID, IARID);
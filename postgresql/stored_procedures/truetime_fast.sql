@@ -0,0 +1,99 @@
+-- script: postgresql/stored_procedures/truetime_fast.sql
+-- auth: Nathan T. Stevens
+-- org: PNSN
+-- license: CC-1.0
+-- purpose: This script installs fast-path equivalents of the TrueTime conversion
+--  functions in `truetime.sql`:
+--      truetime.nominal2true_fast(n)       ~ truetime.nominal2truef(n)
+--      truetime.true2nominal_fast(t)       ~ truetime.true2nominalf(t)
+--      truetime.putEpoch_fast(t, baseIn)   ~ truetime.putEpoch(t, baseIn)
+--      truetime.getEpoch_fast(t, baseIn)   ~ truetime.getEpoch(t, baseIn)
+--
+--  The PL/pgSQL originals query EpochTimeBase and LEAP_SECONDS on every call. The
+--  fast-path functions are single-expression SQL functions generated by
+--  `truetime.install_fast()` with the contents of LEAP_SECONDS and the database
+--  timebase written into their bodies as array literals. They are IMMUTABLE and
+--  PARALLEL SAFE, so the planner can inline them into queries, run them in parallel
+--  workers, and use them in expression indexes (see `indexes/create_indexes.sql`), e.g.,
+--
+--      SELECT orid FROM origin
+--      WHERE truetime.getEpoch_fast(datetime, 'UNIX') BETWEEN 1325376000 AND 1325462400;
+--
+--  Install after `truetime.sql` and `Init_Leap_Secs.sql`. If LEAP_SECONDS or
+--  EpochTimeBase change, re-run `SELECT truetime.install_fast();` and then
+--  `REINDEX` any expression indexes built on these functions.
+
+
+create schema if not exists truetime;
+
+CREATE OR REPLACE FUNCTION truetime.install_fast() RETURNS integer AS $$
+DECLARE
+    s_nom   TEXT;
+    e_nom   TEXT;
+    s_tru   TEXT;
+    e_tru   TEXT;
+    counts  TEXT;
+    isTrue  INTEGER;
+BEGIN
+    SELECT array_agg(s_nominal ORDER BY s_nominal)::text,
+           array_agg(e_nominal ORDER BY s_nominal)::text,
+           array_agg(s_true ORDER BY s_nominal)::text,
+           array_agg(e_true ORDER BY s_nominal)::text,
+           array_agg(ls_count ORDER BY s_nominal)::text
+    INTO s_nom, e_nom, s_tru, e_tru, counts
+    FROM leap_seconds;
+    IF (counts IS NULL) THEN
+      RAISE EXCEPTION 'leap_seconds is empty, run Init_Leap_Secs.sql first';
+    END IF;
+    isTrue := truetime.timeBaseIsTrue();
+--
+--  Leap second ranges are found with width_bucket on the range starts, then checked
+--  against the range end (times inside a leap second map to NULL, as in the originals)
+    EXECUTE format($f$
+        CREATE OR REPLACE FUNCTION truetime.nominal2true_fast(n DOUBLE PRECISION)
+        RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $body$
+        SELECT CASE WHEN floor(n)::bigint <= (%1$L::bigint[])[width_bucket(floor(n)::bigint, %2$L::bigint[])]
+                    THEN n + (%3$L::bigint[])[width_bucket(floor(n)::bigint, %2$L::bigint[])] END
+        $body$;
+        $f$, e_nom, s_nom, counts);
+    EXECUTE format($f$
+        CREATE OR REPLACE FUNCTION truetime.true2nominal_fast(t DOUBLE PRECISION)
+        RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $body$
+        SELECT CASE WHEN floor(t)::bigint <= (%1$L::bigint[])[width_bucket(floor(t)::bigint, %2$L::bigint[])]
+                    THEN t - (%3$L::bigint[])[width_bucket(floor(t)::bigint, %2$L::bigint[])] END
+        $body$;
+        $f$, e_tru, s_tru, counts);
+--
+--  The timebase is resolved here, once, rather than per call
+    IF (isTrue = 1) THEN
+      EXECUTE $f$
+        CREATE OR REPLACE FUNCTION truetime.putEpoch_fast(t DOUBLE PRECISION, baseIn VARCHAR)
+        RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $body$
+        SELECT CASE WHEN UPPER(baseIn) IN ('NOMINAL', 'UNIX', 'POSIX')
+                    THEN truetime.nominal2true_fast(t) ELSE t END
+        $body$;
+        CREATE OR REPLACE FUNCTION truetime.getEpoch_fast(t DOUBLE PRECISION, baseIn VARCHAR)
+        RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $body$
+        SELECT CASE WHEN UPPER(baseIn) IN ('NOMINAL', 'UNIX', 'POSIX')
+                    THEN truetime.true2nominal_fast(t) ELSE t END
+        $body$;
+        $f$;
+    ELSE
+      EXECUTE $f$
+        CREATE OR REPLACE FUNCTION truetime.putEpoch_fast(t DOUBLE PRECISION, baseIn VARCHAR)
+        RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $body$
+        SELECT CASE WHEN UPPER(baseIn) IN ('TRUE', 'UTC')
+                    THEN truetime.true2nominal_fast(t) ELSE t END
+        $body$;
+        CREATE OR REPLACE FUNCTION truetime.getEpoch_fast(t DOUBLE PRECISION, baseIn VARCHAR)
+        RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $body$
+        SELECT CASE WHEN UPPER(baseIn) IN ('TRUE', 'UTC')
+                    THEN truetime.nominal2true_fast(t) ELSE t END
+        $body$;
+        $f$;
+    END IF;
+    RETURN 1;
+END
+$$ LANGUAGE plpgsql;
+
+select truetime.install_fast();
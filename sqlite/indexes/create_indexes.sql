@@ -0,0 +1,30 @@
+-- SECONDARY INDEXES FOR THE SQLITE PARAMETRIC SCHEMA
+-- Supporting indexes for common joins and filters used in this repository
+--  - event -> origin -> assocaro -> arrival joins (see `src/sqlite/query_helpers.py`)
+--  - arrival lookups by station and time (see `example/cascadia/ingest_assoc_ver_3.py`)
+--  - spatiotemporal origin searches via the ORIGIN_RTREE R*Tree (see `select_origins_in_box`
+--    in `src/sqlite/query_helpers.py`). R*Tree coordinates are stored as 32-bit floats that are
+--    rounded outwards, so queries must re-check exact ORIGIN values. ORIGIN_RTREE is rebuilt
+--    from ORIGIN each time this script runs.
+-- ASSOCARO lookups by ORID are served by the (ORID, ARID) primary key.
+-- Install after tables are created and, for bulk loads, after data are loaded.
+-- Indexes use the `ix_` name prefix so they can be dropped/rebuilt around bulk loads.
+-- editor: Nathan T. Stevens
+-- org: PNSN
+-- license: CC-1.0
+
+CREATE INDEX IF NOT EXISTS ix_arrival_net_sta_datetime ON ARRIVAL (NET, STA, DATETIME);
+CREATE INDEX IF NOT EXISTS ix_assocaro_arid ON ASSOCARO (ARID);
+CREATE INDEX IF NOT EXISTS ix_origin_evid ON ORIGIN (EVID);
+CREATE INDEX IF NOT EXISTS ix_origin_datetime ON ORIGIN (DATETIME);
+CREATE INDEX IF NOT EXISTS ix_event_prefor ON EVENT (PREFOR);
+CREATE INDEX IF NOT EXISTS ix_netmag_orid ON NETMAG (ORID);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS origin_rtree USING rtree(
+    orid, min_lat, max_lat, min_lon, max_lon, min_time, max_time);
+DELETE FROM origin_rtree;
+INSERT INTO origin_rtree (orid, min_lat, max_lat, min_lon, max_lon, min_time, max_time)
+    SELECT orid, lat, lat, lon, lon, datetime, datetime FROM origin
+    WHERE lat IS NOT NULL AND lon IS NOT NULL AND datetime IS NOT NULL;
+
+ANALYZE;
@@ -4,6 +4,7 @@
  -- editor: Nathan T. Stevens
  -- orgs: PNSN / AQMS-SWG
  -- license: CC-1.0
+ -- Very lightly modified to conform with SQLite syntax (i.e., removed AT TIME ZONE 'UTC' for LDDATE)
  
  CREATE TABLE MEC 
  (	MECID BIGINT, 
@@ -61,8 +62,7 @@
 	PISO SMALLINT, 
 	DATETIME DOUBLE PRECISION NOT NULL , 
 	RFLAG VARCHAR(2), 
-	LDDATE TIMESTAMP DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC'
-       ),
+	LDDATE TIMESTAMP DEFAULT (CURRENT_TIMESTAMP),
 	CONSTRAINT MEC06 CHECK (mechtype in ('MT','FP')),
 	CONSTRAINT MEC18 CHECK (piso >= 0 and piso <=100),
 	CONSTRAINT MEC29 CHECK (tfd > 0),
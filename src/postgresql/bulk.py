@@ -0,0 +1,286 @@
+"""
+module: postgresql.bulk
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides methods for bulk-loading tabular data into an AQMS
+    PostgreSQL style database using `COPY ... FROM STDIN` in chunks, with one
+    transaction per chunk.
+
+    Time conversions that would otherwise be done server-side with
+    `TrueTime.putEpoch(t, 'UNIX')` for each row are done client-side in vectorized
+    form using :mod:`~sqlite.truetime`, after checking the database's timebase once.
+
+    Conversions, CSV rendering, COPY calls (rows, bytes), and commits are recorded as
+    stages in :mod:`~sqlite.metrics`.
+
+Note on time format for the ANSS parametric schema
+ - datetime: database `datetime` values include leap seconds if the database timebase
+    is TRUE (see EPOCHTIMEBASE), so UTC (UNIX) epoch times supplied to these methods
+    are shifted by the applicable leap-second count before loading.
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from sqlite.metrics import stage
+from sqlite.truetime import as_seconds, dbtime2utc_array, utc2dbtime_array
+
+# Column order of the ARRIVAL table (see `postgresql/schema/create_ARRIVAL.sql`)
+ARRIVAL_COLUMNS = ['arid', 'commid', 'datetime', 'sta', 'net', 'auth', 'subsource',
+                   'channel', 'channelsrc', 'seedchan', 'location', 'iphase', 'qual',
+                   'clockqual', 'clockcorr', 'ccset', 'fm', 'ema', 'azimuth', 'slow',
+                   'deltim', 'delinc', 'delaz', 'delslo', 'quality', 'snr', 'rflag']
+
+
+def timebase_is_true(conn):
+    """Query the database's timebase once using `truetime.timeBaseIsTrue()`
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :return: True if database `datetime` values include leap seconds
+    :rtype: bool
+    """    
+    with stage('truetime.timebase', round_trips=2), conn.cursor() as cur:
+        cur.execute("SELECT truetime.timeBaseIsTrue();")
+        is_true = cur.fetchone()[0]
+        # Close out the read-only transaction
+        conn.commit()
+    return is_true == 1
+
+
+def utc2dbtime_column(utc, is_true=True):
+    """Client-side, vectorized equivalent of `TrueTime.putEpoch(utc, 'UNIX')`
+
+    :param utc: UTC (UNIX) epoch seconds or datetime-like values
+    :type utc: numpy.ndarray or pandas.Series
+    :param is_true: is the database timebase TRUE? Defaults to True
+        (see :meth:`~.timebase_is_true`)
+    :type is_true: bool, optional
+    :return: database `datetime` values
+    :rtype: numpy.ndarray or pandas.Series (matches input)
+    """    
+    if is_true:
+        with stage('truetime.utc2dbtime', rows=np.size(utc)):
+            return utc2dbtime_array(utc)
+    seconds = as_seconds(utc)
+    if isinstance(utc, pd.Series):
+        return pd.Series(seconds, index=utc.index, name=utc.name)
+    return seconds
+
+
+def dbtime2utc_column(dbtime, is_true=True):
+    """Client-side, vectorized equivalent of `TrueTime.getEpoch(dbtime, 'UNIX')`
+
+    :param dbtime: database `datetime` values
+    :type dbtime: numpy.ndarray or pandas.Series
+    :param is_true: is the database timebase TRUE? Defaults to True
+        (see :meth:`~.timebase_is_true`)
+    :type is_true: bool, optional
+    :return: UTC (UNIX) epoch seconds
+    :rtype: numpy.ndarray or pandas.Series (matches input)
+    """    
+    if is_true:
+        with stage('truetime.dbtime2utc', rows=np.size(dbtime)):
+            return dbtime2utc_array(dbtime)
+    return dbtime
+
+
+def get_max_key(conn, table, key):
+    """Get the maximum value of a (primary) key column for a table
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param table: table name
+    :type table: str
+    :param key: key column name
+    :type key: str
+    :return: maximum key value or None if the table is empty
+    :rtype: int or None
+    """    
+    with stage(f'max_key.{table}', round_trips=2), conn.cursor() as cur:
+        cur.execute(f"SELECT max({key}) FROM {table};")
+        value = cur.fetchone()[0]
+        conn.commit()
+    return value
+
+
+def frame_to_buffer(df, columns):
+    """Render the specified columns of a DataFrame into an in-memory CSV buffer
+    formatted for `COPY ... FROM STDIN WITH (FORMAT csv)`. Null values are written
+    as empty (unquoted) fields, which COPY reads as NULL.
+
+    All-numeric frames (e.g., cross-correlation pairs) are rendered with the
+    `pyarrow` CSV writer when it is installed, which is several times faster than
+    :meth:`pandas.DataFrame.to_csv` for large chunks.
+
+    :param df: input dataframe
+    :type df: pandas.DataFrame
+    :param columns: column names to write, in order
+    :type columns: list of str
+    :return: buffer positioned at its start
+    :rtype: io.StringIO or io.BytesIO
+    """    
+    df = df[columns]
+    if all(pd.api.types.is_numeric_dtype(_d) and not pd.api.types.is_bool_dtype(_d)
+           for _d in df.dtypes):
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+        except ImportError:
+            pass
+        else:
+            sink = pa.BufferOutputStream()
+            pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), sink,
+                             pa_csv.WriteOptions(include_header=False))
+            return io.BytesIO(sink.getvalue().to_pybytes())
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False, na_rep='')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_frame(cur, table, df, columns=None):
+    """Stream a DataFrame into a table with a single `COPY ... FROM STDIN` call.
+    Does not commit.
+
+    :param cur: open cursor
+    :type cur: psycopg2.extensions.cursor
+    :param table: destination table name
+    :type table: str
+    :param df: rows to load with column names matching the destination table
+    :type df: pandas.DataFrame
+    :param columns: subset of columns to load, defaults to None (all columns of **df**)
+    :type columns: list of str, optional
+    :return: number of rows copied
+    :rtype: int
+    """    
+    if columns is None:
+        columns = list(df.columns)
+    with stage(f'render.{table}', rows=len(df)):
+        buffer = frame_to_buffer(df, columns)
+    nbytes = buffer.seek(0, io.SEEK_END)
+    buffer.seek(0)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv);"
+    with stage(f'copy.{table}', rows=len(df), round_trips=1, bytes=nbytes):
+        cur.copy_expert(sql, buffer)
+    return len(df)
+
+
+def copy_stream(conn, table, frames, columns=None, progress=True):
+    """Load an iterable of DataFrame chunks into a table using one `COPY` per chunk,
+    committing once per chunk. Only one chunk is held in memory at a time when
+    **frames** is a generator.
+
+    If a chunk fails, it is rolled back and the error is re-raised so that previously
+    committed chunks remain in place and a subsequent run can resume after them.
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param table: destination table name
+    :type table: str
+    :param frames: chunks of rows to load with column names matching the destination table
+    :type frames: iterable of pandas.DataFrame
+    :param columns: subset of columns to load, defaults to None (all columns of each chunk)
+    :type columns: list of str, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows loaded
+    :rtype: int
+    """    
+    nrows = 0
+    for _chunk in tqdm(frames, disable=not progress, unit='chunk'):
+        if len(_chunk) == 0:
+            continue
+        with conn.cursor() as cur:
+            try:
+                nrows += copy_frame(cur, table, _chunk, columns=columns)
+            except Exception:
+                conn.rollback()
+                raise
+        with stage(f'commit.{table}', round_trips=1):
+            conn.commit()
+    return nrows
+
+
+def copy_chunks(conn, table, df, chunksize=100000, columns=None, progress=True):
+    """Load a DataFrame into a table in chunks of **chunksize** rows using `COPY`,
+    committing once per chunk (see :meth:`~.copy_stream`).
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param table: destination table name
+    :type table: str
+    :param df: rows to load with column names matching the destination table
+    :type df: pandas.DataFrame
+    :param chunksize: rows per COPY/transaction, defaults to 100000
+    :type chunksize: int, optional
+    :param columns: subset of columns to load, defaults to None (all columns of **df**)
+    :type columns: list of str, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows loaded
+    :rtype: int
+    """    
+    frames = (df.iloc[_i:_i + chunksize] for _i in range(0, len(df), chunksize))
+    return copy_stream(conn, table, frames, columns=columns, progress=progress)
+
+
+def load_arrivals(conn, df, chunksize=100000, resume=True, progress=True):
+    """Bulk-load phase arrivals into the ARRIVAL table
+
+    **df** must use ARRIVAL column names (lower case) and include at least
+    `arid`, `datetime`, `sta`, and `auth`. The `datetime` column must be UTC (UNIX)
+    epoch seconds or datetime-like values and is converted to database time
+    client-side (see :meth:`~.utc2dbtime_column`). Columns that are not part of
+    ARRIVAL are ignored.
+
+    Rows that would violate an ARRIVAL constraint (e.g., a missing `datetime`, a
+    negative `deltim`, or `quality` outside [0, 1]) are returned instead of aborting
+    the load (see :meth:`~postgresql.catalog.validate_rows`).
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param df: arrivals to load
+    :type df: pandas.DataFrame
+    :param chunksize: rows per COPY/transaction, defaults to 100000
+    :type chunksize: int, optional
+    :param resume: skip rows with `arid` at or below the current max(arid) in
+        ARRIVAL? Defaults to True
+    :type resume: bool, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows loaded and rejected rows (with a `reason` column)
+    :rtype: tuple (int, pandas.DataFrame)
+    """    
+    good, rejected = validate_arrivals(df)
+    if resume:
+        last_arid = get_max_key(conn, 'arrival', 'arid')
+        if last_arid is not None:
+            good = good[good.arid > last_arid]
+    good = good.assign(datetime=utc2dbtime_column(good['datetime'], is_true=timebase_is_true(conn)))
+    nrows = copy_chunks(conn, 'arrival', good, chunksize=chunksize, columns=list(good.columns),
+                        progress=progress)
+    return nrows, rejected
+
+
+def validate_arrivals(df):
+    """Select ARRIVAL columns, sort by `arid`, and split rows into those that pass the
+    ARRIVAL constraints and those that do not (see :meth:`~postgresql.catalog.validate_rows`)
+
+    :param df: arrivals with ARRIVAL column names (other columns are ignored)
+    :type df: pandas.DataFrame
+    :return: valid rows (integer columns as Int64) and rejected rows (with a `reason` column)
+    :rtype: tuple of pandas.DataFrame
+    """
+    # catalog imports this module
+    from .catalog import cast_integers, validate_rows
+    missing = {'arid', 'datetime', 'sta', 'auth'}.difference(df.columns)
+    if missing:
+        raise KeyError(f'Missing required ARRIVAL columns: {sorted(missing)}')
+    columns = [_c for _c in ARRIVAL_COLUMNS if _c in df.columns]
+    good, rejected = validate_rows('arrival', df[columns].sort_values('arid'))
+    return cast_integers('arrival', good), rejected
@@ -0,0 +1,317 @@
+"""
+module: postgresql.catalog
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides a generic, bulk ingestion path for earthquake catalogs
+    into the ORIGIN, EVENT, and NETMAG tables of an AQMS PostgreSQL style database.
+
+    A catalog DataFrame is mapped onto table columns with a column mapping
+    (see :meth:`~.map_columns`), rows are validated client-side against the NOT NULL,
+    CHECK, and PRIMARY KEY constraints of the parametric schema (see TABLE_SPECS), and
+    all valid rows are loaded with `COPY` in a single transaction. Rows that would
+    violate a constraint are returned with the reason for rejection instead of
+    stopping the load.
+
+Note on time format for the ANSS parametric schema
+ - datetime: ORIGIN `datetime` values are supplied as UTC (UNIX) epoch seconds or
+    datetime-like values and are converted to database time client-side
+    (see :meth:`~postgresql.bulk.utc2dbtime_column`)
+"""
+
+import numpy as np
+import pandas as pd
+
+from sqlite.metrics import count, stage
+
+from .bulk import ARRIVAL_COLUMNS, copy_frame, timebase_is_true, utc2dbtime_column
+
+
+def _between(lo, hi):
+    return lambda x: (x >= lo) & (x <= hi)
+
+
+def _at_least(lo):
+    return lambda x: x >= lo
+
+
+def _above(lo):
+    return lambda x: x > lo
+
+
+def _isin(values):
+    return lambda x: x.isin(values)
+
+
+# Column order, NOT NULL columns, primary keys, integer columns, VARCHAR widths, and
+# CHECK constraints by table (see `postgresql/schema/create_{ORIGIN,EVENT,NETMAG,ARRIVAL}.sql`)
+TABLE_SPECS = {
+    'origin': {
+        'columns': ['orid', 'evid', 'prefmag', 'prefmec', 'commid', 'bogusflag', 'datetime',
+                    'lat', 'lon', 'depth', 'mdepth', 'type', 'algorithm', 'algo_assoc', 'auth',
+                    'subsource', 'datumhor', 'datumver', 'gap', 'distance', 'wrms', 'stime',
+                    'erhor', 'sdep', 'erlat', 'erlon', 'totalarr', 'totalamp', 'ndef', 'nbs',
+                    'nbfm', 'locevid', 'quality', 'fdepth', 'fepi', 'ftime', 'vmodelid',
+                    'cmodelid', 'crust_type', 'crust_model', 'gtype', 'rflag'],
+        'key': 'orid',
+        'notnull': ['orid', 'evid', 'datetime', 'lat', 'lon', 'auth'],
+        'integers': ['orid', 'evid', 'prefmag', 'prefmec', 'commid', 'bogusflag', 'totalarr',
+                     'totalamp', 'ndef', 'nbs', 'nbfm'],
+        'widths': {'type': 2, 'algorithm': 15, 'algo_assoc': 80, 'auth': 15, 'subsource': 8,
+                   'datumhor': 8, 'datumver': 8, 'locevid': 12, 'fdepth': 1, 'fepi': 1,
+                   'ftime': 1, 'vmodelid': 2, 'cmodelid': 2, 'crust_type': 1,
+                   'crust_model': 3, 'gtype': 1, 'rflag': 2},
+        'checks': {
+            'ORIGIN02': ('datumhor', _isin(['NAD27', 'WGS84'])),
+            'ORIGIN03': ('datumver', _isin(['NAD27', 'WGS84', 'AVERAGE'])),
+            'ORIGIN04': ('depth', _between(-10., 1000.)),
+            'ORIGIN05': ('distance', _at_least(0.)),
+            'ORIGIN06': ('erhor', _at_least(0.)),
+            'ORIGIN07': ('erlat', _at_least(0.)),
+            'ORIGIN08': ('erlon', _at_least(0.)),
+            'ORIGIN09': ('fdepth', _isin(['y', 'n'])),
+            'ORIGIN10': ('fepi', _isin(['y', 'n'])),
+            'ORIGIN11': ('ftime', _isin(['y', 'n'])),
+            'ORIGIN12': ('gap', _between(0., 360.)),
+            'ORIGIN15': ('nbfm', _at_least(0)),
+            'ORIGIN16': ('nbs', _at_least(0)),
+            'ORIGIN17': ('ndef', _at_least(0)),
+            'ORIGIN18': ('orid', _above(0)),
+            'ORIGIN19': ('quality', _between(0., 1.)),
+            'ORIGIN20': ('type', _isin(list('HhCcAaDdUu'))),
+            'ORIGIN21': ('stime', _at_least(0.)),
+            'ORIGIN23': ('wrms', _at_least(0.)),
+            'ORIGIN24': ('sdep', _at_least(0.)),
+            'ORIGIN25': ('totalarr', _at_least(0)),
+            'ORIGIN26': ('totalamp', _at_least(0)),
+            'ORIGIN28': ('rflag', _isin(list('ahficAHFIC'))),
+            'ORIGIN30': ('crust_type', _isin(list('HTELV'))),
+            'ORIGIN31': ('gtype', _isin(list('lrt'))),
+        }},
+    'event': {
+        'columns': ['evid', 'prefor', 'prefmag', 'prefmec', 'commid', 'auth', 'subsource',
+                    'etype', 'selectflag', 'version'],
+        'key': 'evid',
+        'notnull': ['evid', 'auth', 'etype'],
+        'integers': ['evid', 'prefor', 'prefmag', 'prefmec', 'commid', 'selectflag', 'version'],
+        'widths': {'auth': 15, 'subsource': 8, 'etype': 2},
+        'checks': {
+            'EVENT02': ('evid', _above(0)),
+        }},
+    'netmag': {
+        'columns': ['magid', 'orid', 'commid', 'magnitude', 'magtype', 'auth', 'subsource',
+                    'magalgo', 'nsta', 'uncertainty', 'gap', 'distance', 'quality', 'rflag', 'nobs'],
+        'key': 'magid',
+        'notnull': ['magid', 'orid', 'magnitude', 'magtype', 'auth'],
+        'integers': ['magid', 'orid', 'commid', 'nsta', 'nobs'],
+        'widths': {'magtype': 6, 'auth': 15, 'subsource': 8, 'magalgo': 15, 'rflag': 2},
+        'checks': {
+            'NETMAG01': ('magnitude', _between(-10., 10.)),
+            'NETMAG02': ('magtype', _isin(['p', 'a', 'b', 'e', 'l', 'l1', 'l2', 'l3', 'lg', 'c', 's',
+                                           'w', 'z', 'B', 'un', 'd', 'h', 'n', 'dl', 'lr'])),
+            'NETMAG03': ('nsta', _at_least(0)),
+            'NETMAG04': ('uncertainty', _at_least(0.)),
+            'NETMAG05': ('quality', _between(0., 1.)),
+            'NETMAG06': ('magid', _above(0)),
+            'NETMAG07': ('rflag', _isin(list('ahfAHF'))),
+        }},
+    # Validated by :meth:`~postgresql.bulk.load_arrivals`, not loaded by :meth:`~.load_catalog`
+    'arrival': {
+        'columns': ARRIVAL_COLUMNS,
+        'key': 'arid',
+        'notnull': ['arid', 'datetime', 'sta', 'auth'],
+        'integers': ['arid', 'commid', 'clockcorr', 'ccset'],
+        'widths': {'sta': 6, 'net': 8, 'auth': 15, 'subsource': 8, 'channel': 8,
+                   'channelsrc': 8, 'seedchan': 3, 'location': 2, 'iphase': 8, 'qual': 1,
+                   'clockqual': 1, 'fm': 2, 'rflag': 2},
+        'checks': {
+            'ARRIVAL01': ('arid', _above(0)),
+            'ARRIVAL02': ('azimuth', _between(0., 360.)),
+            'ARRIVAL03': ('delaz', _above(0.)),
+            'ARRIVAL04': ('delinc', _at_least(0.)),
+            'ARRIVAL05': ('delslo', _above(0.)),
+            'ARRIVAL06': ('deltim', _at_least(0.)),
+            'ARRIVAL07': ('ema', _between(0., 90.)),
+            'ARRIVAL09': ('qual', _isin(list('iewIEW'))),
+            'ARRIVAL10': ('slow', _at_least(0.)),
+            'ARRIVAL11': ('snr', _above(0.)),
+            'ARRIVAL12': ('quality', _between(0., 1.)),
+            'ARRIVAL13': ('ccset', lambda x: x < 1),
+            'ARRIVAL14': ('rflag', _isin(list('ahfAHF'))),
+        }},
+}
+
+# Load order for :meth:`~.load_catalog`
+LOAD_ORDER = ['origin', 'netmag', 'event']
+
+
+def constant(value):
+    """Column source for :meth:`~.map_columns` that broadcasts **value** to all rows
+
+    :param value: constant column value (e.g., an AUTH code)
+    :type value: str, int, or float
+    :return: function of a DataFrame returning the column
+    :rtype: callable
+    """
+    return lambda df: pd.Series(value, index=df.index)
+
+
+def map_columns(df, mapping):
+    """Build a table-shaped DataFrame from a catalog DataFrame and a column mapping
+
+    Mapping values are interpreted as:
+     - str: name of a column of **df** to copy
+     - callable: function of **df** returning an array-like column
+       (e.g., :meth:`~.constant` for a constant column)
+
+    :param df: input catalog
+    :type df: pandas.DataFrame
+    :param mapping: destination column names and their sources
+    :type mapping: dict
+    :return: mapped columns, indexed like **df**
+    :rtype: pandas.DataFrame
+    """
+    out = pd.DataFrame(index=df.index)
+    for _k, _v in mapping.items():
+        if isinstance(_v, str):
+            if _v not in df.columns:
+                raise KeyError(f'Source column "{_v}" for "{_k}" not found '
+                               '(wrap constants with constant())')
+            out[_k] = df[_v]
+        elif callable(_v):
+            _col = _v(df)
+            out[_k] = _col if isinstance(_col, pd.Series) else np.asarray(_col)
+        else:
+            raise TypeError(f'Source for "{_k}" must be a column name or a callable, '
+                            f'not {type(_v).__name__} (wrap constants with constant())')
+    return out
+
+
+def validate_rows(table, df):
+    """Validate rows against the NOT NULL, CHECK, integer type, and VARCHAR width
+    constraints of a table and for duplicate primary key values within **df**
+
+    :param table: table name (a key of TABLE_SPECS)
+    :type table: str
+    :param df: rows with table column names
+    :type df: pandas.DataFrame
+    :return: valid rows and rejected rows (with a `reason` column)
+    :rtype: tuple of pandas.DataFrame
+    """
+    spec = TABLE_SPECS[table]
+    unknown = set(df.columns).difference(spec['columns'])
+    if unknown:
+        raise KeyError(f'Columns not in {table.upper()}: {sorted(unknown)}')
+    reason = pd.Series('', index=df.index, dtype=object)
+    for col in spec['notnull']:
+        if col not in df.columns:
+            raise KeyError(f'Missing required {table.upper()} column "{col}"')
+        reason[df[col].isna().to_numpy()] += f'{col} IS NULL;'
+    for name, (col, test) in spec['checks'].items():
+        if col not in df.columns:
+            continue
+        # As in SQL, NULL values pass CHECK constraints
+        passed = test(df[col]) | df[col].isna()
+        reason[~passed.to_numpy()] += f'{name};'
+    for col in spec['integers']:
+        if col not in df.columns or pd.api.types.is_integer_dtype(df[col]):
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        passed = (values == np.round(values)) | df[col].isna()
+        reason[~passed.to_numpy()] += f'{col} not integer;'
+    for col, width in spec['widths'].items():
+        if col not in df.columns:
+            continue
+        passed = (df[col].astype('string').str.len() <= width).fillna(True)
+        reason[~passed.to_numpy(dtype=bool)] += f'{col} longer than {width};'
+    key = spec['key']
+    reason[df[key].duplicated(keep='first').to_numpy()] += f'duplicate {key};'
+    bad = (reason != '').to_numpy()
+    count(f'validate.{table}', rows=len(df), rejected=int(bad.sum()))
+    return df[~bad], df[bad].assign(reason=reason[bad].str.rstrip(';'))
+
+
+def cast_integers(table, df):
+    """Cast the integer columns of a table to nullable Int64, so values are rendered for
+    `COPY` as integers (e.g., '1', not the '1.0' of a float column holding NaN)
+
+    :param table: table name (a key of TABLE_SPECS)
+    :type table: str
+    :param df: validated rows with table column names (see :meth:`~.validate_rows`)
+    :type df: pandas.DataFrame
+    :return: rows with integer columns as Int64
+    :rtype: pandas.DataFrame
+    """
+    cols = [_c for _c in TABLE_SPECS[table]['integers'] if _c in df.columns]
+    return df.astype({_c: 'Int64' for _c in cols})
+
+
+def existing_keys(conn, table, keys):
+    """Query which primary key values are already present in a table
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param table: table name (a key of TABLE_SPECS)
+    :type table: str
+    :param keys: candidate key values
+    :type keys: array-like of int
+    :return: key values already present
+    :rtype: set
+    """
+    key = TABLE_SPECS[table]['key']
+    with stage(f'existing_keys.{table}', rows=len(keys), round_trips=1), conn.cursor() as cur:
+        cur.execute(f"SELECT {key} FROM {table} WHERE {key} = ANY(%s);",
+                    ([int(_k) for _k in keys],))
+        found = {_r[0] for _r in cur.fetchall()}
+    return found
+
+
+def load_catalog(conn, tables, check_existing=True):
+    """Validate and load catalog rows into ORIGIN, NETMAG, and EVENT with `COPY`
+    in a single transaction
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param tables: table names ('origin', 'netmag', 'event') and rows to load, using
+        table column names (e.g., from :meth:`~.map_columns`). ORIGIN `datetime` values
+        must be UTC (UNIX) epoch seconds or datetime-like values.
+    :type tables: dict of pandas.DataFrame
+    :param check_existing: reject rows whose primary key is already present in the
+        database? Defaults to True
+    :type check_existing: bool, optional
+    :return: number of rows loaded per table and all rejected rows (with `table`
+        and `reason` columns)
+    :rtype: tuple (dict, pandas.DataFrame)
+    """
+    unknown = set(tables).difference(LOAD_ORDER)
+    if unknown:
+        raise KeyError(f'Unsupported tables: {sorted(unknown)}')
+    is_true = timebase_is_true(conn)
+    valid = {}
+    rejected = []
+    for table in [_t for _t in LOAD_ORDER if _t in tables]:
+        df = tables[table]
+        if table == 'origin':
+            df = df.assign(datetime=utc2dbtime_column(df['datetime'], is_true=is_true))
+        good, bad = validate_rows(table, df)
+        if check_existing and len(good) > 0:
+            key = TABLE_SPECS[table]['key']
+            found = existing_keys(conn, table, good[key].to_numpy())
+            dup = good[key].isin(found).to_numpy()
+            count(f'validate.{table}', rejected=int(dup.sum()))
+            bad = pd.concat([bad, good[dup].assign(reason=f'{key} exists')])
+            good = good[~dup]
+        valid[table] = good
+        rejected.append(bad.assign(table=table))
+    counts = {}
+    with conn.cursor() as cur:
+        try:
+            for table, df in valid.items():
+                columns = [_c for _c in TABLE_SPECS[table]['columns'] if _c in df.columns]
+                counts[table] = copy_frame(cur, table, cast_integers(table, df), columns=columns)
+        except Exception:
+            conn.rollback()
+            raise
+    with stage('commit.catalog', round_trips=1):
+        conn.commit()
+    return counts, pd.concat(rejected)
@@ -8,15 +8,21 @@ purpose: This script launches a user prompt to provide the relevant connection p
 
     It then creates the database and populates select parametric schema tables and stored procedures
     used in AQMS (ANSS Quake Management System) production systems as defined by the contents
-    of the accompanying `schema` and `stored_procedures` directories, respectively.
+    of the accompanying `schema` and `stored_procedures` directories, respectively, along with
+    the secondary indexes in `indexes/create_indexes.sql` (installed last, as they include
+    expression indexes on the fast-path TrueTime functions).
 """
 
+import sys
 from pathlib import Path
-import psycopg2, glob, os
 from getpass import getpass
 
+import psycopg2
+
 # Get absolute path to repository root directory
 ROOT = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT/'src'))
+from postgresql.install import create_database, install_schema
 
 print("Provide the host name / IP address for your PostgreSQL server: [e.g., localhost]")
 host = input()
@@ -26,26 +32,15 @@ print("Provide the name of a server superuser: [e.g., postgres]")
 user = input()
 print("Provide the name of the database you wish to create:")
 dbname = input()
+password = getpass(f"Provide the password for user `{user}`:")
 
 # Create database
-print(f'CREATING DATABASE {dbname}! Please provide password for `{user}` when prompted.')
-cmd = f'psql -U {user} -h {host} -p {port} -W -c "CREATE DATABASE {dbname};"'
-os.system(cmd)
+print(f'CREATING DATABASE {dbname}')
+create_database(dbname, host=host, port=port, user=user, password=password, dbname='postgres')
 
-# Open connection to new database (and have implicit connection closure if script ends or fails)
+# Install parametric tables, stored procedures, and secondary indexes in one transaction
 print(f'CONNECTING TO DATABASE')
-with psycopg2.connect(host=host, port=port, user=user, password=getpass(f"Provide the password for user `{user}` to connect:"), dbname=dbname) as conn:
-
-    # Initialize parametric tables
-    sqlfiles = glob.glob(str(ROOT/'schema'/'create_*.sql'))
-    for sqlfile in sqlfiles:
-        with conn.cursor() as cur:
-            cur.execute(open(sqlfile, 'r').read())
-            
-    # Initialize stored procedures
-    with conn.cursor() as cur:
-        cur.execute(open(str(ROOT/'stored_procedures'/'truetime.sql'), 'r').read())
-        cur.execute(open(str(ROOT/'stored_procedures'/'Init_Leap_Secs.sql'), 'r').read())
-
-    # Commit alterations
-    conn.commit()
+with psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname) as conn:
+    for _name in install_schema(conn):
+        print(f'INSTALLED {_name}')
+conn.close()
@@ -0,0 +1,126 @@
+"""
+module: postgresql.install
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module contains non-interactive methods for creating an AQMS PostgreSQL
+    style database and installing the parametric schema tables (`postgresql/schema`),
+    the TrueTime stored procedures and LEAP_SECONDS contents (`postgresql/stored_procedures`),
+    and secondary indexes (`postgresql/indexes/create_indexes.sql`), and optionally the
+    matched-filter extended schema (`postgresql/extended_schema/matched_filter`), without
+    shelling out to the `psql` command line client. ARRIVAL and XCORR can optionally be
+    installed as partitioned tables (`postgresql/partitioned`).
+
+    All scripts are executed on a single cursor in a single transaction, so a failed
+    installation leaves no partially initialized schema behind.
+"""
+
+from pathlib import Path
+
+import psycopg2
+from psycopg2 import sql
+
+ROOT = Path(__file__).parent.parent.parent
+SCHEMA_DIR = ROOT/'postgresql'/'schema'
+# Stored procedure scripts, in installation order
+PROCEDURES = [ROOT/'postgresql'/'stored_procedures'/'truetime.sql',
+              ROOT/'postgresql'/'stored_procedures'/'Init_Leap_Secs.sql',
+              ROOT/'postgresql'/'stored_procedures'/'truetime_fast.sql']
+INDEX_SQL = ROOT/'postgresql'/'indexes'/'create_indexes.sql'
+MATCHED_FILTER_DIR = ROOT/'postgresql'/'extended_schema'/'matched_filter'
+# Partitioned variants of ARRIVAL and XCORR (see `postgresql.partitions`)
+PARTITIONED_DIR = ROOT/'postgresql'/'partitioned'
+# Matched-filter extended schema tables, in foreign key dependency order
+MATCHED_FILTER_TABLES = ['TEMPLATE', 'DETECTION', 'DCLUSTER', 'ASSOCDEC', 'ASSOCARD',
+                         'ASSOCART', 'ASSOCAWF', 'STACHAN', 'WFTRACE', 'XCORR', 'XCORR_PACKED']
+
+
+def create_database(dbname, **admin_kwargs):
+    """Create a new database on a running PostgreSQL server
+
+    :param dbname: name of the new database
+    :type dbname: str
+    :param admin_kwargs: connection parameters for a user allowed to create databases
+        (e.g., host, port, user, password), passed to `psycopg2.connect`
+    :type admin_kwargs: dict
+    """
+    conn = psycopg2.connect(**admin_kwargs)
+    try:
+        # CREATE DATABASE cannot run inside a transaction block
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL('CREATE DATABASE {};').format(sql.Identifier(dbname)))
+    finally:
+        conn.close()
+
+
+def _partitioned(scripts, partitioned):
+    """Swap in partitioned variants of scripts with the same file name"""
+    if not partitioned:
+        return scripts
+    return [PARTITIONED_DIR/_s.name if (PARTITIONED_DIR/_s.name).exists() else _s
+            for _s in scripts]
+
+
+def install_schema(conn, schema_dir=SCHEMA_DIR, procedures=PROCEDURES, indexes=True,
+                   partitioned=False):
+    """Install schema tables, stored procedures, and secondary indexes in one transaction
+
+    :param conn: connection to the (empty) target database
+    :type conn: psycopg2.extensions.connection
+    :param schema_dir: directory of `create_*.sql` table scripts, defaults to SCHEMA_DIR
+    :type schema_dir: pathlib.Path, optional
+    :param procedures: stored procedure scripts in installation order, defaults to PROCEDURES
+    :type procedures: list of pathlib.Path, optional
+    :param indexes: install secondary indexes (after stored procedures, as they include
+        expression indexes on TrueTime functions)? Defaults to True
+    :type indexes: bool, optional
+    :param partitioned: create ARRIVAL as a range-partitioned table (see
+        `postgresql/partitioned` and :mod:`~postgresql.partitions`)? Defaults to False
+    :type partitioned: bool, optional
+    :return: names of the executed scripts
+    :rtype: list of str
+    """
+    scripts = _partitioned(sorted(Path(schema_dir).glob('create_*.sql')), partitioned)
+    scripts += [Path(_p) for _p in procedures]
+    if indexes:
+        scripts.append(Path(INDEX_SQL))
+    try:
+        with conn.cursor() as cur:
+            for _s in scripts:
+                cur.execute(_s.read_text())
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    conn.commit()
+    return [_s.name for _s in scripts]
+
+
+def install_extended_schema(conn, tables=MATCHED_FILTER_TABLES, schema_dir=MATCHED_FILTER_DIR,
+                            partitioned=False):
+    """Install matched-filter extended schema tables in one transaction. Requires the
+    parametric schema tables they reference (see :meth:`~.install_schema`)
+
+    :param conn: connection to the target database
+    :type conn: psycopg2.extensions.connection
+    :param tables: table names to create, in dependency order, defaults to MATCHED_FILTER_TABLES
+    :type tables: list of str, optional
+    :param schema_dir: directory of `create_<TABLE>.sql` scripts, defaults to MATCHED_FILTER_DIR
+    :type schema_dir: pathlib.Path, optional
+    :param partitioned: create XCORR as a hash-partitioned table? Required if ARRIVAL
+        was installed partitioned. Defaults to False
+    :type partitioned: bool, optional
+    :return: names of the executed scripts
+    :rtype: list of str
+    """
+    scripts = _partitioned([Path(schema_dir)/f'create_{_t.upper()}.sql' for _t in tables],
+                           partitioned)
+    try:
+        with conn.cursor() as cur:
+            for _s in scripts:
+                cur.execute(_s.read_text())
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    conn.commit()
+    return [_s.name for _s in scripts]
@@ -0,0 +1,512 @@
+"""
+module: postgresql.matched_filter
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides a streaming, bulk ingestion path for matched-filter
+    (EQcorrscan) outputs into the extended schema tables in
+    `postgresql/extended_schema/matched_filter`:
+     - DETECTION: one row per EQcorrscan `Detection` in a `Party`
+     - ASSOCARD: one row per detection pick inherited from a template arrival
+     - XCORR: one row per event pair of a cross-correlation matrix
+     - XCORR_PACKED: one row per reference arrival of a cross-correlation matrix, with
+        the test arrivals, correlation values, and shifts of its pairs in arrays
+        (see :meth:`~.pack_xcorr` and the XCORR_UNPACKED view)
+
+    Rows are generated as DataFrame chunks of at most **chunksize** rows and are
+    loaded with one `COPY` and one transaction per chunk
+    (see :meth:`~postgresql.bulk.copy_stream`), so memory use is bounded by the chunk
+    size rather than by the number of detections or correlation pairs. Correlation
+    matrices are read in blocks of rows, so they may be `numpy.memmap` arrays
+    (e.g., from `numpy.load(..., mmap_mode='r')`) larger than memory.
+
+    EQcorrscan objects are accessed by attribute (duck-typed), so EQcorrscan is
+    not required to import this module.
+
+    DEIDs are assigned in `Party` iteration order from an explicit `deid_start`, so
+    re-loading the same `Party` with the same `deid_start` reproduces the same rows.
+    With `resume=True`, :meth:`~.load_detections` and :meth:`~.load_xcorr` drop rows
+    that are already present (one indexed lookup per chunk), so a run that failed part way
+    through can simply be re-run without duplicating the chunks it committed.
+
+Note on time format for the ANSS parametric schema
+ - datetime: DETECTION `datetime` values are converted from UTC (UNIX) epoch seconds
+    to database time client-side (see :meth:`~postgresql.bulk.utc2dbtime_column`)
+"""
+
+import numpy as np
+import pandas as pd
+
+from sqlite.metrics import count, stage
+
+from .bulk import copy_stream, timebase_is_true, utc2dbtime_column
+
+# Column order of the DETECTION, ASSOCARD, and XCORR tables, less LDDATE
+# (see `postgresql/extended_schema/matched_filter/create_*.sql`)
+DETECTION_COLUMNS = ['deid', 'teid', 'name', 'datetime', 'nbc', 'dval', 'thresh', 'dtype',
+                     'ttype', 'thresh_in', 'dt_d0', 'dt_t0', 'fpath', 'fname']
+ASSOCARD_COLUMNS = ['deid', 'arid', 'daoff', 'chan_det_val', 'cc_val', 'cc_shift', 'shiftmax']
+XCORR_COLUMNS = ['ievid', 'iarid', 'jevid', 'jarid', 'samp_rate', 'cc_val', 'cc_shift', 'shmax']
+XCORR_PACKED_COLUMNS = ['ievid', 'iarid', 'samp_rate', 'shmax', 'jevids', 'jarids', 'cc_vals',
+                        'cc_shifts']
+# Keys shared by all pairs in one XCORR_PACKED row and the packed (array) columns
+_PACK_KEYS = ['ievid', 'iarid', 'samp_rate', 'shmax']
+_PACKED = {'jevids': ('jevid', np.int64), 'jarids': ('jarid', np.int64),
+           'cc_vals': ('cc_val', np.float32), 'cc_shifts': ('cc_shift', np.int16)}
+
+
+def _timestamp(t):
+    """UTC epoch seconds of an obspy UTCDateTime (or a number)"""
+    return float(getattr(t, 'timestamp', t))
+
+
+def _batched(records, columns, chunksize):
+    """Group an iterable of row tuples into DataFrames of at most **chunksize** rows"""
+    batch = []
+    for _r in records:
+        batch.append(_r)
+        if len(batch) == chunksize:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch, columns=columns)
+
+
+def iter_party(party, deid_start=1):
+    """Iterate over the detections of an EQcorrscan `Party` (or any iterable of
+    `Family` objects with a `detections` attribute), assigning sequential DEIDs
+    in iteration order
+
+    :param party: EQcorrscan Party
+    :type party: eqcorrscan.core.match_filter.Party
+    :param deid_start: DEID of the first detection, defaults to 1
+    :type deid_start: int, optional
+    :return: generator of (deid, detection) tuples
+    :rtype: generator
+    """
+    deid = deid_start
+    for _family in party:
+        for _det in _family.detections:
+            yield deid, _det
+            deid += 1
+
+
+def iter_detection_frames(party, templates, deid_start=1, is_true=True, chunksize=100000,
+                          fpath=None, fname=None):
+    """Render the detections of an EQcorrscan `Party` into chunks of DETECTION rows
+
+    EQcorrscan detection times (`detect_time`) are the start time of the first sample
+    of the template aligned on the data, so detection origin times are reconstituted
+    using the template's origin time relative to its start time:
+     - datetime = detect_time + (origin - start)
+     - dt_d0 = detect_time - datetime
+     - dt_t0 = datetime - origin
+
+    :param party: EQcorrscan Party
+    :type party: eqcorrscan.core.match_filter.Party
+    :param templates: template metadata indexed by template name with columns `teid`,
+        `origin` (template origin time) and `start` (template start time), both in UTC
+        (UNIX) epoch seconds
+    :type templates: pandas.DataFrame
+    :param deid_start: DEID of the first detection, defaults to 1 (see :meth:`~.iter_party`)
+    :type deid_start: int, optional
+    :param is_true: is the database timebase TRUE? Defaults to True
+    :type is_true: bool, optional
+    :param chunksize: maximum rows per chunk, defaults to 100000
+    :type chunksize: int, optional
+    :param fpath: detection file path to record, defaults to None
+    :type fpath: str, optional
+    :param fname: detection file name to record, defaults to None
+    :type fname: str, optional
+    :return: generator of DETECTION DataFrames
+    :rtype: generator
+    """
+    missing = {'teid', 'origin', 'start'}.difference(templates.columns)
+    if missing:
+        raise KeyError(f'Missing required template columns: {sorted(missing)}')
+    records = ((_deid, _det.template_name, _timestamp(_det.detect_time), _det.no_chans,
+                _det.detect_val, _det.threshold, _det.typeofdet, _det.threshold_type,
+                _det.threshold_input)
+               for _deid, _det in iter_party(party, deid_start=deid_start))
+    columns = ['deid', 'name', 'detect_time', 'nbc', 'dval', 'thresh', 'dtype', 'ttype',
+               'thresh_in']
+    for _chunk in _batched(records, columns, chunksize):
+        _tmp = templates.loc[_chunk['name'], ['teid', 'origin', 'start']].to_numpy()
+        _utc = _chunk['detect_time'].to_numpy() + (_tmp[:, 1] - _tmp[:, 2]).astype(np.float64)
+        _chunk = _chunk.assign(teid=_tmp[:, 0].astype(np.int64),
+                               datetime=utc2dbtime_column(_utc, is_true=is_true),
+                               dt_d0=_chunk['detect_time'].to_numpy() - _utc,
+                               dt_t0=_utc - _tmp[:, 1].astype(np.float64),
+                               fpath=fpath, fname=fname)
+        yield _chunk[DETECTION_COLUMNS]
+
+
+def _channel_values(detection):
+    """Per-channel detection values keyed by (station, channel), if EQcorrscan recorded
+    them in `Detection.chans` as (station, channel, value) tuples"""
+    return {tuple(_c[:2]): _c[2] for _c in (detection.chans or []) if len(_c) > 2}
+
+
+def _pick_cc(pick):
+    """Correlation re-alignment value written by `eqcorrscan...lag_calc` as a
+    `cc_max=<value>` pick comment, if present"""
+    for _c in getattr(pick, 'comments', []) or []:
+        if _c.text.startswith('cc_max='):
+            # float32 rounding can put values just outside ASSOCARD01
+            return min(max(float(_c.text.split('=', 1)[1]), -1.), 1.)
+    return None
+
+
+def iter_assocard_frames(party, template_arrivals, deid_start=1, shiftmax=None,
+                         chunksize=100000):
+    """Render the picks of EQcorrscan detections (`Detection.event.picks`) into
+    chunks of ASSOCARD rows, linking each pick to the ARRIVAL of its template
+
+    Picks are matched on (template name, SEED id, phase hint). Picks without a
+    matching template arrival are skipped. The channel detection value is taken from
+    `Detection.chans` when it carries per-channel values, otherwise the mean channel
+    value (`detect_val / no_chans`) is used. Correlation re-alignment values are
+    taken from `cc_max=` pick comments (see `lag_calc`).
+
+    :param party: EQcorrscan Party with detection events populated
+    :type party: eqcorrscan.core.match_filter.Party
+    :param template_arrivals: template arrivals with columns `name` (template name),
+        `seed_id` (NET.STA.LOC.CHAN), `phase`, `arid`, and `time` (UTC epoch seconds)
+    :type template_arrivals: pandas.DataFrame
+    :param deid_start: DEID of the first detection, defaults to 1. Must match the
+        value used for :meth:`~.iter_detection_frames`
+    :type deid_start: int, optional
+    :param shiftmax: maximum re-alignment shift assessed in seconds, defaults to None
+    :type shiftmax: float, optional
+    :param chunksize: maximum rows per chunk, defaults to 100000
+    :type chunksize: int, optional
+    :return: generator of ASSOCARD DataFrames
+    :rtype: generator
+    """
+    lookup = {(_n, _s, _p): (int(_a), float(_t)) for _n, _s, _p, _a, _t in
+              template_arrivals[['name', 'seed_id', 'phase', 'arid', 'time']].itertuples(index=False)}
+
+    def _records():
+        for _deid, _det in iter_party(party, deid_start=deid_start):
+            if _det.event is None:
+                continue
+            _chans = _channel_values(_det)
+            _mean = _det.detect_val / _det.no_chans if _det.no_chans else _det.detect_val
+            _seen = set()
+            for _pick in _det.event.picks:
+                _wid = _pick.waveform_id
+                _match = lookup.get((_det.template_name, _wid.get_seed_string(), _pick.phase_hint))
+                if _match is None or _match[0] in _seen:
+                    continue
+                _seen.add(_match[0])
+                yield (_deid, _match[0], _timestamp(_pick.time) - _match[1],
+                       _chans.get((_wid.station_code, _wid.channel_code), _mean),
+                       _pick_cc(_pick), None, shiftmax)
+
+    yield from _batched(_records(), ASSOCARD_COLUMNS, chunksize)
+
+
+def iter_xcorr_frames(ccc, evids, arids, samp_rate, shmax, shifts=None, symmetric=True,
+                      min_cc=None, chunksize=1000000):
+    """Render a cross-correlation matrix into chunks of XCORR rows
+
+    Element [i, j] of **ccc** (and **shifts**) is the correlation of the arrival
+    **arids** [j] of event **evids** [j] (test) against the arrival **arids** [i] of
+    event **evids** [i] (reference). Non-finite elements (e.g., events without data on
+    the correlated channel) and the diagonal are skipped.
+
+    The matrix is read in blocks of whole rows holding about **chunksize** elements,
+    so only one block and one chunk of rows are held in memory at a time.
+
+    :param ccc: square matrix of correlation coefficients
+    :type ccc: numpy.ndarray or numpy.memmap
+    :param evids: event IDs of the matrix rows/columns
+    :type evids: array-like of int
+    :param arids: arrival IDs of the matrix rows/columns
+    :type arids: array-like of int
+    :param samp_rate: sampling rate of the correlated data in Hz
+    :type samp_rate: float
+    :param shmax: maximum shift assessed in samples
+    :type shmax: int
+    :param shifts: square matrix of shifts in samples, defaults to None (CC_SHIFT is
+        omitted from the chunks and loads as NULL)
+    :type shifts: numpy.ndarray or numpy.memmap, optional
+    :param symmetric: is **ccc** symmetric? If True, only the upper triangle (i < j) is
+        loaded. Defaults to True
+    :type symmetric: bool, optional
+    :param min_cc: skip pairs with absolute correlation below this value, defaults to None
+    :type min_cc: float, optional
+    :param chunksize: approximate number of matrix elements per chunk, defaults to 1000000
+    :type chunksize: int, optional
+    :return: generator of XCORR DataFrames
+    :rtype: generator
+    """
+    nevents = ccc.shape[0]
+    if ccc.shape != (nevents, nevents) or (shifts is not None and shifts.shape != ccc.shape):
+        raise ValueError('ccc and shifts must be square matrices of the same shape')
+    evids = np.asarray(evids, dtype=np.int64)
+    arids = np.asarray(arids, dtype=np.int64)
+    if len(evids) != nevents or len(arids) != nevents:
+        raise ValueError('evids and arids must have one entry per matrix row')
+    step = max(1, chunksize // nevents)
+    columns = np.arange(nevents)
+    for _i0 in range(0, nevents, step):
+        _rows = np.arange(_i0, min(_i0 + step, nevents))
+        _block = np.asarray(ccc[_rows[0]:_rows[-1] + 1], dtype=np.float32)
+        _mask = np.isfinite(_block)
+        if symmetric:
+            _mask &= columns[np.newaxis, :] > _rows[:, np.newaxis]
+        else:
+            _mask &= columns[np.newaxis, :] != _rows[:, np.newaxis]
+        if min_cc is not None:
+            _mask &= np.abs(_block) >= min_cc
+        _ii, _jj = np.nonzero(_mask)
+        if len(_ii) == 0:
+            continue
+        _chunk = pd.DataFrame({'ievid': evids[_rows[_ii]], 'iarid': arids[_rows[_ii]],
+                               'jevid': evids[_jj], 'jarid': arids[_jj],
+                               'samp_rate': np.float32(samp_rate),
+                               # float32 rounding can put values just outside XCORR01
+                               'cc_val': np.clip(_block[_ii, _jj], -1., 1.)})
+        if shifts is not None:
+            _shift = np.asarray(shifts[_rows[0]:_rows[-1] + 1])[_ii, _jj]
+            _chunk['cc_shift'] = np.rint(_shift).astype(np.int32)
+        _chunk['shmax'] = np.int32(shmax)
+        yield _chunk
+
+
+def pack_xcorr(df):
+    """Pack XCORR rows into XCORR_PACKED rows, one per reference (ievid, iarid,
+    samp_rate, shmax) with the pairs' values in numpy arrays
+
+    :param df: rows in the XCORR layout (`cc_shift` is optional)
+    :type df: pandas.DataFrame
+    :return: rows in the XCORR_PACKED layout (`cc_shifts` is None if **df** has no
+        `cc_shift` column)
+    :rtype: pandas.DataFrame
+    :raises ValueError: if a `cc_shift` or `shmax` value does not fit the SMALLINT
+        columns of XCORR_PACKED (load such matrices into XCORR instead)
+    """
+    if len(df) == 0:
+        return pd.DataFrame(columns=XCORR_PACKED_COLUMNS)
+    limits = np.iinfo(np.int16)
+    for _col in ('shmax', 'cc_shift'):
+        if _col in df.columns and ((df[_col] < limits.min) | (df[_col] > limits.max)).any():
+            raise ValueError(f'{_col} values outside [{limits.min}, {limits.max}] do not fit '
+                             'XCORR_PACKED, load into XCORR instead')
+    df = df.sort_values(_PACK_KEYS, kind='stable')
+    keys = df[_PACK_KEYS].to_numpy()
+    starts = np.flatnonzero(np.r_[len(df) > 0, (keys[1:] != keys[:-1]).any(axis=1)])
+    packed = df[_PACK_KEYS].iloc[starts].reset_index(drop=True)
+    for _col, (_src, _dtype) in _PACKED.items():
+        if _src in df.columns:
+            packed[_col] = np.split(df[_src].to_numpy().astype(_dtype), starts[1:])
+        else:
+            packed[_col] = None
+    return packed
+
+
+def unpack_xcorr(packed):
+    """Unpack XCORR_PACKED rows (e.g., from :meth:`~.pack_xcorr` or :meth:`~.fetch_xcorr`)
+    into the XCORR layout, as done by the XCORR_UNPACKED view
+
+    :param packed: rows in the XCORR_PACKED layout
+    :type packed: pandas.DataFrame
+    :return: rows in the XCORR layout (`cc_shift` is a nullable integer column)
+    :rtype: pandas.DataFrame
+    """
+    lengths = np.fromiter((len(_v) for _v in packed['jarids']), dtype=np.int64, count=len(packed))
+    df = pd.DataFrame({_k: np.repeat(packed[_k].to_numpy(), lengths) for _k in _PACK_KEYS})
+    for _col, (_dest, _dtype) in _PACKED.items():
+        # Missing shift arrays unpack to NULL (NaN, then NA) shifts
+        _values = [np.full(_n, np.nan) if _v is None else np.asarray(_v, dtype=np.float64)
+                   for _v, _n in zip(packed[_col], lengths)]
+        df[_dest] = np.concatenate(_values) if _values else np.array([])
+        df[_dest] = df[_dest].astype(_dtype if _col != 'cc_shifts' else 'Int32')
+    return df[XCORR_COLUMNS]
+
+
+def _array_literals(values):
+    """Render a column of numpy arrays as PostgreSQL array literals for `COPY`. Floats
+    are written with 9 significant digits, which round-trips float32 (REAL) values."""
+    literals = []
+    for _v in values:
+        if _v is None:
+            literals.append(None)
+            continue
+        _fmt = '{:.9g}'.format if _v.dtype.kind == 'f' else str
+        literals.append('{' + ','.join(map(_fmt, _v.tolist())) + '}')
+    return literals
+
+
+def iter_xcorr_packed_frames(ccc, evids, arids, samp_rate, shmax, chunksize=1000000, **kwargs):
+    """Render a cross-correlation matrix into chunks of XCORR_PACKED rows with array
+    literal columns ready for `COPY`. Matrix rows are never split across chunks, so each
+    reference arrival of the matrix produces a single row (see :meth:`~.iter_xcorr_frames`
+    for parameters)
+
+    :return: generator of XCORR_PACKED DataFrames
+    :rtype: generator
+    """
+    for _chunk in iter_xcorr_frames(ccc, evids, arids, samp_rate, shmax, chunksize=chunksize,
+                                    **kwargs):
+        _packed = pack_xcorr(_chunk)
+        for _col in _PACKED:
+            _packed[_col] = _array_literals(_packed[_col])
+        yield _packed[XCORR_PACKED_COLUMNS]
+
+
+def fetch_xcorr(conn, ievids=None, unpack=True):
+    """Fetch XCORR_PACKED rows, decoding their arrays into numpy arrays
+
+    :param conn: connection to an AQMS PostgreSQL style database with XCORR_PACKED
+    :type conn: psycopg2.extensions.connection
+    :param ievids: reference event IDs to fetch, defaults to None (all rows)
+    :type ievids: list of int, optional
+    :param unpack: unpack into the XCORR layout (see :meth:`~.unpack_xcorr`)?
+        Defaults to True
+    :type unpack: bool, optional
+    :return: cross-correlation results
+    :rtype: pandas.DataFrame
+    """
+    query = f"SELECT {', '.join(XCORR_PACKED_COLUMNS)} FROM xcorr_packed"
+    params = ()
+    if ievids is not None:
+        query += " WHERE ievid = ANY(%s)"
+        params = ([int(_e) for _e in ievids],)
+    with conn.cursor() as cur:
+        cur.execute(query + ';', params)
+        packed = pd.DataFrame(cur.fetchall(), columns=XCORR_PACKED_COLUMNS)
+    conn.commit()
+    for _col, (_src, _dtype) in _PACKED.items():
+        packed[_col] = [None if _v is None else np.asarray(_v, dtype=_dtype) for _v in packed[_col]]
+    if unpack:
+        return unpack_xcorr(packed)
+    return packed
+
+
+def _drop_present(conn, table, chunk, keys, fixed=()):
+    """Drop rows of **chunk** whose **keys** are already present in **table**, using one
+    query over the distinct values of the first key (which must lead an index of
+    **table**). Columns in **fixed** hold one value per chunk and are compared in the query."""
+    query = (f"SELECT DISTINCT {', '.join(keys)} FROM {table} WHERE {keys[0]} = ANY(%s)"
+             + ''.join(f" AND {_c} = %s" for _c in fixed) + ';')
+    params = [[int(_v) for _v in pd.unique(chunk[keys[0]])]]
+    params += [chunk[_c].iloc[0].item() for _c in fixed]
+    with stage(f'existing_keys.{table}', rows=len(chunk), round_trips=2), conn.cursor() as cur:
+        cur.execute(query, params)
+        found = pd.DataFrame(cur.fetchall(), columns=keys)
+        conn.commit()
+    present = pd.MultiIndex.from_frame(chunk[keys]).isin(pd.MultiIndex.from_frame(found))
+    count(f'existing_keys.{table}', rejected=int(present.sum()))
+    return chunk[~present]
+
+
+def _resume(conn, table, frames, keys, fixed=()):
+    """Apply :meth:`~._drop_present` to each chunk of **frames**"""
+    for _chunk in frames:
+        if len(_chunk) > 0:
+            yield _drop_present(conn, table, _chunk, keys, fixed=fixed)
+
+
+def load_detections(conn, party, templates, deid_start, template_arrivals=None,
+                    shiftmax=None, chunksize=100000, resume=True, progress=True, **kwargs):
+    """Stream an EQcorrscan `Party` into the DETECTION table and, optionally, its
+    detection picks into the ASSOCARD table
+
+    DEIDs are assigned in `Party` iteration order starting at **deid_start**, so a
+    `Party` must always be loaded with the same **deid_start**. Reserve a DEID range
+    per `Party` (e.g., one more than the current max(deid) when it is first loaded) and
+    record it alongside the `Party`.
+
+    :param conn: connection to an AQMS PostgreSQL style database with the matched
+        filter extended schema installed
+    :type conn: psycopg2.extensions.connection
+    :param party: EQcorrscan Party
+    :type party: eqcorrscan.core.match_filter.Party
+    :param templates: template metadata (see :meth:`~.iter_detection_frames`)
+    :type templates: pandas.DataFrame
+    :param deid_start: DEID of the first detection of **party**
+    :type deid_start: int
+    :param template_arrivals: template arrivals (see :meth:`~.iter_assocard_frames`),
+        defaults to None (do not load ASSOCARD)
+    :type template_arrivals: pandas.DataFrame, optional
+    :param shiftmax: see :meth:`~.iter_assocard_frames`
+    :type shiftmax: float, optional
+    :param chunksize: rows per COPY/transaction, defaults to 100000
+    :type chunksize: int, optional
+    :param resume: skip DETECTION rows whose DEID and ASSOCARD rows whose (DEID, ARID)
+        are already present, e.g., from an earlier run that failed part way through?
+        Defaults to True
+    :type resume: bool, optional
+    :param progress: show progress bars? Defaults to True
+    :type progress: bool, optional
+    :param kwargs: key-word arguments passed to :meth:`~.iter_detection_frames`
+        (`fpath`, `fname`)
+    :return: number of rows loaded per table
+    :rtype: dict
+    """
+    frames = iter_detection_frames(party, templates, deid_start=deid_start,
+                                   is_true=timebase_is_true(conn), chunksize=chunksize, **kwargs)
+    if resume:
+        frames = _resume(conn, 'detection', frames, ['deid'])
+    counts = {'detection': copy_stream(conn, 'detection', frames, progress=progress)}
+    if template_arrivals is not None:
+        frames = iter_assocard_frames(party, template_arrivals, deid_start=deid_start,
+                                      shiftmax=shiftmax, chunksize=chunksize)
+        if resume:
+            frames = _resume(conn, 'assocard', frames, ['deid', 'arid'])
+        counts['assocard'] = copy_stream(conn, 'assocard', frames, progress=progress)
+    return counts
+
+
+def load_xcorr(conn, ccc, evids, arids, samp_rate, shmax, chunksize=1000000, packed=False,
+               resume=True, progress=True, **kwargs):
+    """Stream a cross-correlation matrix into the XCORR (or XCORR_PACKED) table with one
+    COPY/transaction per chunk (see :meth:`~.iter_xcorr_frames`)
+
+    Each chunk holds whole matrix rows, so after a failure a reference arrival's pairs are
+    either all loaded or not at all. With **resume**, rows of reference arrivals (IEVID,
+    IARID) already present for the same **samp_rate** and **shmax** are skipped, so a
+    failed load can be re-run. This assumes each reference arrival appears in only one
+    matrix per **samp_rate** and **shmax**; use `resume=False` otherwise.
+
+    :param conn: connection to an AQMS PostgreSQL style database with the matched
+        filter extended schema installed
+    :type conn: psycopg2.extensions.connection
+    :param ccc: square matrix of correlation coefficients
+    :type ccc: numpy.ndarray or numpy.memmap
+    :param evids: event IDs of the matrix rows/columns
+    :type evids: array-like of int
+    :param arids: arrival IDs of the matrix rows/columns
+    :type arids: array-like of int
+    :param samp_rate: sampling rate of the correlated data in Hz
+    :type samp_rate: float
+    :param shmax: maximum shift assessed in samples
+    :type shmax: int
+    :param chunksize: approximate number of matrix elements per chunk, defaults to 1000000
+    :type chunksize: int, optional
+    :param packed: load into XCORR_PACKED (see :meth:`~.iter_xcorr_packed_frames`)?
+        Shifts and **shmax** must then fit in 16 bits (see :meth:`~.pack_xcorr`).
+        Defaults to False
+    :type packed: bool, optional
+    :param resume: skip reference arrivals that are already loaded? Defaults to True
+    :type resume: bool, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :param kwargs: key-word arguments passed to :meth:`~.iter_xcorr_frames`
+        (`shifts`, `symmetric`, `min_cc`)
+    :return: number of rows loaded
+    :rtype: int
+    """
+    if packed:
+        table = 'xcorr_packed'
+        frames = iter_xcorr_packed_frames(ccc, evids, arids, samp_rate, shmax,
+                                          chunksize=chunksize, **kwargs)
+    else:
+        table = 'xcorr'
+        frames = iter_xcorr_frames(ccc, evids, arids, samp_rate, shmax, chunksize=chunksize,
+                                   **kwargs)
+    if resume:
+        frames = _resume(conn, table, frames, ['ievid', 'iarid'], fixed=['samp_rate', 'shmax'])
+    return copy_stream(conn, table, frames, progress=progress)
@@ -0,0 +1,215 @@
+"""
+module: postgresql.matching
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides client-side, vectorized methods for matching catalog
+    entries to origins already present in an AQMS PostgreSQL style database.
+
+    Candidate origins are pulled from the database once, sorted by time, and every
+    catalog entry is resolved against them in a single batch: a binary search on the
+    sorted times bounds each entry's candidate set to its time window, and great-circle
+    distances are only computed for those candidates. This replaces issuing one
+    time/space window query per catalog entry.
+
+    Phase picks are matched to unassociated ARRIVAL rows in the same way: arrivals are
+    fetched once and joined to picks with a nearest-time, tolerance-bounded merge per
+    (network, station, phase).
+"""
+
+import numpy as np
+import pandas as pd
+
+from sqlite.metrics import stage
+
+from .bulk import dbtime2utc_column, timebase_is_true
+
+# Mean Earth radius in km
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between points on a spherical Earth
+
+    :param lat1: latitude(s) of the first point(s) in degrees
+    :type lat1: float or numpy.ndarray
+    :param lon1: longitude(s) of the first point(s) in degrees
+    :type lon1: float or numpy.ndarray
+    :param lat2: latitude(s) of the second point(s) in degrees
+    :type lat2: float or numpy.ndarray
+    :param lon2: longitude(s) of the second point(s) in degrees
+    :type lon2: float or numpy.ndarray
+    :return: distance(s) in km
+    :rtype: float or numpy.ndarray
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def window_pairs(query_times, ref_times, max_dt):
+    """Find all (query, reference) index pairs with |query_time - ref_time| <= max_dt
+
+    :param query_times: query times
+    :type query_times: numpy.ndarray
+    :param ref_times: reference times, sorted ascending
+    :type ref_times: numpy.ndarray
+    :param max_dt: time tolerance
+    :type max_dt: float
+    :return: query positions and reference positions of candidate pairs
+    :rtype: tuple of numpy.ndarray
+    """
+    lo = np.searchsorted(ref_times, query_times - max_dt, side='left')
+    hi = np.searchsorted(ref_times, query_times + max_dt, side='right')
+    counts = hi - lo
+    qpos = np.repeat(np.arange(len(query_times)), counts)
+    # Offsets of each pair within its query's [lo, hi) run
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    rpos = np.repeat(lo, counts) + np.arange(counts.sum()) - starts
+    return qpos, rpos
+
+
+def match_origins(query, reference, max_dt=5., max_dist_km=15., time_col='datetime',
+                  lat_col='lat', lon_col='lon'):
+    """Match each query hypocenter to the closest reference hypocenter within a time and
+    epicentral distance tolerance. Candidates are ranked by a combined, normalized misfit
+
+        score = sqrt((dt/max_dt)**2 + (dist/max_dist_km)**2)
+
+    Times in **query** and **reference** must use the same timebase (e.g., both database
+    `datetime` values, see :meth:`~postgresql.bulk.utc2dbtime_column`).
+
+    :param query: hypocenters to match with columns **time_col**, **lat_col**, **lon_col**
+    :type query: pandas.DataFrame
+    :param reference: candidate hypocenters with the same columns (e.g., from
+        :meth:`~.fetch_origins`)
+    :type reference: pandas.DataFrame
+    :param max_dt: maximum absolute time difference in seconds, defaults to 5.
+    :type max_dt: float, optional
+    :param max_dist_km: maximum epicentral distance in km, defaults to 15.
+    :type max_dist_km: float, optional
+    :param time_col: time column name, defaults to 'datetime'
+    :type time_col: str, optional
+    :param lat_col: latitude column name, defaults to 'lat'
+    :type lat_col: str, optional
+    :param lon_col: longitude column name, defaults to 'lon'
+    :type lon_col: str, optional
+    :return: one row per **query** row (same index) with the matched **reference** index
+        label (`ref_index`, NA if unmatched), signed time difference (`dt`, query minus
+        reference), epicentral distance (`dist_km`) and `score`
+    :rtype: pandas.DataFrame
+    """
+    ref = reference.sort_values(time_col, kind='stable')
+    rtimes = ref[time_col].to_numpy(dtype=float)
+    qtimes = query[time_col].to_numpy(dtype=float)
+    qpos, rpos = window_pairs(qtimes, rtimes, max_dt)
+    dt = qtimes[qpos] - rtimes[rpos]
+    dist = haversine_km(query[lat_col].to_numpy(dtype=float)[qpos],
+                        query[lon_col].to_numpy(dtype=float)[qpos],
+                        ref[lat_col].to_numpy(dtype=float)[rpos],
+                        ref[lon_col].to_numpy(dtype=float)[rpos])
+    keep = dist <= max_dist_km
+    qpos, rpos, dt, dist = qpos[keep], rpos[keep], dt[keep], dist[keep]
+    score = np.sqrt((dt/max_dt)**2 + (dist/max_dist_km)**2)
+    # Best (lowest score) candidate per query: sort by (query, score), keep first
+    order = np.lexsort((score, qpos))
+    qpos, rpos, dt, dist, score = qpos[order], rpos[order], dt[order], dist[order], score[order]
+    first = np.ones(len(qpos), dtype=bool)
+    first[1:] = qpos[1:] != qpos[:-1]
+    _q = qpos[first]
+    dtype = 'Int64' if pd.api.types.is_integer_dtype(ref.index) else 'object'
+    ref_index = pd.array([pd.NA]*len(query), dtype=dtype)
+    ref_index[_q] = ref.index.to_numpy()[rpos[first]]
+    out = pd.DataFrame({'ref_index': ref_index}, index=query.index)
+    for _k, _v in [('dt', dt), ('dist_km', dist), ('score', score)]:
+        _col = np.full(len(query), np.nan)
+        _col[_q] = _v[first]
+        out[_k] = _col
+    return out
+
+
+def fetch_origins(conn, tmin, tmax):
+    """Pull candidate origins within a database-time window in a single query
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :param tmin: earliest database `datetime` value
+    :type tmin: float
+    :param tmax: latest database `datetime` value
+    :type tmax: float
+    :return: origins indexed by ORID with columns evid, datetime, lat, lon, depth
+    :rtype: pandas.DataFrame
+    """
+    sql = """
+        SELECT orid, evid, datetime, lat, lon, depth FROM origin
+        WHERE datetime BETWEEN %(tmin)s AND %(tmax)s;
+        """
+    with stage('fetch.origins', round_trips=1):
+        df = pd.read_sql(sql, con=conn, params={'tmin': float(tmin), 'tmax': float(tmax)},
+                         index_col='orid')
+    return df
+
+
+def fetch_unassociated_arrivals(conn):
+    """Pull all ARRIVAL rows without an ASSOCARO entry in a single query, with
+    `datetime` converted to UTC (UNIX) epoch seconds client-side as `time`
+
+    :param conn: connection to an AQMS PostgreSQL style database
+    :type conn: psycopg2.extensions.connection
+    :return: arrivals with columns arid, net, sta, iphase, datetime, time
+    :rtype: pandas.DataFrame
+    """
+    sql = """
+        SELECT a.arid, a.net, a.sta, a.iphase, a.datetime
+        FROM arrival a
+            LEFT JOIN assocaro x ON a.arid = x.arid
+        WHERE x.orid IS NULL;
+        """
+    is_true = timebase_is_true(conn)
+    with stage('fetch.unassociated_arrivals', round_trips=1):
+        df = pd.read_sql(sql, con=conn)
+    df['time'] = dbtime2utc_column(df['datetime'].astype(float), is_true=is_true)
+    return df
+
+
+def match_arrivals(picks, arrivals, tolerance=0.01, by=('net', 'sta', 'iphase'), time_col='time'):
+    """Match picks to arrivals by nearest time within **tolerance** seconds among
+    rows sharing the same **by** values (e.g., network, station, phase)
+
+    Each arrival is assigned to at most one pick; if several picks fall on the
+    same arrival, the closest in time keeps it.
+
+    :param picks: picks to match with columns **by** and **time_col**
+    :type picks: pandas.DataFrame
+    :param arrivals: arrivals with columns `arid`, **by**, and **time_col**
+        (e.g., from :meth:`~.fetch_unassociated_arrivals`)
+    :type arrivals: pandas.DataFrame
+    :param tolerance: maximum absolute time difference in seconds, defaults to 0.01
+    :type tolerance: float, optional
+    :param by: columns that must match exactly, defaults to ('net', 'sta', 'iphase')
+    :type by: tuple of str, optional
+    :param time_col: time column name (UTC epoch seconds), defaults to 'time'
+    :type time_col: str, optional
+    :return: one row per **picks** row (same index) with matched `arid` (NA if
+        unmatched) and signed time difference `dt` (pick minus arrival)
+    :rtype: pandas.DataFrame
+    """
+    by = list(by)
+    left = picks[by + [time_col]].astype({_b: str for _b in by})
+    left = left.assign(_pos=np.arange(len(picks)), **{time_col: left[time_col].astype(float)})
+    right = arrivals[by + [time_col, 'arid']].astype({_b: str for _b in by})
+    right = right.rename(columns={time_col: '_rtime'}).astype({'_rtime': float})
+    merged = pd.merge_asof(left.dropna(subset=[time_col]).sort_values(time_col),
+                           right.dropna(subset=['_rtime']).sort_values('_rtime'),
+                           left_on=time_col, right_on='_rtime', by=by,
+                           tolerance=tolerance, direction='nearest')
+    merged = merged[merged.arid.notna()]
+    merged = merged.assign(dt=merged[time_col] - merged['_rtime'])
+    # Resolve arrivals claimed by more than one pick
+    merged = merged.iloc[np.argsort(merged.dt.abs().to_numpy(), kind='stable')]
+    merged = merged.drop_duplicates(subset='arid', keep='first')
+    arid = pd.array([pd.NA]*len(picks), dtype='Int64')
+    dt = np.full(len(picks), np.nan)
+    arid[merged._pos.to_numpy()] = merged.arid.astype(np.int64).to_numpy()
+    dt[merged._pos.to_numpy()] = merged.dt.to_numpy()
+    return pd.DataFrame({'arid': arid, 'dt': dt}, index=picks.index)
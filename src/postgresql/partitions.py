@@ -0,0 +1,219 @@
+"""
+module: postgresql.partitions
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module contains methods for creating and managing the partitions of the
+    partitioned ARRIVAL and XCORR variants in `postgresql/partitioned` (install them with
+    `postgresql.install.install_schema(conn, partitioned=True)`):
+     - ARRIVAL is range-partitioned on DATETIME, one partition per year or month
+     - XCORR is hash-partitioned on IEVID into a fixed number of partitions
+
+    Large ARRIVAL loads can be staged in a standalone table (no indexes, no routing),
+    then attached as a partition (see :meth:`~.load_arrival_partition`). Old partitions
+    can be detached and archived/dropped without a bulk DELETE.
+
+Note on time format for the ANSS parametric schema
+ - datetime: ARRIVAL partition bounds are database `datetime` values. Bounds are given as
+    UTC datetime-like values and converted to database time client-side
+    (see :meth:`~postgresql.bulk.utc2dbtime_column`), so partitions hold whole UTC years
+    (months) regardless of the database timebase.
+"""
+
+import pandas as pd
+from psycopg2 import sql
+
+from .bulk import copy_chunks, timebase_is_true, utc2dbtime_column
+
+# Partition name suffixes and pandas frequencies for ARRIVAL range partitions
+INTERVALS = {'year': ('YS', 'y%Y'), 'month': ('MS', 'y%Ym%m')}
+
+
+def arrival_partition_bounds(start, end, interval='year', is_true=True):
+    """Get names and database time bounds of ARRIVAL range partitions covering
+    [**start**, **end**)
+
+    :param start: UTC start time, rounded down to the start of the **interval**
+    :type start: str or datetime-like
+    :param end: UTC end time, rounded up to the end of the **interval** (at least one
+        partition is returned)
+    :type end: str or datetime-like
+    :param interval: partition length, 'year' or 'month', defaults to 'year'
+    :type interval: str, optional
+    :param is_true: is the database timebase TRUE? Defaults to True
+    :type is_true: bool, optional
+    :return: partitions with columns name, lower, upper (lower bound inclusive)
+    :rtype: pandas.DataFrame
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f'interval must be one of {list(INTERVALS)}')
+    freq, fmt = INTERVALS[interval]
+    start = pd.Timestamp(start).to_period(freq[0]).start_time
+    end = pd.Timestamp(end)
+    if end <= start or end != end.to_period(freq[0]).start_time:
+        end = (max(end, start).to_period(freq[0]) + 1).start_time
+    edges = pd.date_range(start, end, freq=freq)
+    bounds = utc2dbtime_column(edges.to_numpy(), is_true=is_true)
+    return pd.DataFrame({'name': [f'arrival_{_e.strftime(fmt)}' for _e in edges[:-1]],
+                         'lower': bounds[:-1], 'upper': bounds[1:]})
+
+
+def _range_bound(lower, upper):
+    return sql.SQL('FOR VALUES FROM ({}) TO ({})').format(sql.Literal(float(lower)),
+                                                          sql.Literal(float(upper)))
+
+
+def create_arrival_partitions(conn, start, end, interval='year', default=True):
+    """Create ARRIVAL range partitions covering [**start**, **end**) in one transaction.
+    Existing partitions with the same names are left in place.
+
+    :param conn: connection to a database with the partitioned ARRIVAL table
+    :type conn: psycopg2.extensions.connection
+    :param start: UTC start time
+    :type start: str or datetime-like
+    :param end: UTC end time
+    :type end: str or datetime-like
+    :param interval: partition length, 'year' or 'month', defaults to 'year'
+    :type interval: str, optional
+    :param default: also create the DEFAULT partition `arrival_default` for rows outside
+        all ranges? Defaults to True. Note that attaching a new range partition scans
+        the DEFAULT partition for conflicting rows.
+    :type default: bool, optional
+    :return: names of the partitions
+    :rtype: list of str
+    """
+    bounds = arrival_partition_bounds(start, end, interval=interval,
+                                      is_true=timebase_is_true(conn))
+    stmts = [sql.SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF arrival {};').format(
+                sql.Identifier(_n), _range_bound(_l, _u))
+             for _n, _l, _u in bounds.itertuples(index=False)]
+    names = bounds.name.tolist()
+    if default:
+        stmts.append(sql.SQL('CREATE TABLE IF NOT EXISTS arrival_default PARTITION OF arrival DEFAULT;'))
+        names.append('arrival_default')
+    _execute(conn, stmts)
+    return names
+
+
+def create_xcorr_partitions(conn, modulus=16):
+    """Create the **modulus** hash partitions `xcorr_p00`, `xcorr_p01`, ... of XCORR
+    in one transaction
+
+    :param conn: connection to a database with the partitioned XCORR table
+    :type conn: psycopg2.extensions.connection
+    :param modulus: number of partitions, defaults to 16
+    :type modulus: int, optional
+    :return: names of the partitions
+    :rtype: list of str
+    """
+    names = [f'xcorr_p{_r:02d}' for _r in range(modulus)]
+    stmts = [sql.SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF xcorr '
+                     'FOR VALUES WITH (MODULUS {}, REMAINDER {});').format(
+                sql.Identifier(_n), sql.Literal(modulus), sql.Literal(_r))
+             for _r, _n in enumerate(names)]
+    _execute(conn, stmts)
+    return names
+
+
+def _execute(conn, stmts):
+    """Execute statements in a single transaction"""
+    try:
+        with conn.cursor() as cur:
+            for _s in stmts:
+                cur.execute(_s)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def stage_partition(conn, parent, name):
+    """Create a standalone table with the columns, defaults, and CHECK constraints of
+    **parent** for bulk loading before it is attached as a partition
+
+    :param conn: database connection
+    :type conn: psycopg2.extensions.connection
+    :param parent: partitioned table name
+    :type parent: str
+    :param name: name of the new table
+    :type name: str
+    """
+    _execute(conn, [sql.SQL('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);').format(
+        sql.Identifier(name), sql.Identifier(parent))])
+
+
+def attach_partition(conn, parent, name, lower, upper):
+    """Attach a table as an ARRIVAL-style range partition of **parent** covering
+    [**lower**, **upper**) in database time
+
+    A matching CHECK constraint is added first, so PostgreSQL can skip the validation
+    scan while holding the lock taken by `ATTACH PARTITION`, then dropped.
+
+    :param conn: database connection
+    :type conn: psycopg2.extensions.connection
+    :param parent: range-partitioned table name
+    :type parent: str
+    :param name: table to attach
+    :type name: str
+    :param lower: inclusive lower bound (database time)
+    :type lower: float
+    :param upper: exclusive upper bound (database time)
+    :type upper: float
+    """
+    check = sql.Identifier(f'{name}_bounds')
+    table = sql.Identifier(name)
+    _execute(conn, [
+        sql.SQL('ALTER TABLE {} ADD CONSTRAINT {} CHECK (datetime IS NOT NULL AND '
+                'datetime >= {} AND datetime < {});').format(
+            table, check, sql.Literal(float(lower)), sql.Literal(float(upper))),
+        sql.SQL('ALTER TABLE {} ATTACH PARTITION {} {};').format(
+            sql.Identifier(parent), table, _range_bound(lower, upper)),
+        sql.SQL('ALTER TABLE {} DROP CONSTRAINT {};').format(table, check)])
+
+
+def detach_partition(conn, parent, name):
+    """Detach a partition, leaving it as a standalone table (e.g., for archiving
+    with `pg_dump -t` before dropping it)
+
+    :param conn: database connection
+    :type conn: psycopg2.extensions.connection
+    :param parent: partitioned table name
+    :type parent: str
+    :param name: partition to detach
+    :type name: str
+    """
+    _execute(conn, [sql.SQL('ALTER TABLE {} DETACH PARTITION {};').format(
+        sql.Identifier(parent), sql.Identifier(name))])
+
+
+def load_arrival_partition(conn, df, start, interval='year', chunksize=100000, progress=True):
+    """Load one year (month) of arrivals into a new ARRIVAL partition by staging them
+    in a standalone table, then attaching it (see :meth:`~.attach_partition`). Indexes
+    defined on ARRIVAL are built on the staged table once, when it is attached.
+
+    :param conn: connection to a database with the partitioned ARRIVAL table
+    :type conn: psycopg2.extensions.connection
+    :param df: arrivals to load, with ARRIVAL column names and `datetime` in database
+        time (e.g., from :meth:`~postgresql.bulk.utc2dbtime_column`), all within the
+        partition
+    :type df: pandas.DataFrame
+    :param start: any UTC time within the partition's year (month)
+    :type start: str or datetime-like
+    :param interval: partition length, 'year' or 'month', defaults to 'year'
+    :type interval: str, optional
+    :param chunksize: rows per COPY/transaction, defaults to 100000
+    :type chunksize: int, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: name of the new partition and number of rows loaded
+    :rtype: tuple of (str, int)
+    """
+    bounds = arrival_partition_bounds(start, start, interval=interval,
+                                      is_true=timebase_is_true(conn)).iloc[0]
+    outside = (df['datetime'] < bounds.lower) | (df['datetime'] >= bounds.upper)
+    if outside.any():
+        raise ValueError(f'{outside.sum()} arrivals fall outside partition {bounds["name"]}')
+    stage_partition(conn, 'arrival', bounds['name'])
+    nrows = copy_chunks(conn, bounds['name'], df, chunksize=chunksize, progress=progress)
+    attach_partition(conn, 'arrival', bounds['name'], bounds.lower, bounds.upper)
+    return bounds['name'], nrows
@@ -0,0 +1,261 @@
+"""
+module: postgresql.pipeline
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides an asyncio ingestion pipeline that overlaps reading and
+    transforming input chunks with database writes:
+     - one producer pulls chunks from an iterator (e.g., `pandas.read_csv(..., chunksize=N)`
+       mapped through a formatting function) in a worker thread and puts them on a
+       bounded queue, so it blocks (backpressure) when the writers fall behind
+     - NWRITERS writer coroutines each hold one connection from a small
+       :class:`~psycopg2.pool.ThreadedConnectionPool` and run blocking `COPY` + `COMMIT`
+       calls (see :mod:`~postgresql.bulk`) in worker threads
+
+    psycopg2 releases the GIL while waiting on the server, so chunk N+1 is parsed and
+    formatted while chunks N, N-1, ... are being sent and committed.
+
+    Each chunk is committed in its own transaction and chunks may commit out of order,
+    so after a failure rows from chunks that follow the failed one may already be
+    present. :meth:`~.load_arrivals_pipelined` skips ARIDs that are already present
+    (with `resume=True`), so a failed run can simply be re-run.
+
+    Time spent waiting on the queue is recorded in :mod:`~sqlite.metrics` as
+    'pipeline.put_wait' (writers are the bottleneck) and 'pipeline.get_wait'
+    (the producer is the bottleneck).
+
+Note on time format for the ANSS parametric schema
+ - datetime: ARRIVAL and ORIGIN `datetime` values are supplied as UTC (UNIX) epoch
+    seconds or datetime-like values and are converted to database time client-side
+    (see :meth:`~postgresql.bulk.utc2dbtime_column`)
+"""
+
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+from tqdm import tqdm
+
+from sqlite.metrics import count, stage
+
+from .bulk import copy_stream, timebase_is_true, utc2dbtime_column, validate_arrivals
+from .catalog import load_catalog
+
+_DONE = object()
+
+
+def _next(iterator):
+    with stage('pipeline.produce'):
+        return next(iterator, _DONE)
+
+
+def _in_thread(pending, func, *args):
+    """Run a blocking call in a worker thread, tracking it in **pending** so it can be
+    awaited before connections are returned, even if the awaiting task is cancelled"""
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    pending.add(future)
+    future.add_done_callback(pending.discard)
+    return asyncio.shield(future)
+
+
+async def _produce(items, queue, nwriters, pending):
+    iterator = iter(items)
+    while True:
+        item = await _in_thread(pending, _next, iterator)
+        if item is _DONE:
+            break
+        tick = time.perf_counter()
+        await queue.put(item)
+        count('pipeline.put_wait', calls=1, seconds=time.perf_counter() - tick)
+    for _ in range(nwriters):
+        await queue.put(_DONE)
+
+
+async def _consume(conn, write, queue, results, pending, bar):
+    while True:
+        tick = time.perf_counter()
+        item = await queue.get()
+        count('pipeline.get_wait', calls=1, seconds=time.perf_counter() - tick)
+        if item is _DONE:
+            return
+        results.append(await _in_thread(pending, write, conn, item))
+        bar.update()
+
+
+async def run_pipeline(pg_kwargs, items, write, nwriters=4, maxsize=None, progress=True):
+    """Run **write** on each item of **items** concurrently on **nwriters** connections
+    while the next items are produced
+
+    If a write fails, the producer and the other writers are cancelled, writes already
+    in progress are allowed to finish, and the error is re-raised.
+
+    :param pg_kwargs: keyword arguments for :func:`psycopg2.connect`
+    :type pg_kwargs: dict
+    :param items: chunks to write, produced lazily (e.g., a generator)
+    :type items: iterable
+    :param write: blocking function called as `write(conn, item)` in a worker thread.
+        It is responsible for committing (or rolling back) its own transaction.
+    :type write: callable
+    :param nwriters: number of writer coroutines/connections, defaults to 4
+    :type nwriters: int, optional
+    :param maxsize: maximum number of chunks waiting in the queue, defaults to None
+        (2 * **nwriters**)
+    :type maxsize: int, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: return values of **write**, in completion order
+    :rtype: list
+    """
+    queue = asyncio.Queue(maxsize=maxsize or 2*nwriters)
+    pool = await asyncio.to_thread(ThreadedConnectionPool, nwriters, nwriters, **pg_kwargs)
+    conns = [pool.getconn() for _ in range(nwriters)]
+    results = []
+    pending = set()
+    bar = tqdm(disable=not progress, unit='chunk')
+    tasks = [asyncio.create_task(_produce(items, queue, nwriters, pending))]
+    tasks += [asyncio.create_task(_consume(_c, write, queue, results, pending, bar))
+              for _c in conns]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for _t in tasks:
+            _t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        # Let blocking calls already in worker threads finish before closing connections
+        await asyncio.gather(*pending, return_exceptions=True)
+        bar.close()
+        pool.closeall()
+    return results
+
+
+def copy_pipeline(pg_kwargs, table, frames, columns=None, nwriters=4, maxsize=None,
+                  progress=True):
+    """Load DataFrame chunks into a table with one `COPY` and commit per chunk, on
+    **nwriters** concurrent connections (see :meth:`~.run_pipeline`)
+
+    :param pg_kwargs: keyword arguments for :func:`psycopg2.connect`
+    :type pg_kwargs: dict
+    :param table: destination table name
+    :type table: str
+    :param frames: chunks of rows to load with column names matching the destination table
+    :type frames: iterable of pandas.DataFrame
+    :param columns: subset of columns to load, defaults to None (all columns of each chunk)
+    :type columns: list of str, optional
+    :param nwriters: number of writer connections, defaults to 4
+    :type nwriters: int, optional
+    :param maxsize: maximum number of chunks waiting in the queue, defaults to None
+        (2 * **nwriters**)
+    :type maxsize: int, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows loaded
+    :rtype: int
+    """
+    def write(conn, df):
+        return copy_stream(conn, table, [df], columns=columns, progress=False)
+    return sum(asyncio.run(run_pipeline(pg_kwargs, frames, write, nwriters=nwriters,
+                                        maxsize=maxsize, progress=progress)))
+
+
+def _present_arids(conn, arid):
+    """ARIDs in the range of **arid** that are already present in ARRIVAL"""
+    with stage('existing_keys.arrival', rows=len(arid), round_trips=2), conn.cursor() as cur:
+        cur.execute("SELECT arid FROM arrival WHERE arid BETWEEN %s AND %s;",
+                    (int(arid.min()), int(arid.max())))
+        found = np.fromiter((_r[0] for _r in cur.fetchall()), dtype=np.int64)
+        conn.commit()
+    return found
+
+
+def load_arrivals_pipelined(pg_kwargs, frames, nwriters=4, maxsize=None, resume=True,
+                            progress=True):
+    """Bulk-load chunks of phase arrivals into the ARRIVAL table with the pipeline
+    (the concurrent counterpart of :meth:`~postgresql.bulk.load_arrivals`)
+
+    Each chunk must use ARRIVAL column names (lower case) and include at least
+    `arid`, `datetime`, `sta`, and `auth`. The `datetime` column must be UTC (UNIX)
+    epoch seconds or datetime-like values and is converted to database time
+    in the writer threads. Columns that are not part of ARRIVAL are ignored.
+
+    Rows that would violate an ARRIVAL constraint are returned instead of aborting the
+    load (see :meth:`~postgresql.bulk.validate_arrivals`).
+
+    :param pg_kwargs: keyword arguments for :func:`psycopg2.connect`
+    :type pg_kwargs: dict
+    :param frames: chunks of arrivals to load, produced lazily (e.g., a generator)
+    :type frames: iterable of pandas.DataFrame
+    :param nwriters: number of writer connections, defaults to 4
+    :type nwriters: int, optional
+    :param maxsize: maximum number of chunks waiting in the queue, defaults to None
+        (2 * **nwriters**)
+    :type maxsize: int, optional
+    :param resume: skip rows whose `arid` is already present in ARRIVAL (one range
+        query per chunk)? Defaults to True
+    :type resume: bool, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows loaded and all rejected rows (with a `reason` column)
+    :rtype: tuple (int, pandas.DataFrame)
+    """
+    is_true = {}
+
+    def write(conn, df):
+        df, rejected = validate_arrivals(df)
+        if len(df) == 0:
+            return 0, rejected
+        if conn not in is_true:
+            is_true[conn] = timebase_is_true(conn)
+        if resume:
+            arid = df.arid.to_numpy(dtype=np.int64)
+            present = np.isin(arid, _present_arids(conn, arid))
+            count('existing_keys.arrival', rejected=int(present.sum()))
+            df = df[~present]
+        df = df.assign(datetime=utc2dbtime_column(df['datetime'], is_true=is_true[conn]))
+        nrows = copy_stream(conn, 'arrival', [df], columns=list(df.columns), progress=False)
+        return nrows, rejected
+    results = asyncio.run(run_pipeline(pg_kwargs, frames, write, nwriters=nwriters,
+                                       maxsize=maxsize, progress=progress))
+    rejected = [_r for _, _r in results]
+    return (sum(_n for _n, _ in results),
+            pd.concat(rejected) if rejected else pd.DataFrame(columns=['reason']))
+
+
+def load_catalog_pipelined(pg_kwargs, chunks, nwriters=4, maxsize=None, check_existing=True,
+                           progress=True):
+    """Validate and load chunks of catalog rows with the pipeline, each chunk in its own
+    transaction (see :meth:`~postgresql.catalog.load_catalog`)
+
+    :param pg_kwargs: keyword arguments for :func:`psycopg2.connect`
+    :type pg_kwargs: dict
+    :param chunks: table names ('origin', 'netmag', 'event') and rows to load per chunk,
+        produced lazily (e.g., a generator). ORIGIN `datetime` values must be UTC (UNIX)
+        epoch seconds or datetime-like values.
+    :type chunks: iterable of dict of pandas.DataFrame
+    :param nwriters: number of writer connections, defaults to 4
+    :type nwriters: int, optional
+    :param maxsize: maximum number of chunks waiting in the queue, defaults to None
+        (2 * **nwriters**)
+    :type maxsize: int, optional
+    :param check_existing: reject rows whose primary key is already present in the
+        database? Defaults to True
+    :type check_existing: bool, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows loaded per table and all rejected rows (with `table`
+        and `reason` columns)
+    :rtype: tuple (dict, pandas.DataFrame)
+    """
+    def write(conn, tables):
+        return load_catalog(conn, tables, check_existing=check_existing)
+    results = asyncio.run(run_pipeline(pg_kwargs, chunks, write, nwriters=nwriters,
+                                       maxsize=maxsize, progress=progress))
+    counts = {}
+    for _counts, _ in results:
+        for _t, _n in _counts.items():
+            counts[_t] = counts.get(_t, 0) + _n
+    rejected = [_r for _, _r in results]
+    return counts, (pd.concat(rejected) if rejected else pd.DataFrame(columns=['table', 'reason']))
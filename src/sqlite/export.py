@@ -0,0 +1,700 @@
+"""
+module: sqlite.export
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module contains methods for streaming table contents from an AQMS
+    PostgreSQL style database into a SQLite database with the same (truncated)
+    ANSS parametric schema (see `sqlite/schema/create_*.sql`).
+
+    Rows are read from PostgreSQL with named (server-side) cursors in batches of
+    `batchsize` rows and written to SQLite with `executemany` inside large
+    transactions, so memory use is bounded by the batch size rather than the
+    table size.
+
+    Tables (and key-range partitions of large tables such as ARRIVAL) can also be
+    read concurrently on a pool of PostgreSQL connections while a single writer
+    drains a bounded queue into SQLite (see :meth:`~.export_database_parallel`).
+
+    After a full export, per-table high-water marks (max LDDATE and max primary key)
+    are recorded in the EXPORT_STATE table of the SQLite file so that subsequent runs
+    can transfer only new or changed rows as upserts (see :meth:`~.sync_database`).
+
+    Secondary indexes (see `sqlite/indexes/create_indexes.sql`) are dropped before
+    a full export and rebuilt afterwards, followed by ANALYZE. The same script
+    (re)builds the ORIGIN_RTREE spatiotemporal index. An incremental sync that touches
+    ORIGIN only replaces the ORIGIN_RTREE entries of the synchronized origins.
+
+    Fetches, inserts, commits, and index builds are recorded as stages in
+    :mod:`~sqlite.metrics`.
+
+    During loading, SQLite journaling and disk syncs are disabled (see LOAD_PRAGMAS).
+    This is safe for building a new export file, but an interrupted load can leave
+    the SQLite file corrupted and it should be rebuilt from scratch.
+"""
+
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+from psycopg2.pool import ThreadedConnectionPool
+from tqdm import tqdm
+
+from .install import DEFAULT_TABLES
+from .metrics import count, stage
+
+ROOT = Path(__file__).parent.parent.parent
+INDEX_SQL = ROOT/'sqlite'/'indexes'/'create_indexes.sql'
+# Name prefix of secondary indexes that are dropped/rebuilt around bulk loads
+INDEX_PREFIX = 'ix_'
+
+# Tables split into key-range partitions for parallel reads and their keys
+PARTITION_KEYS = {'arrival': 'arid'}
+
+# PRAGMA settings applied while bulk loading and their post-load values
+LOAD_PRAGMAS = {'journal_mode': 'OFF',
+                'synchronous': 'OFF',
+                'temp_store': 'MEMORY',
+                'cache_size': -262144}
+RESTORE_PRAGMAS = {'journal_mode': 'DELETE',
+                   'synchronous': 'FULL',
+                   'temp_store': 'DEFAULT',
+                   'cache_size': -2000}
+
+# Name of the SQLite table holding per-table export high-water marks
+STATE_TABLE = 'export_state'
+
+# Adapt PostgreSQL-native python types that sqlite3 does not handle natively
+sqlite3.register_adapter(datetime.datetime, lambda x: x.isoformat(' '))
+sqlite3.register_adapter(Decimal, float)
+
+
+def set_pragmas(conn_lite, pragmas):
+    """Apply a dictionary of PRAGMA settings to a SQLite connection
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param pragmas: PRAGMA names and values
+    :type pragmas: dict
+    """
+    for _k, _v in pragmas.items():
+        conn_lite.execute(f'PRAGMA {_k} = {_v};')
+
+
+@contextmanager
+def bulk_load(conn_lite):
+    """Context manager that applies LOAD_PRAGMAS to a SQLite connection
+    and restores RESTORE_PRAGMAS on exit
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    """
+    set_pragmas(conn_lite, LOAD_PRAGMAS)
+    try:
+        yield conn_lite
+    finally:
+        conn_lite.commit()
+        set_pragmas(conn_lite, RESTORE_PRAGMAS)
+
+
+def drop_indexes(conn_lite, prefix=INDEX_PREFIX):
+    """Drop secondary indexes whose names start with **prefix**
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param prefix: index name prefix, defaults to INDEX_PREFIX
+    :type prefix: str, optional
+    :return: names of dropped indexes
+    :rtype: list of str
+    """
+    cur = conn_lite.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE ?;",
+                            (prefix + '%',))
+    names = [_r[0] for _r in cur.fetchall()]
+    for _n in names:
+        conn_lite.execute(f'DROP INDEX IF EXISTS {_n};')
+    conn_lite.commit()
+    return names
+
+
+def create_indexes(conn_lite, index_sql=INDEX_SQL):
+    """Build secondary indexes and refresh planner statistics (ANALYZE)
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param index_sql: index definition script, defaults to INDEX_SQL
+    :type index_sql: str or pathlib.Path, optional
+    """
+    with open(index_sql, 'r') as _f, stage('sqlite.create_indexes'):
+        conn_lite.executescript(_f.read())
+        conn_lite.commit()
+
+
+def update_origin_rtree(conn_lite, lddate=None, maxkey=None):
+    """Replace the ORIGIN_RTREE entries of ORIGIN rows loaded after the LDDATE and ORID
+    high-water marks of an earlier export/sync (see :meth:`~.get_state`), rather than
+    rebuilding ORIGIN_RTREE with :meth:`~.create_indexes`. If ORIGIN_RTREE does not
+    exist yet or neither mark is given, :meth:`~.create_indexes` is run instead.
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param lddate: LDDATE high-water mark, defaults to None
+    :type lddate: datetime.datetime, optional
+    :param maxkey: ORID high-water mark, defaults to None
+    :type maxkey: int, optional
+    :return: number of ORIGIN rows whose entries were replaced (None if rebuilt)
+    :rtype: int or None
+    """
+    exists = conn_lite.execute("SELECT 1 FROM sqlite_master WHERE name = 'origin_rtree';").fetchone()
+    clauses = []
+    params = []
+    if lddate is not None:
+        clauses.append('lddate > ?')
+        params.append(lddate)
+    if maxkey is not None:
+        clauses.append('orid > ?')
+        params.append(maxkey)
+    if exists is None or len(clauses) == 0:
+        create_indexes(conn_lite)
+        return None
+    synced = f"SELECT orid FROM origin WHERE {' OR '.join(clauses)}"
+    with stage('sqlite.update_origin_rtree'):
+        # Delete, then insert, the entries of new and updated origins
+        conn_lite.execute(f'DELETE FROM origin_rtree WHERE orid IN ({synced});', params)
+        cur = conn_lite.execute(f"""
+            INSERT INTO origin_rtree (orid, min_lat, max_lat, min_lon, max_lon, min_time, max_time)
+            SELECT orid, lat, lat, lon, lon, datetime, datetime FROM origin
+            WHERE ({' OR '.join(clauses)})
+                AND lat IS NOT NULL AND lon IS NOT NULL AND datetime IS NOT NULL;""", params)
+        conn_lite.commit()
+    return cur.rowcount
+
+
+def table_columns(conn_lite, table):
+    """Get the (lower case) column names of a SQLite table in schema order
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :return: column names
+    :rtype: list of str
+    """
+    cur = conn_lite.execute(f'PRAGMA table_info({table});')
+    columns = [_r[1].lower() for _r in cur.fetchall()]
+    if len(columns) == 0:
+        raise KeyError(f'Table "{table}" not found in SQLite database')
+    return columns
+
+
+def insert_sql(table, columns, verb='INSERT'):
+    """Compose a parameterized INSERT statement for `executemany`
+
+    :param table: table name
+    :type table: str
+    :param columns: column names
+    :type columns: list of str
+    :param verb: insert verb, e.g., 'INSERT' or 'INSERT OR REPLACE', defaults to 'INSERT'
+    :type verb: str, optional
+    :return: SQL statement
+    :rtype: str
+    """
+    return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?'*len(columns))});"
+
+
+def iter_pg_batches(conn_pg, sql, params=None, batchsize=50000, name='export_cursor'):
+    """Stream the results of a query from PostgreSQL in batches using a
+    named (server-side) cursor
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param sql: query to run
+    :type sql: str
+    :param params: query parameters, defaults to None
+    :type params: dict or tuple, optional
+    :param batchsize: rows per batch, defaults to 50000
+    :type batchsize: int, optional
+    :param name: server-side cursor name, defaults to 'export_cursor'
+    :type name: str, optional
+    :yield: batch of rows
+    :rtype: list of tuple
+    """
+    with conn_pg.cursor(name=name) as cur:
+        cur.itersize = batchsize
+        cur.execute(sql, params)
+        while True:
+            with stage(f'fetch.{name}', round_trips=1):
+                rows = cur.fetchmany(batchsize)
+            if len(rows) == 0:
+                break
+            count(f'fetch.{name}', rows=len(rows))
+            yield rows
+    # End the read transaction holding the server-side cursor
+    conn_pg.rollback()
+
+
+def export_table(conn_pg, conn_lite, table, where=None, params=None, batchsize=50000,
+                 commit_every=1000000, verb='INSERT', progress=True):
+    """Stream the contents of a PostgreSQL table into the matching SQLite table
+
+    Only columns present in the SQLite table are transferred (e.g., the SQLite schema
+    omits some PostgreSQL-only tables and columns).
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name (same in both databases)
+    :type table: str
+    :param where: optional SQL WHERE clause (without 'WHERE') for the PostgreSQL query
+    :type where: str, optional
+    :param params: parameters for **where**, defaults to None
+    :type params: dict or tuple, optional
+    :param batchsize: rows per fetch/executemany call, defaults to 50000
+    :type batchsize: int, optional
+    :param commit_every: approximate number of rows per SQLite transaction, defaults to 1000000
+    :type commit_every: int, optional
+    :param verb: insert verb, defaults to 'INSERT'
+    :type verb: str, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows transferred
+    :rtype: int
+    """
+    columns = table_columns(conn_lite, table)
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += f' WHERE {where}'
+    ins = insert_sql(table, columns, verb=verb)
+    nrows = 0
+    uncommitted = 0
+    with tqdm(desc=table, unit='row', disable=not progress) as pbar:
+        for rows in iter_pg_batches(conn_pg, sql + ';', params=params,
+                                    batchsize=batchsize, name=f'export_{table}'):
+            with stage(f'sqlite.insert.{table}', rows=len(rows)):
+                conn_lite.executemany(ins, rows)
+            nrows += len(rows)
+            uncommitted += len(rows)
+            if uncommitted >= commit_every:
+                with stage(f'sqlite.commit.{table}'):
+                    conn_lite.commit()
+                uncommitted = 0
+            pbar.update(len(rows))
+    with stage(f'sqlite.commit.{table}'):
+        conn_lite.commit()
+    return nrows
+
+
+def export_database(conn_pg, conn_lite, tables=DEFAULT_TABLES, batchsize=50000,
+                    commit_every=1000000, indexes=True, progress=True):
+    """Stream a selection of tables from PostgreSQL into SQLite with bulk-load
+    PRAGMA settings applied for the duration of the transfer
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param tables: table names to transfer, defaults to DEFAULT_TABLES
+    :type tables: list of str, optional
+    :param batchsize: rows per fetch/executemany call, defaults to 50000
+    :type batchsize: int, optional
+    :param commit_every: approximate number of rows per SQLite transaction, defaults to 1000000
+    :type commit_every: int, optional
+    :param indexes: drop secondary indexes before loading and rebuild them (with ANALYZE)
+        afterwards? Defaults to True
+    :type indexes: bool, optional
+    :param progress: show progress bars? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows transferred per table
+    :rtype: dict
+    """
+    counts = {}
+    marks = {_t: pg_high_water(conn_pg, conn_lite, _t) for _t in tables}
+    if indexes:
+        drop_indexes(conn_lite)
+    with bulk_load(conn_lite):
+        for table in tables:
+            counts[table] = export_table(conn_pg, conn_lite, table, batchsize=batchsize,
+                                         commit_every=commit_every, progress=progress)
+            set_state(conn_lite, table, *marks[table])
+        if indexes:
+            create_indexes(conn_lite)
+    return counts
+
+
+def partition_ranges(conn_pg, table, key, npartitions):
+    """Split the range of an integer key column into contiguous, inclusive
+    ranges of (roughly) equal width
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param table: table name
+    :type table: str
+    :param key: integer key column name
+    :type key: str
+    :param npartitions: number of partitions
+    :type npartitions: int
+    :return: (first, last) key values for each partition (empty if the table is empty)
+    :rtype: list of tuple
+    """
+    with conn_pg.cursor() as cur:
+        cur.execute(f"SELECT min({key}), max({key}) FROM {table};")
+        kmin, kmax = cur.fetchone()
+    conn_pg.rollback()
+    if kmin is None:
+        return []
+    width = max((kmax - kmin + 1)//npartitions, 1)
+    ranges = []
+    lo = kmin
+    while lo <= kmax:
+        hi = lo + width - 1
+        if len(ranges) == npartitions - 1:
+            hi = kmax
+        ranges.append((lo, min(hi, kmax)))
+        lo = hi + 1
+    return ranges
+
+
+# Sentinel put on the queue by a reader when its task is complete
+_DONE = object()
+
+
+def _read_task(pool, outq, stop, started, table, sql, params, batchsize, name):
+    """Reader worker: stream one query into the output queue on a pooled connection,
+    recording when the first task of each table starts in **started**"""
+    started.setdefault(table, time.perf_counter())
+    conn_pg = pool.getconn()
+    try:
+        for rows in iter_pg_batches(conn_pg, sql, params=params, batchsize=batchsize, name=name):
+            if stop.is_set():
+                break
+            outq.put((table, rows))
+    except Exception as e:
+        outq.put((table, e))
+        return
+    finally:
+        pool.putconn(conn_pg)
+    outq.put((table, _DONE))
+
+
+def export_database_parallel(pg_kwargs, conn_lite, tables=DEFAULT_TABLES, nworkers=4,
+                             npartitions=None, batchsize=50000, maxsize=16,
+                             commit_every=1000000, indexes=True, progress=True):
+    """Export a selection of tables from PostgreSQL into SQLite, reading tables (and
+    key-range partitions of the tables in PARTITION_KEYS) concurrently on a pool of
+    **nworkers** PostgreSQL connections. The calling thread is the single SQLite
+    writer, draining a bounded queue of row batches.
+
+    :param pg_kwargs: keyword arguments for :func:`psycopg2.connect`
+    :type pg_kwargs: dict
+    :param conn_lite: SQLite connection (used only from the calling thread)
+    :type conn_lite: sqlite3.Connection
+    :param tables: table names to transfer, defaults to DEFAULT_TABLES
+    :type tables: list of str, optional
+    :param nworkers: number of reader threads/connections, defaults to 4
+    :type nworkers: int, optional
+    :param npartitions: number of key-range partitions for partitioned tables,
+        defaults to None (uses **nworkers**)
+    :type npartitions: int, optional
+    :param batchsize: rows per fetch/executemany call, defaults to 50000
+    :type batchsize: int, optional
+    :param maxsize: maximum number of batches waiting in the queue, defaults to 16
+    :type maxsize: int, optional
+    :param commit_every: approximate number of rows per SQLite transaction, defaults to 1000000
+    :type commit_every: int, optional
+    :param indexes: drop secondary indexes before loading and rebuild them (with ANALYZE)
+        afterwards? Defaults to True
+    :type indexes: bool, optional
+    :param progress: show progress bars? Defaults to True
+    :type progress: bool, optional
+    :return: per-table row counts, elapsed seconds (from the start of the table's first
+        read task to the end of its last), and rows per second
+    :rtype: dict
+    """
+    if npartitions is None:
+        npartitions = nworkers
+    pool = ThreadedConnectionPool(1, nworkers + 1, **pg_kwargs)
+    # Compose read tasks (table, sql, params, cursor name)
+    tasks = []
+    inserts = {}
+    conn_pg = pool.getconn()
+    try:
+        marks = {_t: pg_high_water(conn_pg, conn_lite, _t) for _t in tables}
+        for table in tables:
+            columns = table_columns(conn_lite, table)
+            inserts[table] = insert_sql(table, columns)
+            sql = f"SELECT {', '.join(columns)} FROM {table}"
+            if table in PARTITION_KEYS:
+                key = PARTITION_KEYS[table]
+                for _i, (lo, hi) in enumerate(partition_ranges(conn_pg, table, key, npartitions)):
+                    tasks.append((table, sql + f' WHERE {key} BETWEEN %s AND %s;', (lo, hi), f'export_{table}_{_i}'))
+            else:
+                tasks.append((table, sql + ';', None, f'export_{table}'))
+    finally:
+        pool.putconn(conn_pg)
+
+    stats = {_t: {'rows': 0, 'seconds': 0., 'rows_per_sec': 0.} for _t in tables}
+    remaining = {_t: sum(1 for _task in tasks if _task[0] == _t) for _t in tables}
+    bars = {_t: tqdm(desc=_t, unit='row', position=_e, disable=not progress)
+            for _e, _t in enumerate(tables)}
+    outq = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    error = None
+    pending = len(tasks)
+    started = {}
+    uncommitted = 0
+    if indexes:
+        drop_indexes(conn_lite)
+    try:
+        with bulk_load(conn_lite), ThreadPoolExecutor(max_workers=nworkers) as executor:
+            for table, sql, params, name in tasks:
+                executor.submit(_read_task, pool, outq, stop, started, table, sql, params,
+                                batchsize, name)
+            while pending > 0:
+                table, item = outq.get()
+                if item is _DONE or isinstance(item, Exception):
+                    pending -= 1
+                    remaining[table] -= 1
+                    if isinstance(item, Exception) and error is None:
+                        # Stop readers and keep draining so blocked readers can exit
+                        error = item
+                        stop.set()
+                    if remaining[table] == 0:
+                        stats[table]['seconds'] = time.perf_counter() - started[table]
+                    continue
+                if error is not None:
+                    continue
+                try:
+                    with stage(f'sqlite.insert.{table}', rows=len(item)):
+                        conn_lite.executemany(inserts[table], item)
+                except Exception as e:
+                    error = e
+                    stop.set()
+                    continue
+                stats[table]['rows'] += len(item)
+                bars[table].update(len(item))
+                uncommitted += len(item)
+                if uncommitted >= commit_every:
+                    conn_lite.commit()
+                    uncommitted = 0
+    finally:
+        for _b in bars.values():
+            _b.close()
+        pool.closeall()
+    if error is not None:
+        raise error
+    for table in tables:
+        set_state(conn_lite, table, *marks[table])
+    if indexes:
+        with bulk_load(conn_lite):
+            create_indexes(conn_lite)
+    for table, _s in stats.items():
+        if _s['seconds'] > 0:
+            _s['rows_per_sec'] = _s['rows']/_s['seconds']
+    return stats
+
+
+def primary_key(conn_lite, table):
+    """Get the primary key column name(s) of a SQLite table
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :return: primary key column names in key order (empty if no primary key)
+    :rtype: list of str
+    """
+    cur = conn_lite.execute(f'PRAGMA table_info({table});')
+    keys = sorted((_r[5], _r[1].lower()) for _r in cur.fetchall() if _r[5] > 0)
+    return [_k for _, _k in keys]
+
+
+def ensure_state_table(conn_lite):
+    """Create the EXPORT_STATE table in the SQLite database if it does not exist
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    """
+    conn_lite.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            TABLENAME VARCHAR(30) PRIMARY KEY,
+            LDDATE TIMESTAMP,
+            MAXKEY BIGINT,
+            SYNCDATE TIMESTAMP DEFAULT (CURRENT_TIMESTAMP)
+        );""")
+
+
+def get_state(conn_lite, table):
+    """Get the recorded high-water marks for a table
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :return: max LDDATE and max primary key values at the last export/sync or
+        None if the table has not been exported
+    :rtype: tuple (datetime.datetime or None, int or None) or None
+    """
+    ensure_state_table(conn_lite)
+    row = conn_lite.execute(f'SELECT lddate, maxkey FROM {STATE_TABLE} WHERE tablename = ?;',
+                            (table,)).fetchone()
+    if row is None:
+        return None
+    lddate, maxkey = row
+    if lddate is not None:
+        lddate = datetime.datetime.fromisoformat(lddate)
+    return lddate, maxkey
+
+
+def set_state(conn_lite, table, lddate, maxkey):
+    """Record the high-water marks for a table and commit
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :param lddate: max LDDATE value transferred (None if not applicable)
+    :type lddate: datetime.datetime or None
+    :param maxkey: max primary key value transferred (None if not applicable)
+    :type maxkey: int or None
+    """
+    ensure_state_table(conn_lite)
+    conn_lite.execute(f"""
+        INSERT INTO {STATE_TABLE} (tablename, lddate, maxkey, syncdate)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (tablename) DO UPDATE SET
+            lddate = excluded.lddate, maxkey = excluded.maxkey, syncdate = excluded.syncdate;""",
+                      (table, lddate, maxkey))
+    conn_lite.commit()
+
+
+def pg_high_water(conn_pg, conn_lite, table):
+    """Get the current max LDDATE and max (single-column, integer) primary key of a
+    PostgreSQL table. Either value is None if the table lacks the relevant column.
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param conn_lite: SQLite connection (used to look up the table layout)
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :return: max LDDATE and max primary key values
+    :rtype: tuple
+    """
+    columns = table_columns(conn_lite, table)
+    keys = primary_key(conn_lite, table)
+    exprs = ['max(lddate)' if 'lddate' in columns else 'NULL',
+             f'max({keys[0]})' if len(keys) == 1 else 'NULL']
+    with conn_pg.cursor() as cur:
+        cur.execute(f"SELECT {', '.join(exprs)} FROM {table};")
+        marks = cur.fetchone()
+    conn_pg.rollback()
+    return marks
+
+
+def upsert_sql(table, columns, keys):
+    """Compose a parameterized INSERT ... ON CONFLICT DO UPDATE statement
+
+    :param table: table name
+    :type table: str
+    :param columns: column names
+    :type columns: list of str
+    :param keys: primary key column names
+    :type keys: list of str
+    :return: SQL statement
+    :rtype: str
+    """
+    updates = ', '.join(f'{_c} = excluded.{_c}' for _c in columns if _c not in keys)
+    sql = insert_sql(table, columns)[:-1]
+    return sql + f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates};"
+
+
+def sync_table(conn_pg, conn_lite, table, batchsize=50000, progress=True):
+    """Incrementally synchronize one table from PostgreSQL into SQLite
+
+    Rows with an LDDATE after the recorded LDDATE high-water mark, or a (single-column)
+    primary key above the recorded key high-water mark, are upserted. Tables that have not
+    been exported before, or that have neither an LDDATE column nor a single-column primary
+    key (e.g., LEAP_SECONDS), are fully refreshed.
+
+    NOTE: Updates to existing rows are only picked up if they also update LDDATE.
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :param batchsize: rows per fetch/executemany call, defaults to 50000
+    :type batchsize: int, optional
+    :param progress: show a progress bar? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows transferred
+    :rtype: int
+    """
+    marks = pg_high_water(conn_pg, conn_lite, table)
+    state = get_state(conn_lite, table)
+    keys = primary_key(conn_lite, table)
+    clauses = []
+    params = {}
+    if state is not None:
+        lddate, maxkey = state
+        if lddate is not None:
+            clauses.append('lddate > %(lddate)s')
+            params['lddate'] = lddate
+        if maxkey is not None:
+            clauses.append(f'{keys[0]} > %(maxkey)s')
+            params['maxkey'] = maxkey
+    if len(clauses) == 0:
+        # Full refresh
+        conn_lite.execute(f'DELETE FROM {table};')
+        nrows = export_table(conn_pg, conn_lite, table, batchsize=batchsize, progress=progress)
+    else:
+        columns = table_columns(conn_lite, table)
+        sql = f"SELECT {', '.join(columns)} FROM {table} WHERE {' OR '.join(clauses)};"
+        ins = upsert_sql(table, columns, keys) if keys else insert_sql(table, columns)
+        nrows = 0
+        with tqdm(desc=table, unit='row', disable=not progress) as pbar:
+            for rows in iter_pg_batches(conn_pg, sql, params=params, batchsize=batchsize,
+                                        name=f'sync_{table}'):
+                with stage(f'sqlite.upsert.{table}', rows=len(rows)):
+                    conn_lite.executemany(ins, rows)
+                nrows += len(rows)
+                pbar.update(len(rows))
+        conn_lite.commit()
+    set_state(conn_lite, table, *marks)
+    return nrows
+
+
+def sync_database(conn_pg, conn_lite, tables=DEFAULT_TABLES, batchsize=50000, progress=True):
+    """Incrementally synchronize a selection of tables from PostgreSQL into an existing
+    SQLite export (see :meth:`~.sync_table`). Journaling is left on because the target
+    file already holds data. ORIGIN_RTREE entries are replaced only for the ORIGIN rows
+    that were synchronized (see :meth:`~.update_origin_rtree`).
+
+    :param conn_pg: PostgreSQL connection
+    :type conn_pg: psycopg2.extensions.connection
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param tables: table names to synchronize, defaults to DEFAULT_TABLES
+    :type tables: list of str, optional
+    :param batchsize: rows per fetch/executemany call, defaults to 50000
+    :type batchsize: int, optional
+    :param progress: show progress bars? Defaults to True
+    :type progress: bool, optional
+    :return: number of rows transferred per table
+    :rtype: dict
+    """
+    # High-water marks of the previous sync select the ORIGIN rows to re-index
+    origin_state = get_state(conn_lite, 'origin') if 'origin' in tables else None
+    counts = {_t: sync_table(conn_pg, conn_lite, _t, batchsize=batchsize, progress=progress)
+              for _t in tables}
+    if counts.get('origin'):
+        # Existing secondary indexes are maintained by SQLite, ORIGIN_RTREE is not
+        update_origin_rtree(conn_lite, *(origin_state or (None, None)))
+    return counts
@@ -7,20 +7,24 @@ purpose: This script provides an interactive prompt for
     initializing a SQLite database and populating it with
     a trucated version of the ANSS parametric schema
 
-    See included tables in `sqlite/schema/create_*.sql`
+    See included tables in `sqlite/schema/create_*.sql` and
+    secondary indexes in `sqlite/indexes/create_indexes.sql`
 
     It also populates the leap_seconds table using data in:
-    `sqlite/data/leap_seconds.csv`
+    `sqlite/table_data/leap_seconds.csv`
+
+    Installation is done without the `sqlite3` command line client
+    (see :meth:`~sqlite.install.create_database`)
 
 """
 
-import os, glob
+import os
+import sys
 from pathlib import Path
-import sqlite3
 
 ROOT = Path(__file__).parent.parent.parent
-SCHEMA = ROOT/'sqlite'/'schema'
-LEAPCSV = ROOT/'sqlite'/'table_data'/'leap_seconds.csv'
+sys.path.append(str(ROOT/'src'))
+from sqlite.install import create_database
 
 default_db_path = ROOT/'db'
 default_db_name = 'test.db'
@@ -60,35 +64,8 @@ if os.path.isfile(pdb):
         raise FileExistsError(f'Aborting overwrite of "{pdb}"')
     else:
         print(f'Proceeding with delete of "{pdb}"')
-        os.system(f'rm {pdb}')
-
-# Get list of schema files
-sf_list = glob.glob(str(SCHEMA/'create_*.sql'))
-# Install schema
-for _sf in sf_list:
-    _fname = Path(_sf).parts[-1]
-    print(f'RUNNING {_fname} ON {dbname}')
-    cmd = f'sqlite3 {pdb} < {_sf}'
-    os.system(cmd)
-
-
-# sqlite3 connection
-with sqlite3.connect(pdb) as conn:
-    print('Connected to database - populating leap_seconds table')
-    # Populate leap_seconds table
-    with open(str(LEAPCSV), 'r') as _f:
-        cur = conn.cursor()
-        for _e, line in enumerate(_f.readlines()):
-            line = line[:-1]
-            if _e == 0:
-                hdr = line
-                continue
-            sql = f'INSERT INTO leap_seconds ({hdr}) VALUES ({line});'
-            try:
-                cur.execute(sql)
-            except:
-                cur.close()
-                conn.rollback()
 
-                breakpoint()
-        conn.commit()        
+# Install schema, secondary indexes, and leap_seconds contents
+print(f'INITIALIZING {dbname}')
+conn = create_database(pdb, overwrite=True)
+conn.close()
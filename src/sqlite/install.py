@@ -0,0 +1,131 @@
+"""
+module: sqlite.install
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module contains non-interactive methods for installing the (truncated)
+    ANSS parametric schema (see `sqlite/schema/create_*.sql`), the secondary indexes
+    (see `sqlite/indexes/create_indexes.sql`), and the contents of the LEAP_SECONDS
+    table (see `sqlite/table_data/leap_seconds.csv`) into SQLite databases without
+    shelling out to the `sqlite3` command line client.
+
+    All schema scripts are run in a single transaction with `executescript` and
+    LEAP_SECONDS is loaded with one `executemany` call. For creating many (e.g., per-job
+    scratch) databases, :meth:`~.create_database` builds the schema once in an in-memory
+    template database and copies it into each new file with the SQLite backup API.
+"""
+
+import csv
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.parent
+SCHEMA_DIR = ROOT/'sqlite'/'schema'
+INDEX_SQL = ROOT/'sqlite'/'indexes'/'create_indexes.sql'
+LEAP_SECONDS_CSV = ROOT/'sqlite'/'table_data'/'leap_seconds.csv'
+
+# Tables copied by a default export (see :mod:`~sqlite.export`), in order of dependency
+DEFAULT_TABLES = ['event', 'origin', 'assocaro', 'netmag', 'remark', 'leap_seconds', 'arrival']
+
+
+@lru_cache(maxsize=None)
+def schema_script(tables=None, schema_dir=SCHEMA_DIR):
+    """Concatenate the `create_<TABLE>.sql` schema scripts into one SQL script
+
+    :param tables: table names to include, defaults to None (all scripts in **schema_dir**)
+    :type tables: tuple of str, optional
+    :param schema_dir: schema script directory, defaults to SCHEMA_DIR
+    :type schema_dir: pathlib.Path, optional
+    :return: SQL script
+    :rtype: str
+    """
+    if tables is None:
+        files = sorted(Path(schema_dir).glob('create_*.sql'))
+    else:
+        files = [Path(schema_dir)/f'create_{_t.upper()}.sql' for _t in tables]
+    return '\n'.join(_f.read_text() for _f in files)
+
+
+def load_leap_seconds(conn_lite, csvfile=LEAP_SECONDS_CSV):
+    """Replace the contents of LEAP_SECONDS with the rows of **csvfile** in one `executemany`
+    (does not commit)
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param csvfile: leap seconds CSV with a header of column names, defaults to LEAP_SECONDS_CSV
+    :type csvfile: str or pathlib.Path, optional
+    :return: number of rows loaded
+    :rtype: int
+    """
+    with open(csvfile, 'r', newline='') as _f:
+        reader = csv.reader(_f)
+        header = next(reader)
+        rows = [tuple(int(_v) for _v in _r) for _r in reader if _r]
+    conn_lite.execute('DELETE FROM leap_seconds;')
+    conn_lite.executemany(f"INSERT INTO leap_seconds ({', '.join(header)}) "
+                          f"VALUES ({', '.join(['?']*len(header))});", rows)
+    return len(rows)
+
+
+def install_schema(conn_lite, tables=None, indexes=True, leap_seconds=True):
+    """Install the schema tables, secondary indexes, and LEAP_SECONDS contents into a
+    SQLite database in a single transaction
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param tables: table names to create, defaults to None (all tables in SCHEMA_DIR)
+    :type tables: list of str, optional
+    :param indexes: install secondary indexes (requires the indexed tables)? Defaults to True
+    :type indexes: bool, optional
+    :param leap_seconds: populate LEAP_SECONDS (requires that table)? Defaults to True
+    :type leap_seconds: bool, optional
+    """
+    script = schema_script(None if tables is None else tuple(tables))
+    if indexes:
+        script += '\n' + Path(INDEX_SQL).read_text()
+    try:
+        conn_lite.executescript(f'BEGIN;\n{script}\n')
+        if leap_seconds:
+            load_leap_seconds(conn_lite)
+        conn_lite.commit()
+    except sqlite3.Error:
+        conn_lite.rollback()
+        raise
+
+
+@lru_cache(maxsize=None)
+def _template(tables=None, indexes=True, leap_seconds=True):
+    """In-memory database with the schema installed, built once per argument set"""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    install_schema(conn, tables=tables, indexes=indexes, leap_seconds=leap_seconds)
+    return conn
+
+
+def create_database(dbfile, tables=None, indexes=True, leap_seconds=True, overwrite=False):
+    """Create a new SQLite database file with the schema installed by copying a cached,
+    in-memory template database (see :meth:`~.install_schema`)
+
+    :param dbfile: path of the new database file (parent directories are created)
+    :type dbfile: str or pathlib.Path
+    :param tables: table names to create, defaults to None (all tables in SCHEMA_DIR)
+    :type tables: list of str, optional
+    :param indexes: install secondary indexes? Defaults to True
+    :type indexes: bool, optional
+    :param leap_seconds: populate LEAP_SECONDS? Defaults to True
+    :type leap_seconds: bool, optional
+    :param overwrite: replace an existing file? Defaults to False
+    :type overwrite: bool, optional
+    :return: connection to the new database
+    :rtype: sqlite3.Connection
+    """
+    dbfile = Path(dbfile)
+    if dbfile.exists():
+        if not overwrite:
+            raise FileExistsError(f'Database file "{dbfile}" already exists')
+        dbfile.unlink()
+    dbfile.parent.mkdir(parents=True, exist_ok=True)
+    template = _template(None if tables is None else tuple(tables), indexes, leap_seconds)
+    conn = sqlite3.connect(dbfile)
+    template.backup(conn)
+    return conn
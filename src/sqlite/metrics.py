@@ -0,0 +1,232 @@
+"""
+module: sqlite.metrics
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides lightweight, per-stage instrumentation shared by the
+    ingest (:mod:`~postgresql.bulk`, :mod:`~postgresql.catalog`) and export
+    (:mod:`~sqlite.export`) code and the `example/cascadia` scripts.
+
+    Each named stage accumulates
+     - calls: number of times the stage ran
+     - seconds: wall time
+     - rows: rows processed
+     - rejected: rows rejected (e.g., by client-side constraint checks)
+     - round_trips: database round trips (queries, COPY calls, fetches, commits)
+     - bytes: bytes sent to the database (COPY payloads)
+
+    in the module-level METRICS registry (thread-safe), which can be written out as
+    structured JSON (:meth:`~.to_json`) or in the Prometheus text exposition format
+    for the node_exporter textfile collector (:meth:`~.to_prometheus`).
+
+    Stages can optionally be profiled with cProfile or pyinstrument
+    (see :meth:`~.set_profiler`). Only outermost stages are profiled, as profilers
+    cannot be nested.
+
+    Stage names are dotted, e.g., 'copy.arrival', 'truetime.utc2dbtime', 'export_origin.fetch'.
+"""
+
+import atexit
+import copy
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+FIELDS = ('calls', 'seconds', 'rows', 'rejected', 'round_trips', 'bytes')
+METRICS = {}
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_PROFILER = {'kind': None, 'outdir': None, 'stages': None}
+
+
+def count(name, **increments):
+    """Add to the counters of a stage (e.g., count('copy.arrival', rows=100, bytes=2048))
+
+    :param name: stage name
+    :type name: str
+    :param increments: amounts to add to any of FIELDS
+    :type increments: dict
+    """
+    with _LOCK:
+        record = METRICS.setdefault(name, dict.fromkeys(FIELDS, 0))
+        for _k, _v in increments.items():
+            record[_k] += _v
+
+
+@contextmanager
+def stage(name, **increments):
+    """Time a block of code as one call of a stage, optionally adding to its counters
+    (see :meth:`~.count`). Time is recorded even if the block raises.
+
+    :param name: stage name
+    :type name: str
+    :param increments: amounts to add to any of FIELDS
+    :type increments: dict
+    """
+    depth = getattr(_LOCAL, 'depth', 0)
+    profiler = _start_profiler(name) if depth == 0 else None
+    _LOCAL.depth = depth + 1
+    tick = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - tick
+        _LOCAL.depth = depth
+        count(name, calls=1, seconds=elapsed, **increments)
+        if profiler is not None:
+            _stop_profiler(name, profiler)
+
+
+def set_profiler(kind=None, outdir='.', stages=None):
+    """Enable (or disable) profiling of outermost stages
+
+    cProfile statistics are written to `<outdir>/<stage>.<call>.prof` (view with
+    `python -m pstats` or snakeviz) and pyinstrument reports to `<outdir>/<stage>.<call>.txt`.
+
+    :param kind: 'cprofile', 'pyinstrument', or None (disable), defaults to None
+    :type kind: str, optional
+    :param outdir: output directory, defaults to '.'
+    :type outdir: str or pathlib.Path, optional
+    :param stages: stage names to profile, defaults to None (all outermost stages)
+    :type stages: list of str, optional
+    """
+    if kind not in (None, 'cprofile', 'pyinstrument'):
+        raise ValueError(f'Unsupported profiler "{kind}"')
+    if kind is not None:
+        Path(outdir).mkdir(parents=True, exist_ok=True)
+    _PROFILER.update(kind=kind, outdir=Path(outdir),
+                     stages=None if stages is None else set(stages))
+
+
+def _start_profiler(name):
+    kind = _PROFILER['kind']
+    if kind is None or (_PROFILER['stages'] is not None and name not in _PROFILER['stages']):
+        return None
+    if kind == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    return profiler
+
+
+def _stop_profiler(name, profiler):
+    stem = _PROFILER['outdir']/f"{name}.{METRICS[name]['calls']}"
+    if _PROFILER['kind'] == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(stem.with_name(stem.name + '.prof'))
+    else:
+        profiler.stop()
+        stem.with_name(stem.name + '.txt').write_text(profiler.output_text())
+
+
+def reset():
+    """Clear all recorded metrics"""
+    with _LOCK:
+        METRICS.clear()
+
+
+def snapshot():
+    """Copy of the recorded metrics
+
+    :return: counters keyed by stage name
+    :rtype: dict
+    """
+    with _LOCK:
+        return copy.deepcopy(METRICS)
+
+
+def _write(text, path):
+    """Write atomically, so collectors never read a partial file"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def to_json(path=None, **extra):
+    """Render recorded metrics as JSON
+
+    :param path: also write to this file, defaults to None
+    :type path: str or pathlib.Path, optional
+    :param extra: additional top-level fields (e.g., script name, input file)
+    :type extra: dict
+    :return: JSON document with `stages` keyed by stage name
+    :rtype: str
+    """
+    text = json.dumps({'timestamp': time.time(), **extra, 'stages': snapshot()}, indent=2)
+    if path is not None:
+        _write(text, path)
+    return text
+
+
+def to_prometheus(path=None, prefix='pg_anss_lite', **labels):
+    """Render recorded metrics in the Prometheus text exposition format, e.g.,
+    `pg_anss_lite_stage_seconds_total{stage="copy.arrival"} 1.25`
+
+    :param path: also write to this file (e.g., `<textfile collector dir>/ingest.prom`),
+        defaults to None
+    :type path: str or pathlib.Path, optional
+    :param prefix: metric name prefix, defaults to 'pg_anss_lite'
+    :type prefix: str, optional
+    :param labels: labels added to every sample (e.g., script='ingest_all_picks')
+    :type labels: dict
+    :return: metrics text
+    :rtype: str
+    """
+    metrics = snapshot()
+    lines = []
+    for _field in FIELDS:
+        _name = f'{prefix}_stage_{_field}_total'
+        lines.append(f'# TYPE {_name} counter')
+        for _stage, _record in sorted(metrics.items()):
+            _labels = ','.join(f'{_k}="{_v}"' for _k, _v in {**labels, 'stage': _stage}.items())
+            lines.append(f'{_name}{{{_labels}}} {_record[_field]}')
+    text = '\n'.join(lines) + '\n'
+    if path is not None:
+        _write(text, path)
+    return text
+
+
+def summary():
+    """Render recorded metrics as a fixed-width table, slowest stages first
+
+    :return: table text
+    :rtype: str
+    """
+    metrics = snapshot()
+    lines = [f"{'stage':<36}{'calls':>8}{'seconds':>10}{'rows':>12}{'rows/s':>12}"
+             f"{'rejected':>10}{'trips':>8}{'MB':>9}"]
+    for _stage, _r in sorted(metrics.items(), key=lambda _i: -_i[1]['seconds']):
+        _rate = _r['rows']/_r['seconds'] if _r['seconds'] > 0 else 0.
+        lines.append(f"{_stage:<36}{_r['calls']:>8d}{_r['seconds']:>10.2f}{_r['rows']:>12d}"
+                     f"{_rate:>12.0f}{_r['rejected']:>10d}{_r['round_trips']:>8d}"
+                     f"{_r['bytes']/1024**2:>9.1f}")
+    return '\n'.join(lines)
+
+
+def report_at_exit(name, outdir=None, prometheus=True):
+    """Print a summary and write `<outdir>/<name>.json` (and `<outdir>/<name>.prom`)
+    when the interpreter exits, including after an uncaught exception
+
+    :param name: script name, added to the outputs
+    :type name: str
+    :param outdir: output directory, defaults to None (print the summary only)
+    :type outdir: str or pathlib.Path, optional
+    :param prometheus: also write the Prometheus text file? Defaults to True
+    :type prometheus: bool, optional
+    """
+    def _report():
+        print(summary())
+        if outdir is not None:
+            to_json(Path(outdir)/f'{name}.json', script=name)
+            if prometheus:
+                to_prometheus(Path(outdir)/f'{name}.prom', script=name)
+    atexit.register(_report)
@@ -0,0 +1,139 @@
+"""
+module: sqlite.parquet
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module contains methods for writing the tables of a SQLite export
+    (see :mod:`~sqlite.export`) as (Hive-style) partitioned Parquet datasets for
+    columnar analysis (e.g., memory-mapping and predicate push-down in pandas/pyarrow).
+
+    Tables with `datetime` columns gain a leap-second corrected `utc` column
+    (datetime64[ns], see :meth:`~sqlite.truetime.dbtime2datetime64`) and a `year`
+    column (UTC year) used for partitioning:
+     - ARRIVAL: partitioned by year and net
+     - ORIGIN: partitioned by year
+     - all other tables: unpartitioned
+
+    Example read with partition pruning:
+    >>> pd.read_parquet(outdir/'arrival', filters=[('year', '=', 2012), ('net', '=', '7D')])
+
+    Requires `pyarrow`
+"""
+
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+from .install import DEFAULT_TABLES
+from .truetime import dbtime2datetime64
+
+# Partition columns by table
+PARTITIONS = {'arrival': ['year', 'net'],
+              'origin': ['year']}
+
+
+def arrow_schema(conn_lite, table):
+    """Build a pyarrow schema from the declared SQLite column types of a table, so that
+    every chunk of a dataset is written with the same types regardless of null content
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :return: schema (with `utc` and `year` fields if the table has a `datetime` column)
+    :rtype: pyarrow.Schema
+    """
+    import pyarrow as pa
+
+    fields = []
+    for _r in conn_lite.execute(f'PRAGMA table_info({table});').fetchall():
+        name, decl = _r[1].lower(), _r[2].upper()
+        if 'INT' in decl:
+            dtype = pa.int64()
+        elif 'DOUBLE' in decl or 'REAL' in decl or 'FLOAT' in decl:
+            dtype = pa.float64()
+        else:
+            dtype = pa.string()
+        fields.append(pa.field(name, dtype))
+    if any(_f.name == 'datetime' for _f in fields):
+        fields += [pa.field('utc', pa.timestamp('ns')), pa.field('year', pa.int16())]
+    return pa.schema(fields)
+
+
+def add_utc_columns(df):
+    """Append leap-second corrected `utc` and `year` columns to a chunk of a table
+    with a `datetime` (database time) column
+
+    :param df: table chunk
+    :type df: pandas.DataFrame
+    :return: table chunk with `utc` and `year` columns
+    :rtype: pandas.DataFrame
+    """
+    utc = dbtime2datetime64(df['datetime'].astype(float))
+    return df.assign(utc=utc, year=utc.dt.year.astype('Int16'))
+
+
+def export_table_parquet(conn_lite, table, outdir, chunksize=500000, overwrite=True):
+    """Write one SQLite table as a Parquet dataset in **outdir**/**table**, reading and
+    writing **chunksize** rows at a time
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: table name
+    :type table: str
+    :param outdir: dataset root directory
+    :type outdir: str or pathlib.Path
+    :param chunksize: rows per read/write, defaults to 500000
+    :type chunksize: int, optional
+    :param overwrite: remove an existing dataset for this table first? Defaults to True
+    :type overwrite: bool, optional
+    :return: number of rows written
+    :rtype: int
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = Path(outdir)/table
+    if path.exists():
+        if not overwrite:
+            raise FileExistsError(f'Parquet dataset "{path}" already exists')
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+    partition_cols = PARTITIONS.get(table)
+    schema = arrow_schema(conn_lite, table)
+    nrows = 0
+    for _i, df in enumerate(pd.read_sql(f'SELECT * FROM {table};', con=conn_lite, chunksize=chunksize)):
+        df.columns = [_c.lower() for _c in df.columns]
+        if 'datetime' in df.columns:
+            df = add_utc_columns(df)
+        # Pandas metadata is dropped so partition columns read back as plain categories
+        patable = pa.Table.from_pandas(df, schema=schema, preserve_index=False).replace_schema_metadata(None)
+        if partition_cols:
+            pq.write_to_dataset(patable, root_path=str(path), partition_cols=partition_cols,
+                                basename_template=f'part-{_i:05d}-{{i}}.parquet',
+                                existing_data_behavior='overwrite_or_ignore')
+        else:
+            pq.write_table(patable, str(path/f'part-{_i:05d}.parquet'))
+        nrows += len(df)
+    return nrows
+
+
+def export_parquet(conn_lite, outdir, tables=DEFAULT_TABLES, chunksize=500000, overwrite=True):
+    """Write a selection of SQLite tables as Parquet datasets under **outdir**
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param outdir: output root directory (one sub-directory per table)
+    :type outdir: str or pathlib.Path
+    :param tables: table names, defaults to DEFAULT_TABLES
+    :type tables: list of str, optional
+    :param chunksize: rows per read/write, defaults to 500000
+    :type chunksize: int, optional
+    :param overwrite: replace existing datasets? Defaults to True
+    :type overwrite: bool, optional
+    :return: number of rows written per table
+    :rtype: dict
+    """
+    return {_t: export_table_parquet(conn_lite, _t, outdir, chunksize=chunksize, overwrite=overwrite)
+            for _t in tables}
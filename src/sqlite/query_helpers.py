@@ -1,11 +1,247 @@
+import json
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-from truetime import dbtime2timestamp
+from .timeparse import NAT
+from .truetime import dbtime2datetime64, register_functions, utc2dbtime
+
+# PRAGMA settings applied to read-only (pooled) connections
+READ_PRAGMAS = {'query_only': 'ON',
+                'mmap_size': 268435456,
+                'cache_size': -65536,
+                'temp_store': 'MEMORY'}
+
+# Prepared statements kept per connection (see sqlite3.connect `cached_statements`)
+CACHED_STATEMENTS = 256
+
+# Connection pools by resolved database path (see :meth:`~.pooled_connection`)
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
 
 def connect_to_database(sqlite_file):
+    """Open a SQLite database with the `truetime_get_epoch` and `truetime_put_epoch`
+    functions registered (see :meth:`~sqlite.truetime.register_functions`)
+
+    :param sqlite_file: path to the database file
+    :type sqlite_file: str or pathlib.Path
+    :return: connection
+    :rtype: sqlite3.Connection
+    """    
     conn = sqlite3.connect(sqlite_file)
+    register_functions(conn)
+    return conn
+
+
+def connect_read_only(sqlite_file, pragmas=READ_PRAGMAS, cached_statements=CACHED_STATEMENTS):
+    """Open a SQLite database in read-only URI mode with READ_PRAGMAS applied and the
+    TrueTime functions registered. The connection may be used from any thread (one
+    thread at a time, e.g., via :meth:`~.pooled_connection`)
+
+    :param sqlite_file: path to the database file
+    :type sqlite_file: str or pathlib.Path
+    :param pragmas: PRAGMA names and values, defaults to READ_PRAGMAS
+    :type pragmas: dict, optional
+    :param cached_statements: number of prepared statements to cache, defaults to CACHED_STATEMENTS
+    :type cached_statements: int, optional
+    :return: connection
+    :rtype: sqlite3.Connection
+    """    
+    uri = f'{Path(sqlite_file).resolve().as_uri()}?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                           cached_statements=cached_statements)
+    for _k, _v in pragmas.items():
+        conn.execute(f'PRAGMA {_k} = {_v};')
+    register_functions(conn)
     return conn
 
+
+def _get_pool(sqlite_file, maxsize):
+    """Get (or create) the pool record for a database file"""
+    key = str(Path(sqlite_file).resolve())
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = {'idle': queue.LifoQueue(),
+                           'slots': threading.BoundedSemaphore(maxsize)}
+        return _POOLS[key]
+
+
+@contextmanager
+def pooled_connection(sqlite_file, maxsize=8, timeout=None):
+    """Borrow a read-only connection (see :meth:`~.connect_read_only`) from a per-file,
+    thread-safe pool of at most **maxsize** connections. Idle connections are reused most
+    recently used first, so callers get connections with warm page and statement caches;
+    connections are opened lazily and kept open until :meth:`~.close_pools`.
+
+    Example:
+    >>> with pooled_connection('cascadia_obs.db') as conn:
+    ...     df = select_preferred_origins(conn, evids)
+
+    :param sqlite_file: path to the database file
+    :type sqlite_file: str or pathlib.Path
+    :param maxsize: maximum number of connections to this file (set by the first call
+        for a given file), defaults to 8
+    :type maxsize: int, optional
+    :param timeout: seconds to wait for a free connection, defaults to None (wait indefinitely)
+    :type timeout: float, optional
+    :yield: connection
+    :rtype: sqlite3.Connection
+    """    
+    pool = _get_pool(sqlite_file, maxsize)
+    if not pool['slots'].acquire(timeout=timeout):
+        raise TimeoutError(f'No pooled connection to "{sqlite_file}" available within {timeout} s')
+    try:
+        try:
+            conn = pool['idle'].get_nowait()
+        except queue.Empty:
+            conn = connect_read_only(sqlite_file)
+        try:
+            yield conn
+        finally:
+            # Leave no open transaction or cursor state behind for the next borrower
+            conn.rollback()
+            pool['idle'].put(conn)
+    finally:
+        pool['slots'].release()
+
+
+def close_pools():
+    """Close all idle pooled connections and forget all pools"""
+    with _POOLS_LOCK:
+        for _pool in _POOLS.values():
+            while True:
+                try:
+                    _pool['idle'].get_nowait().close()
+                except queue.Empty:
+                    break
+        _POOLS.clear()
+
+
+# Output formats supported by :meth:`~.iter_preferred_origins`
+OUTPUTS = ('pandas', 'numpy', 'arrow')
+
+_ORIGIN_COLUMNS = """e.evid, e.etype, 
+                    o.orid, o.datetime AS nom_origin, o.lat, o.lon, o.depth, o.erhor as herr_km, o.sdep as verr_km, o.wrms"""
+
+_PHASE_COLUMNS = """a.arid, a.datetime AS nom_arrival, a.net AS network, a.sta AS station, 
+                    CASE WHEN a.location = '  ' THEN '' ELSE a.location END AS location,
+                    a.seedchan AS channel, a.iphase AS label, a.quality"""
+
+
+def _as_id_list(event_ids):
+    """Normalize one or more integer-like IDs into a list of int"""
+    if isinstance(event_ids, (str, int, np.integer)):
+        return [int(event_ids)]
+    return [int(_e) for _e in event_ids]
+
+
+def ids_param(ids):
+    """Encode IDs as a single JSON array parameter for `json_each(?)`, so that queries
+    bind any number of IDs without inlining them into the SQL text (avoids SQLite
+    expression/parameter limits, keeps the statement text constant for the prepared
+    statement cache, and works on read-only connections)
+
+    :param ids: integer-like IDs
+    :type ids: int, str, or iterable thereof
+    :return: JSON array
+    :rtype: str
+    """    
+    return json.dumps(_as_id_list(ids))
+
+
+def _format_chunk(df, output):
+    """Convert a DataFrame chunk into the requested **output** container"""
+    if output == 'pandas':
+        return df
+    elif output == 'numpy':
+        return df.to_records(index=False)
+    else:
+        import pyarrow as pa
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _iter_query(conn, sql, params=(), truetime=False, chunksize=100000, output='pandas'):
+    """Execute **sql** and yield results in chunks of up to **chunksize** rows (a single
+    chunk, possibly empty, if **chunksize** is None) formatted as **output**, converting
+    `nom_origin`/`nom_arrival` to UTC `origin`/`arrival` datetime64 columns if **truetime**
+    """
+    if output not in OUTPUTS:
+        raise ValueError(f'output "{output}" not supported. Supported: {OUTPUTS}')
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        columns = [_d[0] for _d in cur.description]
+        if truetime:
+            columns = [{'nom_origin': 'origin', 'nom_arrival': 'arrival'}.get(_c, _c) for _c in columns]
+        while True:
+            rows = cur.fetchall() if chunksize is None else cur.fetchmany(chunksize)
+            # A single fetchall() chunk is yielded even if empty, to carry the column names
+            if not rows and chunksize is not None:
+                break
+            df = pd.DataFrame.from_records(rows, columns=columns)
+            if truetime:
+                # Vectorized conversion to UTC datetime64[ns] values
+                for _c in ('origin', 'arrival'):
+                    if _c in df.columns:
+                        df[_c] = dbtime2datetime64(df[_c].astype(float))
+            yield _format_chunk(df, output)
+            if chunksize is None:
+                break
+    finally:
+        cur.close()
+
+
+def iter_preferred_origins(conn, event_ids, include_phases=False, truetime=False,
+                           chunksize=100000, output='pandas'):
+    """Generator version of :meth:`~.select_preferred_origins` that binds event IDs
+    as one parameter (see :meth:`~.ids_param`) and yields results in chunks of up to
+    **chunksize** rows
+
+    :param conn: sqlite3 connection to the desired database (see :meth:`~.connect_to_database`)
+    :type conn: sqlite3.Connection
+    :param event_ids: one or more integer-like event IDs to query
+    :type event_ids: int, str or iterable thereof
+    :param include_phases: should phase-arrival data be included? Defaults to False
+    :type include_phases: bool, optional
+    :param truetime: should time columns be converted to UTC datetime64 values? Defaults to False
+    :type truetime: bool, optional
+    :param chunksize: maximum rows per chunk, defaults to 100000
+    :type chunksize: int, optional
+    :param output: chunk format, one of OUTPUTS: 'pandas' (DataFrame), 'numpy'
+        (structured numpy.recarray), or 'arrow' (pyarrow.Table, requires `pyarrow`).
+        Defaults to 'pandas'
+    :type output: str, optional
+    :yield: result chunks
+    :rtype: pandas.DataFrame, numpy.recarray, or pyarrow.Table
+    """    
+    if output not in OUTPUTS:
+        raise ValueError(f'output "{output}" not supported. Supported: {OUTPUTS}')
+    if include_phases:
+        _sql = f"""
+                SELECT {_ORIGIN_COLUMNS},
+                    {_PHASE_COLUMNS} 
+                FROM event e
+                    INNER JOIN origin o ON e.prefor = o.orid
+                    INNER JOIN assocaro x ON o.orid = x.orid 
+                    INNER JOIN arrival a ON x.arid = a.arid
+                WHERE e.evid IN (SELECT value FROM json_each(?));
+            """
+    else:
+        _sql = f"""
+                SELECT {_ORIGIN_COLUMNS}
+                FROM event e
+                    INNER JOIN origin o ON e.prefor = o.orid
+                WHERE e.evid IN (SELECT value FROM json_each(?));
+            """
+    yield from _iter_query(conn, _sql, params=(ids_param(event_ids),), truetime=truetime,
+                           chunksize=chunksize, output=output)
+
+
 def select_preferred_origins(conn, event_ids, include_phases=False, truetime=False):
     """Fetch records for the hypocentral parameter estimates tied to the preferred origins of
     specified event IDs (EVID) with the option to include contributing phase arrival information.
@@ -26,46 +262,241 @@ def select_preferred_origins(conn, event_ids, include_phases=False, truetime=Fal
 
     :param conn: sqlite3 connection to the desired database (see :meth:`~.connect_to_database`)
     :type conn: sqlite3.connect.Connection
-    :param event_ids: one or more integer-like event IDs to query
-    :type event_ids: int, str or list, tuple, or set thereof
+    :param event_ids: one or more integer-like event IDs to query. IDs are bound as one
+        parameter (see :meth:`~.ids_param`), so large ID lists are supported. For chunked
+        or NumPy/Arrow output see :meth:`~.iter_preferred_origins`
+    :type event_ids: int, str or iterable thereof
     :param include_phases: should phase-arrival data be included? Defaults to False
     :type include_phases: bool, optional
+    :param truetime: should time columns be converted to UTC datetime64 values? Defaults to False
+    :type truetime: bool, optional
     :return: result dataframe
     :rtype: pandas.DataFrame
     """    
-    if isinstance(event_ids, (str, int)):
-        event_ids = [str(int(event_ids))]
-    elif isinstance(event_ids, (list, tuple, set)):
-        if all(isinstance(_e, (int, str)) for _e in event_ids):
-            event_ids = [str(int(_e)) for _e in event_ids]
+    return next(iter_preferred_origins(conn, event_ids, include_phases=include_phases,
+                                       truetime=truetime, chunksize=None))
+
+
+def _as_dbtime(t):
+    """Convert a UTC time (epoch seconds, str, or datetime-like) into a database `datetime` value"""
+    if isinstance(t, str):
+        t = pd.Timestamp(t)
+    if isinstance(t, pd.Timestamp) and t.tzinfo is not None:
+        t = t.tz_convert('UTC').tz_localize(None)
+    return utc2dbtime(t)
+
+
+def select_origins_in_box(conn, minlat=None, maxlat=None, minlon=None, maxlon=None,
+                          starttime=None, endtime=None, minmag=None, maxmag=None,
+                          include_phases=False, truetime=False, chunksize=None, output='pandas'):
+    """Fetch preferred origins inside a latitude/longitude box and time window, optionally
+    filtered by the magnitude of the event's preferred NETMAG entry (EVENT.prefmag, falling
+    back to ORIGIN.prefmag), with the option to include contributing phase arrivals.
+
+    Candidates are found with the ORIGIN_RTREE R*Tree index (built by
+    `sqlite/indexes/create_indexes.sql`) and re-checked against exact ORIGIN values.
+    The R*Tree is forced to be the outer loop of the join (CROSS JOIN).
+    Bounds left as None are not applied. Output columns are those of
+    :meth:`~.select_preferred_origins` plus `magid`, `magnitude`, and `magtype`.
+
+    :param conn: sqlite3 connection to the desired database (see :meth:`~.connect_to_database`)
+    :type conn: sqlite3.Connection
+    :param minlat: southern bound in degrees, defaults to None
+    :type minlat: float, optional
+    :param maxlat: northern bound in degrees, defaults to None
+    :type maxlat: float, optional
+    :param minlon: western bound in degrees, defaults to None
+    :type minlon: float, optional
+    :param maxlon: eastern bound in degrees, defaults to None
+    :type maxlon: float, optional
+    :param starttime: earliest UTC origin time, defaults to None
+    :type starttime: float, str, pandas.Timestamp, or obspy.UTCDateTime, optional
+    :param endtime: latest UTC origin time, defaults to None
+    :type endtime: float, str, pandas.Timestamp, or obspy.UTCDateTime, optional
+    :param minmag: minimum preferred magnitude, defaults to None
+    :type minmag: float, optional
+    :param maxmag: maximum preferred magnitude, defaults to None
+    :type maxmag: float, optional
+    :param include_phases: should phase-arrival data be included? Defaults to False
+    :type include_phases: bool, optional
+    :param truetime: should time columns be converted to UTC datetime64 values? Defaults to False
+    :type truetime: bool, optional
+    :param chunksize: if set, return a generator of chunks of up to this many rows, defaults
+        to None (single result)
+    :type chunksize: int, optional
+    :param output: result format, one of OUTPUTS, defaults to 'pandas'
+    :type output: str, optional
+    :return: result (or generator of results if **chunksize** is set)
+    :rtype: pandas.DataFrame, numpy.recarray, or pyarrow.Table
+    """    
+    tmin = None if starttime is None else _as_dbtime(starttime)
+    tmax = None if endtime is None else _as_dbtime(endtime)
+    # (R*Tree column, exact column, operator, value) for each applied bound
+    bounds = [('r.max_lat', 'o.lat', '>=', minlat), ('r.min_lat', 'o.lat', '<=', maxlat),
+              ('r.max_lon', 'o.lon', '>=', minlon), ('r.min_lon', 'o.lon', '<=', maxlon),
+              ('r.max_time', 'o.datetime', '>=', tmin), ('r.min_time', 'o.datetime', '<=', tmax)]
+    clauses = []
+    params = []
+    for _rcol, _ocol, _op, _v in bounds:
+        if _v is not None:
+            # Unary + keeps the planner from using ORIGIN indexes for the exact re-check
+            clauses += [f'{_rcol} {_op} ?', f'+{_ocol} {_op} ?']
+            params += [float(_v), float(_v)]
+    for _op, _v in [('>=', minmag), ('<=', maxmag)]:
+        if _v is not None:
+            clauses.append(f'm.magnitude {_op} ?')
+            params.append(float(_v))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
     if include_phases:
         _sql = f"""
-                SELECT e.evid, e.etype, 
-                    o.orid, o.datetime AS nom_origin, o.lat, o.lon, o.depth, o.erhor as herr_km, o.sdep as verr_km, o.wrms,
-                    a.arid, a.datetime AS nom_arrival, a.net AS network, a.sta AS station, 
-                    CASE WHEN a.location = '  ' THEN '' ELSE a.location END AS location,
-                    a.seedchan AS channel, a.iphase AS label, a.quality 
-                FROM event e 
-                    INNER JOIN origin o ON e.prefor = o.orid
+                SELECT {_ORIGIN_COLUMNS},
+                    m.magid, m.magnitude, m.magtype,
+                    {_PHASE_COLUMNS} 
+                FROM origin_rtree r
+                    CROSS JOIN origin o ON o.orid = r.orid
+                    INNER JOIN event e ON e.prefor = o.orid
+                    LEFT JOIN netmag m ON m.magid = COALESCE(e.prefmag, o.prefmag)
                     INNER JOIN assocaro x ON o.orid = x.orid 
                     INNER JOIN arrival a ON x.arid = a.arid
-                WHERE e.evid IN ({','.join(event_ids)});
+                {where};
             """
     else:
         _sql = f"""
-                SELECT e.evid, e.etype, 
-                    o.orid, o.datetime AS nom_origin, o.lat, o.lon, o.depth, o.erhor as herr_km, o.sdep as verr_km, o.wrms,
-                FROM event e 
-                    INNER JOIN origin o ON e.prefor = o.orid 
-                WHERE e.evid IN ({','.join(event_ids)});
+                SELECT {_ORIGIN_COLUMNS},
+                    m.magid, m.magnitude, m.magtype
+                FROM origin_rtree r
+                    CROSS JOIN origin o ON o.orid = r.orid
+                    INNER JOIN event e ON e.prefor = o.orid
+                    LEFT JOIN netmag m ON m.magid = COALESCE(e.prefmag, o.prefmag)
+                {where};
             """
-    df = pd.read_sql(_sql, con=conn)
-    if truetime:
+    results = _iter_query(conn, _sql, params=params, truetime=truetime, chunksize=chunksize, output=output)
+    if chunksize is None:
+        return next(results)
+    return results
 
-        df.nom_origin = df.nom_origin.apply(lambda x: nominal2timestamp(x, format='pandas'))
-        df = df.rename(columns={'nom_origin':'origin'})
-        if include_phases:
-            df.nom_arrival = df.nom_arrival.apply(lambda x: nominal2timestamp(x, format='pandas'))
-            df = df.rename(columns={'nom_arrival': 'arrival'})
-    return df
 
+def _as_str_array(values):
+    """Fixed-width unicode array with NULLs as empty strings"""
+    return pd.Series(values, dtype=object).fillna('').to_numpy(dtype=str)
+
+
+def gather_picks(conn, event_ids, phases=None):
+    """Gather the phase arrivals associated with the preferred origins of a batch of events
+    into compact, event-grouped arrays built in a single sorted pass (no DataFrame groupby)
+
+    Arrivals are fetched unsorted and sorted once client-side by event and pick time
+    (numpy.lexsort). Picks of the i-th event in `evid` are
+    rows `offsets[i]:offsets[i + 1]` of the per-pick arrays (see :meth:`~.iter_gathers`).
+
+    Picks without a UTC time (a NULL `datetime` or one that falls on a leap second)
+    convert to NaT, whose int64 value (:data:`~sqlite.timeparse.NAT`, the int64 minimum)
+    reads as a time in 1677, so they are left out of the gather.
+
+    :param conn: sqlite3 connection to the desired database (see :meth:`~.connect_to_database`)
+    :type conn: sqlite3.Connection
+    :param event_ids: one or more integer-like event IDs to query
+    :type event_ids: int, str or iterable thereof
+    :param phases: phase labels (IPHASE) to include, defaults to None (all)
+    :type phases: list of str, optional
+    :return: gather with keys
+        - 'evid': int64 event IDs with at least one pick, ascending
+        - 'offsets': int64 start of each event's picks (length len(evid) + 1)
+        - 'network', 'station', 'location', 'channel': per-pick SEED codes (str)
+        - 'phase': per-pick phase labels (str)
+        - 'time_ns': per-pick UTC times as int64 nanoseconds since 1970-01-01T00:00:00Z
+          (never NAT)
+    :rtype: dict of numpy.ndarray
+    """    
+    params = [ids_param(event_ids)]
+    _phase = ''
+    if phases is not None:
+        _phase = 'AND a.iphase IN (SELECT value FROM json_each(?))'
+        params.append(json.dumps(list(phases)))
+    _sql = f"""
+            SELECT e.evid, a.net, a.sta,
+                CASE WHEN a.location = '  ' THEN '' ELSE a.location END,
+                a.seedchan, a.iphase, a.datetime
+            FROM event e
+                INNER JOIN assocaro x ON e.prefor = x.orid
+                INNER JOIN arrival a ON x.arid = a.arid
+            WHERE e.evid IN (SELECT value FROM json_each(?)) {_phase};
+        """
+    df = pd.DataFrame.from_records(conn.execute(_sql, params).fetchall(),
+                                   columns=['evid', 'network', 'station', 'location', 'channel',
+                                            'phase', 'datetime'])
+    evid = df['evid'].to_numpy(dtype=np.int64)
+    dbtime = df['datetime'].to_numpy(dtype=np.float64)
+    time_ns = dbtime2datetime64(dbtime).astype(np.int64)
+    valid = np.flatnonzero(time_ns != NAT)
+    # Single (event, time) sort, then event boundaries from changes in the sorted IDs
+    order = valid[np.lexsort((dbtime[valid], evid[valid]))]
+    evid = evid[order]
+    starts = np.flatnonzero(np.r_[True, evid[1:] != evid[:-1]]) if len(evid) else np.zeros(0, dtype=np.int64)
+    time_ns = time_ns[order]
+    cols = {_c: _as_str_array(df[_c].to_numpy()[order])
+            for _c in ['network', 'station', 'location', 'channel', 'phase']}
+    return {'evid': evid[starts],
+            'offsets': np.r_[starts, len(evid)].astype(np.int64),
+            **cols,
+            'time_ns': time_ns}
+
+
+def iter_gathers(gather):
+    """Iterate over the events of a gather (see :meth:`~.gather_picks`)
+
+    :param gather: gather
+    :type gather: dict of numpy.ndarray
+    :yield: event ID and per-pick array views for that event
+    :rtype: tuple (int, dict of numpy.ndarray)
+    """    
+    offsets = gather['offsets']
+    for _i, _evid in enumerate(gather['evid']):
+        _s = slice(offsets[_i], offsets[_i + 1])
+        yield int(_evid), {_k: _v[_s] for _k, _v in gather.items() if _k not in ('evid', 'offsets')}
+
+
+def gather_to_bulk(gather, pre=10., post=60.):
+    """Convert a gather into ObsPy bulk waveform request tuples
+    (network, station, location, channel, starttime, endtime) per event
+
+    :param gather: gather (see :meth:`~.gather_picks`)
+    :type gather: dict of numpy.ndarray
+    :param pre: seconds before each pick, defaults to 10.
+    :type pre: float, optional
+    :param post: seconds after each pick, defaults to 60.
+    :type post: float, optional
+    :return: bulk request lists keyed by event ID
+    :rtype: dict
+    """    
+    from obspy import UTCDateTime
+
+    bulk = {}
+    for _evid, _g in iter_gathers(gather):
+        bulk[_evid] = [(_n, _s, _l, _c, UTCDateTime(ns=_t - int(pre*1e9)), UTCDateTime(ns=_t + int(post*1e9)))
+                       for _n, _s, _l, _c, _t in zip(_g['network'].tolist(), _g['station'].tolist(),
+                                                     _g['location'].tolist(), _g['channel'].tolist(),
+                                                     _g['time_ns'].tolist())]
+    return bulk
+
+
+def gather_to_picks(gather):
+    """Convert a gather into ObsPy Pick objects per event
+
+    :param gather: gather (see :meth:`~.gather_picks`)
+    :type gather: dict of numpy.ndarray
+    :return: pick lists keyed by event ID
+    :rtype: dict
+    """    
+    from obspy import UTCDateTime
+    from obspy.core.event import Pick, WaveformStreamID
+
+    picks = {}
+    for _evid, _g in iter_gathers(gather):
+        picks[_evid] = [Pick(time=UTCDateTime(ns=_t), phase_hint=_p,
+                             waveform_id=WaveformStreamID(network_code=_n, station_code=_s,
+                                                          location_code=_l, channel_code=_c))
+                        for _n, _s, _l, _c, _p, _t in zip(_g['network'].tolist(), _g['station'].tolist(),
+                                                          _g['location'].tolist(), _g['channel'].tolist(),
+                                                          _g['phase'].tolist(), _g['time_ns'].tolist())]
+    return picks
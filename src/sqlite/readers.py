@@ -0,0 +1,96 @@
+"""
+module: sqlite.readers
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module provides a chunked, memory-bounded CSV reader for multi-GB input
+    files (e.g., the ELEP pick file read by `example/cascadia/ingest_all_picks.py`)
+    that removes duplicate rows across chunks as it streams.
+
+    Each row is reduced to a 64-bit hash of its values
+    (:func:`pandas.util.hash_pandas_object`). Hashes of rows already yielded are kept
+    as a few sorted `uint64` arrays of doubling size (merged as they fill, like a
+    log-structured merge tree), so membership tests are vectorized binary searches and
+    the only state that grows with the file is 8 bytes per unique row. Peak memory is
+    otherwise bounded by the chunk size.
+
+    As with :meth:`pandas.DataFrame.drop_duplicates`, the first occurrence of a row is
+    kept and the index (e.g., **index_col**) is not part of the comparison. Two distinct
+    rows collide with a probability of about n**2 / 2**65 for n unique rows
+    (~1e-7 for 100 million rows).
+
+    Reading and deduplication are recorded as the 'csv.read' and 'csv.dedup' stages
+    in :mod:`~sqlite.metrics`.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .metrics import count, stage
+
+
+def _seen(levels, hashes):
+    """Which **hashes** are present in any of the sorted arrays in **levels**"""
+    found = np.zeros(len(hashes), dtype=bool)
+    for _level in levels:
+        if len(_level) == 0:
+            continue
+        _i = np.searchsorted(_level, hashes).clip(max=len(_level) - 1)
+        found |= _level[_i] == hashes
+    return found
+
+
+def _add(levels, hashes):
+    """Add unique, unseen **hashes** to **levels**, merging levels of similar size so
+    there are at most ~log2(n/chunksize) levels"""
+    if len(hashes) == 0:
+        return
+    new = np.sort(hashes)
+    while levels and len(levels[-1]) <= 2*len(new):
+        new = np.concatenate([levels.pop(), new])
+        new.sort(kind='stable')
+    levels.append(new)
+
+
+def iter_csv_chunks(path, chunksize=500000, dtype=None, dedup=True, subset=None, **kwargs):
+    """Read a CSV file in chunks of up to **chunksize** rows, optionally dropping rows
+    that duplicate any earlier row of the file
+
+    :param path: CSV file
+    :type path: str or pathlib.Path
+    :param chunksize: rows read per chunk, defaults to 500000
+    :type chunksize: int, optional
+    :param dtype: column dtypes passed to :func:`pandas.read_csv`. Compact dtypes (e.g.,
+        'category' for repeated codes, 'float32' for bounded values) reduce the memory
+        used per chunk. Defaults to None (inferred per chunk)
+    :type dtype: dict, optional
+    :param dedup: drop duplicate rows across all chunks? Defaults to True
+    :type dedup: bool, optional
+    :param subset: columns compared to identify duplicates, defaults to None (all columns)
+    :type subset: list of str, optional
+    :param kwargs: additional keyword arguments for :func:`pandas.read_csv`
+        (e.g., index_col, usecols)
+    :return: generator of chunks, each holding only rows not seen in earlier chunks
+        (chunks may be shorter than **chunksize**, but are never empty)
+    :rtype: generator of pandas.DataFrame
+    """
+    levels = []
+    reader = pd.read_csv(path, chunksize=chunksize, dtype=dtype, **kwargs)
+    with reader:
+        while True:
+            with stage('csv.read'):
+                chunk = next(reader, None)
+            if chunk is None:
+                return
+            count('csv.read', rows=len(chunk))
+            if dedup:
+                with stage('csv.dedup', rows=len(chunk)):
+                    cols = chunk if subset is None else chunk[subset]
+                    hashes = pd.util.hash_pandas_object(cols, index=False).to_numpy()
+                    keep = ~pd.Series(hashes).duplicated().to_numpy()
+                    keep[keep] = ~_seen(levels, hashes[keep])
+                    _add(levels, hashes[keep])
+                count('csv.dedup', rejected=int(len(chunk) - keep.sum()))
+                chunk = chunk[keep]
+            if len(chunk) > 0:
+                yield chunk
@@ -0,0 +1,216 @@
+"""
+module: sqlite.timeparse
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: This module contains vectorized methods shared by the ingest scripts for parsing
+    whole columns of time values into int64 nanoseconds since 1970-01-01T00:00:00Z
+    (the representation behind numpy.datetime64[ns] and pandas.Timestamp), without
+    constructing per-row Python objects:
+     - ISO8601 strings (pick, trigger, and origin times) with :meth:`~.iso_to_ns`
+     - year/month/day/hour/minute/second component columns (or year/day-of-year/...)
+       with :meth:`~.components_to_ns`
+
+    Missing or unparseable values are NAT (the int64 value of numpy.datetime64('NaT')).
+    Durations (e.g., ARRIVAL `deltim` from trigger onset/offset times) are array
+    differences (:meth:`~.duration_seconds`) and leap-second shifts between UTC and
+    database time are applied in bulk in integer nanoseconds (:meth:`~.utc2dbtime_ns`,
+    :meth:`~.dbtime2utc_ns`), using the same leap-second ranges as :mod:`~sqlite.truetime`.
+
+    ISO8601 strings are parsed with pyarrow's string-to-timestamp cast when it is
+    installed, which is roughly 10 times faster than :func:`pandas.to_datetime`,
+    falling back to :func:`pandas.to_datetime` for layouts pyarrow does not accept.
+
+Note on time format
+ - UTC (UNIX) epoch nanoseconds do not count leap seconds. Database `datetime` values
+    include them if the database timebase is TRUE (see :mod:`~sqlite.truetime`).
+"""
+
+import numpy as np
+import pandas as pd
+
+from .truetime import LEAP_SECONDS, _lookup_ls_count, _wrap_like
+
+NAT = np.iinfo(np.int64).min
+NS_PER_S = 1_000_000_000
+
+
+def _arrow_iso_to_ns(values):
+    """Parse with pyarrow, returning None if pyarrow is missing or rejects any value"""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        return None
+    try:
+        arr = pa.array(values, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    # Strings with a zone designator ('Z', '+01:00'), then strings without one (as UTC)
+    for _type in (pa.timestamp('ns', tz='UTC'), pa.timestamp('ns')):
+        try:
+            ts = pc.cast(arr, _type)
+        except pa.ArrowInvalid:
+            continue
+        return ts.cast(pa.int64()).fill_null(NAT).to_numpy(zero_copy_only=False)
+    return None
+
+
+def iso_to_ns(values):
+    """Parse ISO8601 strings (e.g., '2012-01-01T00:00:00.5Z') into UTC epoch nanoseconds.
+    Strings without a zone designator are read as UTC.
+
+    :param values: time strings (None/NaN/empty/unparseable values become NAT)
+    :type values: array-like of str or pandas.Series
+    :return: nanoseconds since 1970-01-01T00:00:00Z
+    :rtype: numpy.ndarray or pandas.Series of int64 (matches input)
+    """
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        # Parse each category once
+        codes = values.cat.codes.to_numpy()
+        parsed = np.append(iso_to_ns(values.cat.categories.to_numpy(dtype=object)), NAT)
+        return _wrap_like(parsed[codes], values)
+    ns = _arrow_iso_to_ns(values)
+    if ns is None:
+        ts = pd.to_datetime(pd.Series(np.asarray(values, dtype=object)), utc=True,
+                            format='ISO8601', errors='coerce')
+        ns = ts.dt.tz_convert(None).to_numpy().astype('datetime64[ns]').view(np.int64)
+    return _wrap_like(np.asarray(ns, dtype=np.int64), values)
+
+
+def _days_from_civil(year, month, day):
+    """Days since 1970-01-01 of proleptic Gregorian dates (H. Hinnant's algorithm)"""
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    yoe = year - era*400
+    doy = (153*(month + np.where(month > 2, -3, 9)) + 2)//5 + day - 1
+    doe = yoe*365 + yoe//4 - yoe//100 + doy
+    return era*146097 + doe - 719468
+
+
+def components_to_ns(df, year='year', month='month', day='day', hour='hour',
+                     minute='minute', second='second'):
+    """Combine component columns (e.g., YEAR, MONTH, DAY, HOUR, MINUTE, SECOND) into
+    UTC epoch nanoseconds with integer arithmetic
+
+    :param df: table with time component columns
+    :type df: pandas.DataFrame
+    :param year: year column, defaults to 'year'
+    :type year: str, optional
+    :param month: month column, defaults to 'month'. If None, **day** is the day of year.
+    :type month: str or None, optional
+    :param day: day of month (or day of year) column, defaults to 'day'
+    :type day: str, optional
+    :param hour: hour column, defaults to 'hour' (None for 0)
+    :type hour: str or None, optional
+    :param minute: minute column, defaults to 'minute' (None for 0)
+    :type minute: str or None, optional
+    :param second: (fractional) second column, defaults to 'second' (None for 0)
+    :type second: str or None, optional
+    :return: nanoseconds since 1970-01-01T00:00:00Z (NAT where any component is missing)
+    :rtype: pandas.Series of int64
+    """
+    def _column(name):
+        if name is None:
+            return np.zeros(len(df))
+        return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64)
+
+    parts = {_k: _column(_n) for _k, _n in
+             [('year', year), ('month', month), ('day', day), ('hour', hour),
+              ('minute', minute), ('second', second)]}
+    missing = np.zeros(len(df), dtype=bool)
+    for _v in parts.values():
+        missing |= ~np.isfinite(_v)
+    ints = {_k: np.where(missing, 0, _v).astype(np.int64) for _k, _v in parts.items()
+            if _k != 'second'}
+    if month is None:
+        days = _days_from_civil(ints['year'], np.ones_like(ints['year']), ints['day'])
+    else:
+        days = _days_from_civil(ints['year'], ints['month'], ints['day'])
+    sec = np.where(missing, 0., parts['second'])
+    whole = np.floor(sec)
+    ns = ((days*24 + ints['hour'])*60 + ints['minute'])*60 + whole.astype(np.int64)
+    ns = ns*NS_PER_S + np.round((sec - whole)*1e9).astype(np.int64)
+    return pd.Series(np.where(missing, NAT, ns), index=df.index)
+
+
+def ns_to_seconds(ns):
+    """Convert epoch nanoseconds into float64 epoch seconds (NaN for NAT)
+
+    :param ns: nanoseconds
+    :type ns: numpy.ndarray or pandas.Series of int64
+    :return: seconds
+    :rtype: numpy.ndarray or pandas.Series (matches input)
+    """
+    _ns = np.asarray(ns, dtype=np.int64)
+    return _wrap_like(np.where(_ns == NAT, np.nan, _ns/1e9), ns)
+
+
+def ns_to_datetime64(ns):
+    """View epoch nanoseconds as numpy.datetime64[ns] values (NAT becomes NaT)
+
+    :param ns: nanoseconds
+    :type ns: numpy.ndarray or pandas.Series of int64
+    :return: timestamps
+    :rtype: numpy.ndarray or pandas.Series (matches input)
+    """
+    return _wrap_like(np.asarray(ns, dtype=np.int64).view('datetime64[ns]'), ns)
+
+
+def duration_seconds(start_ns, end_ns):
+    """Elementwise **end_ns** - **start_ns** in seconds (e.g., trigger offset - onset)
+
+    :param start_ns: start times in nanoseconds
+    :type start_ns: numpy.ndarray or pandas.Series of int64
+    :param end_ns: end times in nanoseconds
+    :type end_ns: numpy.ndarray or pandas.Series of int64
+    :return: durations (NaN where either time is NAT)
+    :rtype: numpy.ndarray or pandas.Series (matches **start_ns**)
+    """
+    _s = np.asarray(start_ns, dtype=np.int64)
+    _e = np.asarray(end_ns, dtype=np.int64)
+    return _wrap_like(np.where((_s == NAT) | (_e == NAT), np.nan, (_e - _s)/1e9), start_ns)
+
+
+def _shift_ns(ns, starts, ends, counts):
+    _ns = np.asarray(ns, dtype=np.int64)
+    nat = _ns == NAT
+    _ls = _lookup_ls_count(np.where(nat, np.nan, np.floor_divide(_ns, NS_PER_S)),
+                           starts, ends, counts)
+    bad = nat | np.isnan(_ls)
+    return np.where(bad, NAT, _ns + np.where(bad, 0, _ls).astype(np.int64)*NS_PER_S)
+
+
+def utc2dbtime_ns(ns, table=None):
+    """Shift UTC epoch nanoseconds to database time nanoseconds by adding the applicable
+    leap-second count (the bulk, integer counterpart of
+    :meth:`~sqlite.truetime.utc2dbtime_array`)
+
+    :param ns: UTC nanoseconds
+    :type ns: numpy.ndarray or pandas.Series of int64
+    :param table: leap-second table (see :meth:`~sqlite.truetime.get_leap_seconds`),
+        defaults to None (module default table)
+    :type table: dict, optional
+    :return: database time nanoseconds (NAT where no leap-second range applies)
+    :rtype: numpy.ndarray or pandas.Series (matches input)
+    """
+    table = LEAP_SECONDS if table is None else table
+    return _wrap_like(_shift_ns(ns, table['s_nominal'], table['e_nominal'],
+                                table['ls_count']), ns)
+
+
+def dbtime2utc_ns(ns, table=None):
+    """Shift database time nanoseconds to UTC epoch nanoseconds by subtracting the
+    applicable leap-second count (the bulk, integer counterpart of
+    :meth:`~sqlite.truetime.dbtime2utc_array`)
+
+    :param ns: database time nanoseconds
+    :type ns: numpy.ndarray or pandas.Series of int64
+    :param table: leap-second table (see :meth:`~sqlite.truetime.get_leap_seconds`),
+        defaults to None (module default table)
+    :type table: dict, optional
+    :return: UTC nanoseconds (NAT where no leap-second range applies, e.g., on a leap second)
+    :rtype: numpy.ndarray or pandas.Series (matches input)
+    """
+    table = LEAP_SECONDS if table is None else table
+    return _wrap_like(_shift_ns(ns, table['s_true'], table['e_true'], -table['ls_count']), ns)
@@ -16,62 +16,105 @@ purpose: This module contains simple methods for converting times between
     UTC TIME - (True Time) seconds since 1970-01-01T00:00:00Z with appropriate leap seconds. 
         This is the timestamp sequence used for more or less everything end users interact with
         for earthquake data (data from ComCat / data queried using ObsPy clients from IRIS/EarthScope)
+
+    LEAP SECONDS - boundaries are loaded from `sqlite/table_data/leap_seconds.csv` (the same data
+        used to populate the SQLite `leap_seconds` table) or from a connected database's
+        `leap_seconds` table (see :meth:`~.get_leap_seconds`).
+        :meth:`~.register_functions` exposes the conversions to SQLite queries as
+        `truetime_get_epoch` and `truetime_put_epoch`.
 """
 
+import math
+from bisect import bisect_right
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 from obspy import UTCDateTime
 
-# Current leap seconds corrections as of 10-29-2025
+# Single source of leap-second boundaries shared with the SQLite `leap_seconds` table
+LEAP_SECONDS_CSV = Path(__file__).parent.parent.parent/'sqlite'/'table_data'/'leap_seconds.csv'
+LEAP_SECONDS_COLUMNS = ['s_nominal', 'e_nominal', 's_true', 'e_true', 'ls_count']
+
+
+def load_leap_seconds(source=LEAP_SECONDS_CSV):
+    """Load leap-second boundaries as compact, sorted int64 arrays
+
+    :param source: path to a CSV file with LEAP_SECONDS_COLUMNS or a database connection
+        with a populated `leap_seconds` table, defaults to LEAP_SECONDS_CSV
+    :type source: str, pathlib.Path, sqlite3.Connection, or psycopg2.extensions.connection
+    :return: arrays keyed by LEAP_SECONDS_COLUMNS, sorted by `s_nominal`. These mirror
+        the columns of the LEAP_SECONDS table
+    :rtype: dict of numpy.ndarray
+    """    
+    if isinstance(source, (str, Path)):
+        df = pd.read_csv(source)
+    else:
+        df = pd.read_sql(f"SELECT {', '.join(LEAP_SECONDS_COLUMNS)} FROM leap_seconds;", con=source)
+    df.columns = [_c.lower() for _c in df.columns]
+    df = df[LEAP_SECONDS_COLUMNS].sort_values('s_nominal')
+    return {_c: df[_c].to_numpy(dtype=np.int64) for _c in LEAP_SECONDS_COLUMNS}
+
+
+def get_leap_seconds(conn=None):
+    """Get the leap-second table of a database connection, falling back to
+    LEAP_SECONDS_CSV if the connected database has no (populated) `leap_seconds` table
+
+    Tables are not cached here, so no reference to **conn** is kept. Callers that convert
+    repeatedly hold on to the returned table (as :meth:`~.register_functions` does).
+
+    :param conn: database connection, defaults to None (module default table,
+        loaded from LEAP_SECONDS_CSV)
+    :type conn: sqlite3.Connection or psycopg2.extensions.connection, optional
+    :return: leap-second table (see :meth:`~.load_leap_seconds`)
+    :rtype: dict of numpy.ndarray
+    """    
+    if conn is None:
+        return LEAP_SECONDS
+    try:
+        table = load_leap_seconds(conn)
+    except pd.errors.DatabaseError:
+        return LEAP_SECONDS
+    if len(table['ls_count']) == 0:
+        return LEAP_SECONDS
+    return table
+
+
+LEAP_SECONDS = load_leap_seconds()
+
+# Sorted boundary arrays of the default table for vectorized (binary search) lookups
+LS_COUNT = LEAP_SECONDS['ls_count']
+S_NOMINAL = LEAP_SECONDS['s_nominal']
+E_NOMINAL = LEAP_SECONDS['e_nominal']
+S_TRUE = LEAP_SECONDS['s_true']
+E_TRUE = LEAP_SECONDS['e_true']
+
+# Leap-second ranges of the default table
 # Structure is:
 #   key: leap second amount
 #   value: [first NOMINAL second this adjustment applies to,
 #           last NOMINAL second that this adjustment applies to]
-NOMRANGES = {
-    0:[-62135596800,78796799],
-    1:[78796800,94694399],
-    2:[94694400,126230399],
-    3:[126230400,157766399],
-    4:[157766400,189302399],
-    5:[189302400,220924799],
-    6:[220924800,252460799],
-    7:[252460800,283996799],
-    8:[283996800,315532799],
-    9:[315532800,362793599],
-    10:[362793600,394329599],
-    11:[394329600,425865599],
-    12:[425865600,489023999],
-    13:[489024000,567993599],
-    14:[567993600,631151999],
-    15:[631152000,662687999],
-    16:[662688000,709948799],
-    17:[709948800,741484799],
-    18:[741484800,773020799],
-    19:[773020800,820454399],
-    20:[820454400,867715199],
-    21:[867715200,915148799],
-    22:[915148800,1136073599],
-    23:[1136073600,1230767999],
-    24:[1230768000,1341100799],
-    25:[1341100800,1435708799],
-    26:[1435708800,1483228799],
-    27:[1483228800,32503680000]}
+NOMRANGES = {int(_l): [int(_s), int(_e)] for _l, _s, _e in zip(LS_COUNT, S_NOMINAL, E_NOMINAL)}
 
 
 def dbtime2utc(dbtime):
     """Convert from database time to UTC time
 
+    Returns None for values that fall on a leap second or outside the
+    leap-second table. See :meth:`~.dbtime2utc_array` for array inputs.
+
     :param dbtime: database `datetime` values
     :type dbtime: float
     :return: utc
     :rtype: float
     """    
-    for _l, (_m, _M) in NOMRANGES.items():
-        if _m <= dbtime <= _M:
-            utc = dbtime - _l
-            return utc
+    utc = dbtime2utc_array(float(dbtime))
+    if np.isfinite(utc):
+        return float(utc)
 
 def utc2dbtime(utc):
     """Convert to database time from UTC timestamp (includes leap-second)
+    See :meth:`~.utc2dbtime_array` for array inputs.
 
     :param utc: UTC seconds since 1970-01-01 00:00:00Z
     :type utc: float
@@ -84,10 +127,9 @@ def utc2dbtime(utc):
         _utc = utc.timestamp()
     else:
         _utc = float(utc)
-    for _l, (_m, _M) in NOMRANGES.items():
-        if _m <= _utc - _l <= _M:
-            dbtime = _utc + _l
-            return dbtime
+    dbtime = utc2dbtime_array(_utc)
+    if np.isfinite(dbtime):
+        return float(dbtime)
 
 def dbtime2timestamp(dbtime, format='obspy'):
     """Convert from database `datetime` values into a UTCDateTime timestamp
@@ -108,4 +150,208 @@ def dbtime2timestamp(dbtime, format='obspy'):
     elif format == 'pandas':
         return pd.Timestamp(utc, unit='s')
     else:
-        raise ValueError(f'format "{format}" not supported. Only "obspy" and "pandas"')
\ No newline at end of file
+        raise ValueError(f'format "{format}" not supported. Only "obspy" and "pandas"')
+
+
+def as_seconds(values):
+    """Cast scalar, array-like, or pandas.Series inputs into a float64 array
+    of seconds since 1970-01-01T00:00:00, unpacking datetime-like inputs
+
+    :param values: input time values
+    :type values: float, int, numpy.ndarray, pandas.Series, or datetime64-like
+    :return: seconds
+    :rtype: numpy.ndarray
+    """    
+    if isinstance(values, pd.Series):
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        values = values.to_numpy()
+    elif isinstance(values, UTCDateTime):
+        values = values.timestamp
+    elif isinstance(values, pd.Timestamp):
+        values = values.to_datetime64()
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        _ns = arr.astype('datetime64[ns]')
+        _nat = np.isnat(_ns)
+        arr = _ns.astype(np.int64).astype(np.float64)/1e9
+        arr[_nat] = np.nan
+    return arr.astype(np.float64, copy=False)
+
+
+def _wrap_like(result, template):
+    """Return **result** in the same container type as **template**
+    (pandas.Series keep their index, scalars come back as scalars)
+    """    
+    if isinstance(template, pd.Series):
+        return pd.Series(result, index=template.index, name=template.name)
+    elif np.ndim(result) == 0:
+        return result[()]
+    else:
+        return result
+
+
+def _lookup_ls_count(seconds, starts, ends, counts=LS_COUNT):
+    """Find the leap-second count for each value in **seconds** by binary search
+    of the sorted range **starts** and **ends** arrays. Values are floored prior to
+    lookup, mirroring the `nominal2truef` and `true2nominalf` TrueTime stored procedures
+
+    :param seconds: seconds values
+    :type seconds: numpy.ndarray
+    :param starts: first integer second of each leap-second range
+    :type starts: numpy.ndarray
+    :param ends: last integer second of each leap-second range
+    :type ends: numpy.ndarray
+    :param counts: leap-second count of each range, defaults to LS_COUNT
+    :type counts: numpy.ndarray, optional
+    :return: leap-second counts with NaN where no range applies
+    :rtype: numpy.ndarray
+    """    
+    _floor = np.floor(seconds)
+    _idx = np.searchsorted(starts, _floor, side='right') - 1
+    _safe = np.clip(_idx, 0, len(starts) - 1)
+    # NaN inputs compare False and are flagged invalid here
+    valid = (_idx >= 0) & (_floor <= ends[_safe])
+    return np.where(valid, counts[_safe], np.nan)
+
+
+def dbtime2utc_array(dbtime, table=None):
+    """Vectorized conversion from database time to UTC time
+
+    Values that fall outside the leap-second table, or on a leap second itself,
+    are returned as NaN
+
+    :param dbtime: database `datetime` values
+    :type dbtime: float, numpy.ndarray, or pandas.Series
+    :param table: leap-second table (see :meth:`~.get_leap_seconds`), defaults to None
+        (module default table)
+    :type table: dict, optional
+    :return: utc
+    :rtype: float, numpy.ndarray, or pandas.Series (matches input)
+    """    
+    table = LEAP_SECONDS if table is None else table
+    _dbt = as_seconds(dbtime)
+    utc = _dbt - _lookup_ls_count(_dbt, table['s_true'], table['e_true'], table['ls_count'])
+    return _wrap_like(utc, dbtime)
+
+
+def utc2dbtime_array(utc, table=None):
+    """Vectorized conversion to database time from UTC timestamps
+
+    Accepts epoch seconds or datetime-like values (numpy.datetime64, pandas.Timestamp,
+    datetime64-typed pandas.Series, obspy.UTCDateTime)
+
+    :param utc: UTC seconds since 1970-01-01 00:00:00Z
+    :type utc: float, numpy.ndarray, or pandas.Series
+    :param table: leap-second table (see :meth:`~.get_leap_seconds`), defaults to None
+        (module default table)
+    :type table: dict, optional
+    :return: dbtime
+    :rtype: float, numpy.ndarray, or pandas.Series (matches input)
+    """    
+    table = LEAP_SECONDS if table is None else table
+    _utc = as_seconds(utc)
+    dbtime = _utc + _lookup_ls_count(_utc, table['s_nominal'], table['e_nominal'], table['ls_count'])
+    return _wrap_like(dbtime, utc)
+
+
+def seconds2datetime64(seconds):
+    """Convert epoch seconds into datetime64[ns] values without passing
+    through per-element Python objects. Whole and fractional seconds are
+    scaled separately to retain sub-microsecond precision.
+
+    :param seconds: seconds since 1970-01-01T00:00:00
+    :type seconds: float, numpy.ndarray, or pandas.Series
+    :return: timestamps (NaN values become NaT)
+    :rtype: numpy.datetime64, numpy.ndarray, or pandas.Series (matches input)
+    """    
+    _sec = as_seconds(seconds)
+    _nan = ~np.isfinite(_sec)
+    _sec = np.where(_nan, 0., _sec)
+    _whole = np.floor(_sec)
+    _ns = _whole.astype(np.int64)*1_000_000_000 + np.round((_sec - _whole)*1e9).astype(np.int64)
+    out = np.where(_nan, np.datetime64('NaT', 'ns'), _ns.astype('datetime64[ns]'))
+    return _wrap_like(out, seconds)
+
+
+def dbtime2datetime64(dbtime, table=None):
+    """Vectorized conversion from database `datetime` values into
+    UTC datetime64[ns] timestamps
+
+    :param dbtime: database `datetime` values
+    :type dbtime: float, numpy.ndarray, or pandas.Series
+    :param table: leap-second table (see :meth:`~.get_leap_seconds`), defaults to None
+        (module default table)
+    :type table: dict, optional
+    :return: UTC timestamps (NaT where no leap-second range applies)
+    :rtype: numpy.datetime64, numpy.ndarray, or pandas.Series (matches input)
+    """    
+    return seconds2datetime64(dbtime2utc_array(dbtime, table=table))
+
+
+def _scalar_ls_count(seconds, starts, ends, counts):
+    """Scalar counterpart of :meth:`~._lookup_ls_count` on Python lists, used by the
+    SQLite user-defined functions where per-row numpy overhead would dominate
+    """    
+    if seconds is None:
+        return None
+    _floor = math.floor(seconds)
+    _idx = bisect_right(starts, _floor) - 1
+    if _idx < 0 or _floor > ends[_idx]:
+        return None
+    return counts[_idx]
+
+
+def register_functions(conn_lite, table=None, is_true=True):
+    """Register TrueTime conversions as deterministic SQLite user-defined functions
+    so that conversions can run inside queries (e.g., in `WHERE` clauses):
+
+     - truetime_get_epoch(datetime, base) ~ `TrueTime.getEpoch(datetime, base)`
+     - truetime_put_epoch(t, base) ~ `TrueTime.putEpoch(t, base)`
+
+    Valid `base` values are ('UTC', 'TRUE') and ('POSIX', 'UNIX', 'NOMINAL'), in any case.
+    Values on a leap second or outside the leap-second table return NULL.
+
+    Example:
+    >>> register_functions(conn)
+    >>> conn.execute("SELECT orid FROM origin WHERE truetime_get_epoch(datetime, 'UNIX') > ?;", (1.3e9,))
+
+    :param conn_lite: SQLite connection
+    :type conn_lite: sqlite3.Connection
+    :param table: leap-second table, defaults to None (loaded once from **conn_lite**,
+        see :meth:`~.get_leap_seconds`, and held only by the registered functions)
+    :type table: dict, optional
+    :param is_true: is the database timebase TRUE? Defaults to True
+    :type is_true: bool, optional
+    """    
+    table = get_leap_seconds(conn_lite) if table is None else table
+    counts = table['ls_count'].tolist()
+    nominal = (table['s_nominal'].tolist(), table['e_nominal'].tolist(), counts)
+    true = (table['s_true'].tolist(), table['e_true'].tolist(), counts)
+
+    def _true2nominal(t):
+        _ls = _scalar_ls_count(t, *true)
+        return None if _ls is None else t - _ls
+
+    def _nominal2true(t):
+        _ls = _scalar_ls_count(t, *nominal)
+        return None if _ls is None else t + _ls
+
+    def _get_epoch(t, base):
+        _base = str(base).upper()
+        if _base in ('TRUE', 'UTC'):
+            return t if is_true else _nominal2true(t)
+        elif _base in ('NOMINAL', 'UNIX', 'POSIX'):
+            return _true2nominal(t) if is_true else t
+        return t
+
+    def _put_epoch(t, base):
+        _base = str(base).upper()
+        if _base in ('TRUE', 'UTC'):
+            return t if is_true else _true2nominal(t)
+        elif _base in ('NOMINAL', 'UNIX', 'POSIX'):
+            return _nominal2true(t) if is_true else t
+        return t
+
+    conn_lite.create_function('truetime_get_epoch', 2, _get_epoch, deterministic=True)
+    conn_lite.create_function('truetime_put_epoch', 2, _put_epoch, deterministic=True)
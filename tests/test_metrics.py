@@ -0,0 +1,29 @@
+"""
+module: tests.test_metrics
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: Regression tests for stage profiling in :mod:`~sqlite.metrics`
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent/'src'))
+from sqlite.metrics import reset, set_profiler, stage
+
+
+def test_profile_per_call(tmp_path):
+    reset()
+    set_profiler('cprofile', outdir=tmp_path)
+    try:
+        for _ in range(3):
+            with stage('copy.arrival'):
+                pass
+        with stage('load.1'):
+            pass
+    finally:
+        set_profiler(None)
+        reset()
+    assert sorted(_f.name for _f in tmp_path.iterdir()) == [
+        'copy.arrival.1.prof', 'copy.arrival.2.prof', 'copy.arrival.3.prof', 'load.1.1.prof']
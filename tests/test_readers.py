@@ -0,0 +1,34 @@
+"""
+module: tests.test_readers
+auth: Nathan T. Stevens
+org: PNSN
+license: CC-1.0
+purpose: Regression tests for :meth:`~sqlite.readers.iter_csv_chunks`
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent/'src'))
+from sqlite.readers import iter_csv_chunks
+
+
+@pytest.fixture
+def repeated_csv(tmp_path):
+    path = tmp_path/'picks.csv'
+    pd.DataFrame({'sta': list('ABABABAB') + ['C', 'D'],
+                  'time': [1, 2, 1, 2, 1, 2, 1, 2, 3, 4]}).to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 3, 4, 20])
+def test_all_duplicate_chunks(repeated_csv, chunksize):
+    # Chunks made up entirely of rows already seen must not break later chunks
+    chunks = list(iter_csv_chunks(repeated_csv, chunksize=chunksize))
+    got = pd.concat(chunks)
+    expected = pd.read_csv(repeated_csv).drop_duplicates(keep='first')
+    pd.testing.assert_frame_equal(got, expected)
+    assert all(len(_c) > 0 for _c in chunks)